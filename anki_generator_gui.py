@@ -1,24 +1,34 @@
+import time
+_module_started = time.perf_counter()  # Marks process start for the startup-time check; keep it first
 import sys
-import genanki
 import re
 import os
 import random
 import math  # Added for the calculation
 import hashlib
-import pykakasi
+import json
+import argparse
+import io
+import functools
+import heapq
+import itertools
+import threading
 from PyQt6.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QHBoxLayout, QPushButton,
     QLineEdit, QLabel, QFileDialog, QTextEdit, QSizePolicy, QTabWidget,
-    QTabBar, QComboBox, QStackedWidget, QFrame
+    QTabBar, QComboBox, QStackedWidget, QFrame, QProgressBar, QPlainTextEdit,
+    QCheckBox, QSpinBox
 )
 from PyQt6.QtGui import (
-    QFontDatabase, QIcon, QFont, QColor, QDesktopServices
+    QFontDatabase, QIcon, QFont, QColor, QDesktopServices, QTextFormat, QTextCursor
 )
-from PyQt6.QtCore import Qt, QTimer, QSettings, QStandardPaths, pyqtSignal, QUrl
+from PyQt6.QtCore import Qt, QTimer, QSettings, QStandardPaths, pyqtSignal, QUrl, QThread, QObject, QEvent
 
 # --- GLOBAL CONFIGURATION ---
 DEBUG = False  # Set to True for development, False for final release
+PROFILE_GENERATION = False  # Set to True to write a cProfile .pstats file for every generated deck
 PROMPTS_DIR = "Prompts"  # Subfolder for LLM prompts
+STARTUP_BUDGET_MS = 1500  # Cold start budget checked by the 'startup-time' command, up to the first paint
 # ADD THESE FOR QSETTINGS
 ORGANIZATION_NAME = "PrismaQuaestionum"
 APPLICATION_NAME = "PQ_Generator"
@@ -30,6 +40,7 @@ MODEL_ID = 1719000001
 QUAESTIONUM_FIELDS = ["Question", "Answer", "ClozeAnswer", "SVGImage", "SharedUtils"]
 QUAESTIONUM_MODEL_FIELDS = [{'name': f} for f in QUAESTIONUM_FIELDS]
 ICON_FILE = "icon.ico"
+FONT_FILES = []  # Bundled fonts, loaded by the GUI and packaged into every deck
 
 
 # --- ARTISTIC CONFIGURATION ---
@@ -38,6 +49,7 @@ IMAGE_SIZE = 1000
 BACKGROUND_COLOR = "#E0DACE"  # A cleaner, warmer bone-white vellum
 COLOR_PALETTE = ['#E73F5E', '#165C8E', '#6B8C4F', '#F8C3CD', '#E4A32E']
 STROKE_WIDTH = 6  # The visual element we must account for
+STROKE_COLOR = '#1a1a1a'
 JITTER_AMOUNT = IMAGE_SIZE * 0.05 # --- NEW: Max offset for positional jitter (5% of image size) ---
 MIN_SEPARATION_GAP = 25  # --- NEW: Min distance between separate shapes ---
 MIN_OVERLAP_DEPTH = 30   # --- NEW: Min overlap for it to look intentional ---
@@ -57,6 +69,125 @@ HARMONIC_REGIONS = {
 BASE_SHAPE_SIZE = IMAGE_SIZE * 0.3
 SIZE_VARIATION = IMAGE_SIZE * 0.15
 
+# Art engine options. 'geometry' selects how rotated shape gaps are measured:
+# 'sampled' is the reference pure-Python perimeter sampling, 'numpy' computes the
+# same samples for every pair at once with array operations, and 'exact' solves
+# the true gap or penetration depth analytically. 'numpy' is opt-in: with two to
+# five shapes per image its per-call overhead makes it slower than 'sampled'.
+# 'composition' selects 'legacy', which re-checks every relationship after each
+# placement, or 'incremental', which only re-checks relationships whose shapes changed.
+# 'svg' selects the serializer: 'legacy' writes full-precision numbers and stroke
+# attributes on every shape, 'compact' rounds numbers to 'svg_precision' decimals,
+# sets the stroke once on a group and drops the hidden term label.
+GEOMETRY_ENGINES = ['sampled', 'numpy', 'exact']
+COMPOSITION_MODES = ['legacy', 'incremental']
+SVG_FORMATS = ['legacy', 'compact']
+SVG_PRECISION_RANGE = range(0, 7)
+DEFAULT_ART_ENGINE = {'geometry': 'sampled', 'composition': 'legacy', 'svg': 'legacy', 'svg_precision': 1}
+
+
+# --- SHAPE REPRESENTATION ---
+class Shape:
+    """
+    A single element of a composition. Slotted, so the correction loops work on plain
+    attributes instead of per-shape dicts. The area, bounding radius and perimeter
+    offsets are computed on first use and dropped whenever the type, size or rotation
+    changes; moving a shape keeps them.
+    """
+    __slots__ = ('type', 'color', 'cx', 'cy', 'width', 'height', 'rotation',
+                 '_area', '_bounding_radius', '_perimeter_offsets')
+    SIZE_FIELDS = frozenset(('type', 'width', 'height', 'rotation'))
+
+    def __init__(self, shape_type, color, cx, cy, width, height, rotation=0):
+        self.type = shape_type
+        self.color = color
+        self.cx = cx
+        self.cy = cy
+        self.width = width
+        self.height = height
+        self.rotation = rotation
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in Shape.SIZE_FIELDS:
+            object.__setattr__(self, '_area', None)
+            object.__setattr__(self, '_bounding_radius', None)
+            object.__setattr__(self, '_perimeter_offsets', None)
+
+    def __repr__(self):
+        return (f"Shape({self.type!r}, {self.color!r}, cx={self.cx}, cy={self.cy}, "
+                f"width={self.width}, height={self.height}, rotation={self.rotation})")
+
+    @property
+    def area(self):
+        if self._area is None:
+            if self.type == 'circle':
+                self._area = math.pi * (self.width / 2) ** 2
+            elif self.type == 'rectangle':
+                self._area = self.width * self.height
+            else:
+                self._area = 0
+        return self._area
+
+    @property
+    def bounding_radius(self):
+        """The radius of a circle that would enclose the entire shape."""
+        if self._bounding_radius is None:
+            if self.type == 'circle':
+                self._bounding_radius = self.width / 2
+            elif self.type == 'rectangle':
+                # The furthest point on a rectangle is its corner.
+                # We use the Pythagorean theorem to find the distance from the center to a corner.
+                self._bounding_radius = math.hypot(self.width / 2, self.height / 2)
+            else:
+                self._bounding_radius = 0
+        return self._bounding_radius
+
+    def perimeter_points(self):
+        """
+        Perimeter samples for the gap calculation: 24 points around a circle, or the four
+        corners followed by three points along each edge of a (rotated) rectangle.
+        """
+        if self._perimeter_offsets is None:
+            self._perimeter_offsets = self._compute_perimeter_offsets()
+        cx, cy = self.cx, self.cy
+        return [(px + cx, py + cy) for px, py in self._perimeter_offsets]
+
+    def corners(self):
+        """The four corners of a rectangle, in drawing order."""
+        return self.perimeter_points()[:4]
+
+    def _compute_perimeter_offsets(self):
+        w, h = self.width, self.height
+        if self.type == 'circle':
+            # For circles, we sample points on the circumference
+            num_samples = 24  # A good number for circles
+            offsets = []
+            for i in range(num_samples):
+                angle = 2 * math.pi * i / num_samples
+                offsets.append(((w / 2) * math.cos(angle), (w / 2) * math.sin(angle)))
+            return offsets
+
+        # For rectangles, sample the four corners (most important) and edges
+        half_w, half_h = w / 2, h / 2
+        corners = [(-half_w, -half_h), (half_w, -half_h), (half_w, half_h), (-half_w, half_h)]
+        edge_points = []
+        for i in range(4):
+            p1 = corners[i]
+            p2 = corners[(i + 1) % 4]
+            # Add a few points between the corners
+            for t in [0.25, 0.5, 0.75]:
+                edge_points.append((p1[0] * (1 - t) + p2[0] * t, p1[1] * (1 - t) + p2[1] * t))
+
+        local_points = corners + edge_points
+
+        angle = math.radians(self.rotation)
+        if angle == 0:
+            return local_points
+
+        cos_a, sin_a = math.cos(angle), math.sin(angle)
+        return [(px * cos_a - py * sin_a, px * sin_a + py * cos_a) for px, py in local_points]
+
 
 # --- UTILITY AND DEBUG FUNCTIONS ---
 
@@ -65,44 +196,47 @@ def get_precise_gap(shape1, shape2):
     Calculates the true, geometric gap between the fills of any two shapes.
     A negative value indicates the depth of penetration (overlap).
     """
-    if shape1['type'] == 'rectangle' and shape2['type'] == 'rectangle':
-        overlap_x = (shape1['width'] / 2 + shape2['width'] / 2) - abs(shape1['cx'] - shape2['cx'])
-        overlap_y = (shape1['height'] / 2 + shape2['height'] / 2) - abs(shape1['cy'] - shape2['cy'])
+    if shape1.type == 'rectangle' and shape2.type == 'rectangle':
+        overlap_x = (shape1.width / 2 + shape2.width / 2) - abs(shape1.cx - shape2.cx)
+        overlap_y = (shape1.height / 2 + shape2.height / 2) - abs(shape1.cy - shape2.cy)
         if overlap_x <= 0 or overlap_y <= 0:
-            dx = max(0, abs(shape1['cx'] - shape2['cx']) - (shape1['width'] / 2 + shape2['width'] / 2))
-            dy = max(0, abs(shape1['cy'] - shape2['cy']) - (shape1['height'] / 2 + shape2['height'] / 2))
+            dx = max(0, abs(shape1.cx - shape2.cx) - (shape1.width / 2 + shape2.width / 2))
+            dy = max(0, abs(shape1.cy - shape2.cy) - (shape1.height / 2 + shape2.height / 2))
             return math.hypot(dx, dy)
         else:
             return -min(overlap_x, overlap_y)
-    elif shape1['type'] == 'circle' and shape2['type'] == 'circle':
-        dist_centers = math.hypot(shape1['cx'] - shape2['cx'], shape1['cy'] - shape2['cy'])
-        return dist_centers - (shape1['width'] / 2 + shape2['width'] / 2)
+    elif shape1.type == 'circle' and shape2.type == 'circle':
+        dist_centers = math.hypot(shape1.cx - shape2.cx, shape1.cy - shape2.cy)
+        return dist_centers - (shape1.width / 2 + shape2.width / 2)
     else:
-        circle, rect = (shape1, shape2) if shape1['type'] == 'circle' else (shape2, shape1)
-        r_half_w, r_half_h = rect['width'] / 2, rect['height'] / 2
-        closest_x = max(rect['cx'] - r_half_w, min(circle['cx'], rect['cx'] + r_half_w))
-        closest_y = max(rect['cy'] - r_half_h, min(circle['cy'], rect['cy'] + r_half_h))
-        dist = math.hypot(circle['cx'] - closest_x, circle['cy'] - closest_y)
-        return dist - (circle['width'] / 2)
+        circle, rect = (shape1, shape2) if shape1.type == 'circle' else (shape2, shape1)
+        r_half_w, r_half_h = rect.width / 2, rect.height / 2
+        closest_x = max(rect.cx - r_half_w, min(circle.cx, rect.cx + r_half_w))
+        closest_y = max(rect.cy - r_half_h, min(circle.cy, rect.cy + r_half_h))
+        dist = math.hypot(circle.cx - closest_x, circle.cy - closest_y)
+        return dist - (circle.width / 2)
+
+
+def get_point_gap(px, py, shape):
+    """
+    Calculates the gap between a point and the fill of a shape (negative inside circles).
+    Equivalent to get_precise_gap with a zero-size circle, without building one.
+    """
+    if shape.type == 'circle':
+        return math.hypot(px - shape.cx, py - shape.cy) - shape.width / 2
+    r_half_w, r_half_h = shape.width / 2, shape.height / 2
+    closest_x = max(shape.cx - r_half_w, min(px, shape.cx + r_half_w))
+    closest_y = max(shape.cy - r_half_h, min(py, shape.cy + r_half_h))
+    return math.hypot(px - closest_x, py - closest_y)
 
 
 def get_shape_area(shape):
     """Calculates the area of a shape."""
-    if shape['type'] == 'circle':
-        return math.pi * (shape['width'] / 2) ** 2
-    elif shape['type'] == 'rectangle':
-        return shape['width'] * shape['height']
-    return 0
+    return shape.area
 
 def get_bounding_radius(shape):
     """Calculates the radius of a circle that would enclose the entire shape."""
-    if shape['type'] == 'circle':
-        return shape['width'] / 2
-    elif shape['type'] == 'rectangle':
-        # The furthest point on a rectangle is its corner.
-        # We use the Pythagorean theorem to find the distance from the center to a corner.
-        return math.hypot(shape['width'] / 2, shape['height'] / 2)
-    return 0
+    return shape.bounding_radius
 
 
 def enforce_shape_boundary(shape, buffer=20):
@@ -114,27 +248,70 @@ def enforce_shape_boundary(shape, buffer=20):
     radius = get_bounding_radius(shape)
 
     # Clamp the center position based on this radius.
-    shape['cx'] = max(shape['cx'], radius + buffer)
-    shape['cx'] = min(shape['cx'], IMAGE_SIZE - radius - buffer)
-    shape['cy'] = max(shape['cy'], radius + buffer)
-    shape['cy'] = min(shape['cy'], IMAGE_SIZE - radius - buffer)
+    shape.cx = max(shape.cx, radius + buffer)
+    shape.cx = min(shape.cx, IMAGE_SIZE - radius - buffer)
+    shape.cy = max(shape.cy, radius + buffer)
+    shape.cy = min(shape.cy, IMAGE_SIZE - radius - buffer)
+
+# --- INCREMENTAL COMPOSITION TRACKING ---
+def get_shape_signature(shape):
+    """The geometric state of a shape; any change to it makes its relationships dirty."""
+    return (shape.type, shape.cx, shape.cy, shape.width, shape.height, shape.rotation)
 
-def transform_deeply_overlapping_rects_to_circles(composition_plan, rng):
+
+class CompositionTracker:
+    """
+    Remembers which shape relationships were last found to need no correction, and
+    the exact geometry they had at the time. The correction phases ask it whether a
+    check can be skipped: in incremental mode that is the case while none of the
+    shapes involved has moved, been resized or been transformed since. The legacy
+    mode never skips, but both modes count the pair evaluations.
+    """
+
+    def __init__(self, incremental=False):
+        self.incremental = incremental
+        self.settled = {}
+        self.pair_evaluations = 0
+        self.pair_evaluations_saved = 0
+
+    def is_settled(self, key, *shapes):
+        """Returns True if the check for these shapes can be skipped."""
+        is_pair = len(shapes) == 2
+        if self.incremental and self.settled.get(key) == tuple(map(get_shape_signature, shapes)):
+            if is_pair:
+                self.pair_evaluations_saved += 1
+            return True
+        if is_pair:
+            self.pair_evaluations += 1
+        return False
+
+    def settle(self, key, *shapes):
+        """Records that the check found nothing to correct for the shapes as they are now."""
+        if self.incremental:
+            self.settled[key] = tuple(map(get_shape_signature, shapes))
+
+
+def transform_deeply_overlapping_rects_to_circles(composition_plan, rng, tracker=None):
     """Transforms heavily obscured rectangles into circles of the same area."""
     # print(f"\n{'=' * 10} CIRCLE TRANSFORMATION PHASE {'=' * 10}")
     OVERLAP_THRESHOLD = 0.75
     transformed_indices = set()
     for i, smaller_shape in enumerate(composition_plan):
-        if i in transformed_indices or smaller_shape['type'] != 'rectangle': continue
+        if i in transformed_indices or smaller_shape.type != 'rectangle': continue
         for j, larger_shape in enumerate(composition_plan):
-            if i == j or j in transformed_indices or larger_shape['type'] != 'rectangle': continue
-            area_smaller = smaller_shape['width'] * smaller_shape['height']
+            if i == j or j in transformed_indices or larger_shape.type != 'rectangle': continue
+            if tracker:
+                if tracker.is_settled(('transform', i, j), smaller_shape, larger_shape): continue
+                # The outcome only depends on this pair, and a transformation changes the
+                # smaller shape, so the record goes stale exactly when it should.
+                tracker.settle(('transform', i, j), smaller_shape, larger_shape)
+            area_smaller = smaller_shape.width * smaller_shape.height
             if area_smaller >= get_shape_area(larger_shape): continue
 
-            s_x1, s_x2 = smaller_shape['cx'] - smaller_shape['width'] / 2, smaller_shape['cx'] + smaller_shape['width'] / 2
-            s_y1, s_y2 = smaller_shape['cy'] - smaller_shape['height'] / 2, smaller_shape['cy'] + smaller_shape['height'] / 2
-            l_x1, l_x2 = larger_shape['cx'] - larger_shape['width'] / 2, larger_shape['cx'] + larger_shape['width'] / 2
-            l_y1, l_y2 = larger_shape['cy'] - larger_shape['height'] / 2, larger_shape['cy'] + larger_shape['height'] / 2
+            s_x1, s_x2 = smaller_shape.cx - smaller_shape.width / 2, smaller_shape.cx + smaller_shape.width / 2
+            s_y1, s_y2 = smaller_shape.cy - smaller_shape.height / 2, smaller_shape.cy + smaller_shape.height / 2
+            l_x1, l_x2 = larger_shape.cx - larger_shape.width / 2, larger_shape.cx + larger_shape.width / 2
+            l_y1, l_y2 = larger_shape.cy - larger_shape.height / 2, larger_shape.cy + larger_shape.height / 2
 
             overlap_w = max(0, min(s_x2, l_x2) - max(s_x1, l_x1))
             overlap_h = max(0, min(s_y2, l_y2) - max(s_y1, l_y1))
@@ -145,29 +322,33 @@ def transform_deeply_overlapping_rects_to_circles(composition_plan, rng):
                 if overlap_ratio > OVERLAP_THRESHOLD:
                     new_radius = math.sqrt(area_smaller / math.pi)
                     buffer = STROKE_WIDTH / 2 + 10
-                    cx, cy = smaller_shape['cx'], smaller_shape['cy']
+                    cx, cy = smaller_shape.cx, smaller_shape.cy
 
                     if (cx - new_radius > buffer and cx + new_radius < IMAGE_SIZE - buffer and
                             cy - new_radius > buffer and cy + new_radius < IMAGE_SIZE - buffer):
                         # print(f"    TRANSFORMING RECTANGLE {i} TO CIRCLE.")
-                        smaller_shape['type'] = 'circle'
-                        smaller_shape['width'] = smaller_shape['height'] = new_radius * 2
-                        available_colors = [c for c in COLOR_PALETTE if c != larger_shape['color']]
+                        smaller_shape.type = 'circle'
+                        smaller_shape.width = smaller_shape.height = new_radius * 2
+                        available_colors = [c for c in COLOR_PALETTE if c != larger_shape.color]
                         if not available_colors: available_colors = COLOR_PALETTE
-                        smaller_shape['color'] = rng.choice(available_colors)
+                        smaller_shape.color = rng.choice(available_colors)
                         transformed_indices.add(i)
                         break
                     # else: print(f"Overlap detected, but resulting circle would be out of bounds. Skipping.")
 
 
-def surgically_correct_composition(composition_plan):
+def surgically_correct_composition(composition_plan, tracker=None):
     VISUAL_CONFLICT_THRESHOLD, DEEP_OVERLAP_THRESHOLD = 15, 30
     # print(f"\n{'=' * 10} SURGICAL CORRECTION PHASE {'=' * 10}")
     for i, shape_to_check in enumerate(composition_plan):
-        if i == 0 or shape_to_check['type'] != 'rectangle' or shape_to_check['height'] <= shape_to_check['width']: continue
+        if i == 0 or shape_to_check.type != 'rectangle' or shape_to_check.height <= shape_to_check.width: continue
         # print(f"\n--- Checking vertical rectangle (Shape {i}) ---")
         for j, other_shape in enumerate(composition_plan):
             if i == j: continue
+            if tracker:
+                if tracker.is_settled(('surgical', i, j), shape_to_check, other_shape): continue
+                # A flip changes the rectangle's dimensions, which invalidates this record.
+                tracker.settle(('surgical', i, j), shape_to_check, other_shape)
             fill_gap = get_precise_gap(shape_to_check, other_shape)
             visual_gap = fill_gap - STROKE_WIDTH
             # print(f"  - vs Shape {j}: Fill Gap = {fill_gap:.2f}, Visual Gap = {visual_gap:.2f}")
@@ -176,7 +357,7 @@ def surgically_correct_composition(composition_plan):
             if is_too_close and not is_deep_overlap:
                 # print(f"CONFLICT DETECTED! Visual gap ({visual_gap:.2f}) is below threshold ({VISUAL_CONFLICT_THRESHOLD}).")
                 # print(f"FLIPPING RECTANGLE {i}.")
-                shape_to_check['width'], shape_to_check['height'] = shape_to_check['height'], shape_to_check['width']
+                shape_to_check.width, shape_to_check.height = shape_to_check.height, shape_to_check.width
                 break
             # else: print(f"Relationship is OK.") print(f"{'=' * 37}\n")
 
@@ -188,12 +369,15 @@ def is_shape_out_of_bounds(shape, buffer=20):
     Checks if any part of a shape extends beyond the canvas buffer,
     accounting for its bounding radius to handle rotation correctly.
     """
-    radius = get_bounding_radius(shape)
+    return is_position_out_of_bounds(shape.cx, shape.cy, get_bounding_radius(shape), buffer)
+
 
-    if (shape['cx'] - radius < buffer or
-            shape['cx'] + radius > IMAGE_SIZE - buffer or
-            shape['cy'] - radius < buffer or
-            shape['cy'] + radius > IMAGE_SIZE - buffer):
+def is_position_out_of_bounds(cx, cy, radius, buffer=20):
+    """Checks if a shape with the given bounding radius would cross the canvas buffer at (cx, cy)."""
+    if (cx - radius < buffer or
+            cx + radius > IMAGE_SIZE - buffer or
+            cy - radius < buffer or
+            cy + radius > IMAGE_SIZE - buffer):
         return True
     return False
 
@@ -212,12 +396,10 @@ def find_emptiest_location(shape_to_place, other_shapes):
     max_min_distance = -1
 
     for (cx, cy) in candidate_points:
-        point_shape = {'type': 'circle', 'cx': cx, 'cy': cy, 'width': 0, 'height': 0}
-
         if not other_shapes:
             min_dist_to_neighbor = float('inf')
         else:
-            min_dist_to_neighbor = min(get_precise_gap(point_shape, other) for other in other_shapes)
+            min_dist_to_neighbor = min(get_point_gap(cx, cy, other) for other in other_shapes)
 
         if min_dist_to_neighbor > max_min_distance:
             max_min_distance = min_dist_to_neighbor
@@ -226,29 +408,33 @@ def find_emptiest_location(shape_to_place, other_shapes):
     return best_location or (IMAGE_SIZE / 2, IMAGE_SIZE / 2)
 
 
-def perform_final_composition_polish(composition_plan):
+def perform_final_composition_polish(composition_plan, tracker=None):
     """
     Final check to find any shapes pushed out of bounds, shrink them slightly,
     and move them to the emptiest available harmonic zone.
     """
     for i, shape in enumerate(composition_plan):
+        if tracker and tracker.is_settled(('polish', i), shape):
+            continue
         if is_shape_out_of_bounds(shape):
             # If a shape is outside, shrink it proportionally to help it fit
-            shape['width'] *= 0.9
-            shape['height'] *= 0.9
+            shape.width *= 0.9
+            shape.height *= 0.9
 
             # Find all other shapes to avoid when relocating
             other_shapes = [s for j, s in enumerate(composition_plan) if i != j]
 
             # Find a new home for it in an uncluttered area
             new_cx, new_cy = find_emptiest_location(shape, other_shapes)
-            shape['cx'], shape['cy'] = new_cx, new_cy
+            shape.cx, shape.cy = new_cx, new_cy
 
             # After moving, one final clamp to guarantee it's within bounds
             enforce_shape_boundary(shape)
+        elif tracker:
+            tracker.settle(('polish', i), shape)
 
 
-def enforce_compositional_harmony(composition_plan):
+def enforce_compositional_harmony(composition_plan, geometry='sampled', tracker=None):
     """
     The master reviewer. Finds visually discordant shape relationships and resolves them by
     moving the smaller shape to a harmonious 'satellite' position around the larger one.
@@ -258,17 +444,25 @@ def enforce_compositional_harmony(composition_plan):
         return
 
     for _ in range(3):
-        pairs_to_check = [(composition_plan[i], composition_plan[j]) for i in range(len(composition_plan)) for j in
+        pairs_to_check = [(i, j) for i in range(len(composition_plan)) for j in
                           range(i + 1, len(composition_plan))]
+        # The vectorized engine measures every pair up front and re-measures after each move.
+        gap_matrix = get_pairwise_rotated_gaps(composition_plan) if geometry == 'numpy' else None
 
-        for shape1, shape2 in pairs_to_check:
+        for i, j in pairs_to_check:
+            shape1, shape2 = composition_plan[i], composition_plan[j]
+            if tracker and tracker.is_settled(('harmony', i, j), shape1, shape2):
+                continue
             area1, area2 = get_shape_area(shape1), get_shape_area(shape2)
             if area1 < area2:
                 offender, anchor = shape1, shape2
             else:
                 offender, anchor = shape2, shape1
 
-            gap = get_rotated_gap(offender, anchor)
+            if gap_matrix is not None:
+                gap = gap_matrix[i, j]
+            else:
+                gap = GEOMETRY_GAP_FUNCTIONS[geometry](offender, anchor)
 
             # --- SIMPLIFIED DISCORD DEFINITION ---
             # The new 'get_rotated_gap' is accurate enough to handle all cases with one rule.
@@ -276,6 +470,8 @@ def enforce_compositional_harmony(composition_plan):
             is_in_awkward_zone = (gap > -MIN_OVERLAP_DEPTH and gap < MIN_SEPARATION_GAP)
 
             if not is_in_awkward_zone:
+                if tracker:
+                    tracker.settle(('harmony', i, j), shape1, shape2)
                 continue  # This relationship is harmonious, do nothing
 
             # --- RESOLVE DISCORD (Logic is unchanged, but now acts on good data) ---
@@ -283,52 +479,57 @@ def enforce_compositional_harmony(composition_plan):
             sqrt2_offset = offset / math.sqrt(2)
 
             satellite_points = [
-                (anchor['cx'] + offset, anchor['cy']),
-                (anchor['cx'] + sqrt2_offset, anchor['cy'] - sqrt2_offset),
-                (anchor['cx'], anchor['cy'] - offset),
-                (anchor['cx'] - sqrt2_offset, anchor['cy'] - sqrt2_offset),
-                (anchor['cx'] - offset, anchor['cy']),
-                (anchor['cx'] - sqrt2_offset, anchor['cy'] + sqrt2_offset),
-                (anchor['cx'], anchor['cy'] + offset),
-                (anchor['cx'] + sqrt2_offset, anchor['cy'] + sqrt2_offset),
+                (anchor.cx + offset, anchor.cy),
+                (anchor.cx + sqrt2_offset, anchor.cy - sqrt2_offset),
+                (anchor.cx, anchor.cy - offset),
+                (anchor.cx - sqrt2_offset, anchor.cy - sqrt2_offset),
+                (anchor.cx - offset, anchor.cy),
+                (anchor.cx - sqrt2_offset, anchor.cy + sqrt2_offset),
+                (anchor.cx, anchor.cy + offset),
+                (anchor.cx + sqrt2_offset, anchor.cy + sqrt2_offset),
             ]
 
             other_shapes = [s for s in composition_plan if s is not offender and s is not anchor]
             best_point = None
             max_min_distance = -1
+            has_candidate = False
 
+            offender_radius = get_bounding_radius(offender)
             for cx, cy in satellite_points:
-                temp_shape_for_bounds_check = {'type': offender['type'], 'cx': cx, 'cy': cy, 'width': offender['width'],
-                                               'height': offender['height']}
-                if is_shape_out_of_bounds(temp_shape_for_bounds_check, buffer=30):
+                if is_position_out_of_bounds(cx, cy, offender_radius, buffer=30):
                     continue
+                has_candidate = True
 
-                point_shape = {'type': 'circle', 'cx': cx, 'cy': cy, 'width': 0, 'height': 0}
                 if not other_shapes:
                     min_dist_to_neighbor = float('inf')
                 else:
-                    min_dist_to_neighbor = min(get_precise_gap(point_shape, other) for other in other_shapes)
+                    min_dist_to_neighbor = min(get_point_gap(cx, cy, other) for other in other_shapes)
 
                 if min_dist_to_neighbor > max_min_distance:
                     max_min_distance = min_dist_to_neighbor
                     best_point = (cx, cy)
 
             if best_point:
-                offender['cx'], offender['cy'] = best_point
-                if offender['type'] == 'rectangle':
-                    offender['rotation'] = 0
+                offender.cx, offender.cy = best_point
+                if offender.type == 'rectangle':
+                    offender.rotation = 0
+                if gap_matrix is not None:
+                    gap_matrix = get_pairwise_rotated_gaps(composition_plan)
+            elif tracker and not has_candidate:
+                # No satellite fits on the canvas whatever the other shapes do.
+                tracker.settle(('harmony', i, j), shape1, shape2)
 
 
 def is_point_in_shape(px, py, shape):
     """Accurately checks if a point (px, py) is inside a given shape, accounting for rotation."""
-    cx, cy = shape['cx'], shape['cy']
+    cx, cy = shape.cx, shape.cy
 
-    if shape['type'] == 'circle':
-        return math.hypot(px - cx, py - cy) <= shape['width'] / 2
+    if shape.type == 'circle':
+        return math.hypot(px - cx, py - cy) <= shape.width / 2
 
-    elif shape['type'] == 'rectangle':
-        w, h = shape['width'], shape['height']
-        angle = math.radians(shape.get('rotation', 0))
+    elif shape.type == 'rectangle':
+        w, h = shape.width, shape.height
+        angle = math.radians(shape.rotation)
 
         # Translate the point so the shape's center is the origin
         translated_x = px - cx
@@ -352,44 +553,13 @@ def get_rotated_gap(shape1, shape2):
     separation and overlap by using a robust point-in-shape test.
     """
     # --- Phase 0: Quick exit for simple cases ---
-    if shape1['type'] == 'circle' and shape2['type'] == 'circle':
+    if shape1.type == 'circle' and shape2.type == 'circle':
         return get_precise_gap(shape1, shape2)
 
     # --- Phase 1: Perimeter Sampling ---
-    # We only need to generate perimeter points once.
-    def get_perimeter_points(shape):
-        points = []
-        cx, cy, w, h = shape['cx'], shape['cy'], shape['width'], shape['height']
-        if shape['type'] == 'circle':
-            # For circles, we sample points on the circumference
-            num_samples = 24  # A good number for circles
-            for i in range(num_samples):
-                angle = 2 * math.pi * i / num_samples
-                points.append((cx + (w / 2) * math.cos(angle), cy + (w / 2) * math.sin(angle)))
-            return points
-
-        # For rectangles, sample the four corners (most important) and edges
-        half_w, half_h = w / 2, h / 2
-        corners = [(-half_w, -half_h), (half_w, -half_h), (half_w, half_h), (-half_w, half_h)]
-        edge_points = []
-        for i in range(4):
-            p1 = corners[i]
-            p2 = corners[(i + 1) % 4]
-            # Add a few points between the corners
-            for t in [0.25, 0.5, 0.75]:
-                edge_points.append((p1[0] * (1 - t) + p2[0] * t, p1[1] * (1 - t) + p2[1] * t))
-
-        local_points = corners + edge_points
-
-        angle = math.radians(shape.get('rotation', 0))
-        if angle == 0:
-            return [(px + cx, py + cy) for px, py in local_points]
-
-        cos_a, sin_a = math.cos(angle), math.sin(angle)
-        return [(px * cos_a - py * sin_a + cx, px * sin_a + py * cos_a + cy) for px, py in local_points]
-
-    points1 = get_perimeter_points(shape1)
-    points2 = get_perimeter_points(shape2)
+    # Each shape caches its sample offsets, so only the translation is redone here.
+    points1 = shape1.perimeter_points()
+    points2 = shape2.perimeter_points()
 
     # --- Phase 2: Overlap Detection ---
     # Check if any point of one shape is inside the other
@@ -421,40 +591,395 @@ def get_rotated_gap(shape1, shape2):
     else:
         return distance
 
+# --- VECTORIZED GEOMETRY ENGINE (NumPy) ---
+CIRCLE_PERIMETER_SAMPLES = 24
+RECT_EDGE_SAMPLES = (0.25, 0.5, 0.75)
+np = None  # Optional: imported on first use of the 'numpy' geometry engine
+
+
+def import_numpy():
+    """Imports NumPy on first use, so startup never pays for it. Returns the module, or None if missing."""
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return None
+        np = numpy
+    return np
+
+
+def get_perimeter_sample_array(composition_plan):
+    """
+    Returns an (n, 24, 2) array holding the same perimeter samples get_rotated_gap uses.
+    Rectangles only have 16 samples, so their corners are repeated as padding; duplicate
+    samples change neither the minimum distance nor the overlap test.
+    """
+    count = len(composition_plan)
+    cx = np.array([shape.cx for shape in composition_plan], dtype=float)
+    cy = np.array([shape.cy for shape in composition_plan], dtype=float)
+    w = np.array([shape.width for shape in composition_plan], dtype=float)
+    h = np.array([shape.height for shape in composition_plan], dtype=float)
+    angle = np.radians([shape.rotation for shape in composition_plan])
+    is_circle = np.array([shape.type == 'circle' for shape in composition_plan])
+
+    # Rectangle outline in local coordinates: corners, then three points along each edge.
+    corner_signs = np.array([(-1, -1), (1, -1), (1, 1), (-1, 1)], dtype=float)
+    t = np.array(RECT_EDGE_SAMPLES)
+    next_signs = np.roll(corner_signs, -1, axis=0)
+    edge_signs = (corner_signs[:, None, :] * (1 - t)[None, :, None] +
+                  next_signs[:, None, :] * t[None, :, None]).reshape(-1, 2)
+    local_signs = np.concatenate([corner_signs, edge_signs])
+    padding = CIRCLE_PERIMETER_SAMPLES - len(local_signs)
+    local_signs = np.concatenate([local_signs, local_signs[:padding]])
+
+    local_x = local_signs[None, :, 0] * (w / 2)[:, None]
+    local_y = local_signs[None, :, 1] * (h / 2)[:, None]
+    cos_a, sin_a = np.cos(angle)[:, None], np.sin(angle)[:, None]
+    rect_x = local_x * cos_a - local_y * sin_a + cx[:, None]
+    rect_y = local_x * sin_a + local_y * cos_a + cy[:, None]
+
+    circle_angles = 2 * np.pi * np.arange(CIRCLE_PERIMETER_SAMPLES) / CIRCLE_PERIMETER_SAMPLES
+    circle_x = cx[:, None] + (w / 2)[:, None] * np.cos(circle_angles)[None, :]
+    circle_y = cy[:, None] + (w / 2)[:, None] * np.sin(circle_angles)[None, :]
+
+    samples = np.empty((count, CIRCLE_PERIMETER_SAMPLES, 2))
+    samples[..., 0] = np.where(is_circle[:, None], circle_x, rect_x)
+    samples[..., 1] = np.where(is_circle[:, None], circle_y, rect_y)
+    return samples
+
+
+def get_points_in_shapes_mask(samples, composition_plan):
+    """
+    Returns a boolean (n, n, k) array where [j, i, p] is True if sample p of
+    shape i lies inside shape j, mirroring is_point_in_shape.
+    """
+    cx = np.array([shape.cx for shape in composition_plan], dtype=float)[:, None, None]
+    cy = np.array([shape.cy for shape in composition_plan], dtype=float)[:, None, None]
+    w = np.array([shape.width for shape in composition_plan], dtype=float)[:, None, None]
+    h = np.array([shape.height for shape in composition_plan], dtype=float)[:, None, None]
+    angle = np.radians([shape.rotation for shape in composition_plan])[:, None, None]
+    is_circle = np.array([shape.type == 'circle' for shape in composition_plan])[:, None, None]
+
+    translated_x = samples[None, :, :, 0] - cx
+    translated_y = samples[None, :, :, 1] - cy
+    in_circle = np.hypot(translated_x, translated_y) <= w / 2
+
+    cos_a, sin_a = np.cos(-angle), np.sin(-angle)
+    rotated_x = translated_x * cos_a - translated_y * sin_a
+    rotated_y = translated_x * sin_a + translated_y * cos_a
+    in_rect = (np.abs(rotated_x) <= w / 2) & (np.abs(rotated_y) <= h / 2)
+
+    return np.where(is_circle, in_circle, in_rect)
+
+
+def get_pairwise_rotated_gaps(composition_plan):
+    """
+    Batched get_rotated_gap: returns a symmetric (n, n) array of the gap between
+    every pair of shapes. Negative values indicate overlap, as in get_rotated_gap.
+    """
+    import_numpy()  # Worker processes start without it
+    samples = get_perimeter_sample_array(composition_plan)
+
+    inside = get_points_in_shapes_mask(samples, composition_plan).any(axis=2)
+    is_overlapping = inside | inside.T
+
+    deltas = samples[:, None, :, None, :] - samples[None, :, None, :, :]
+    min_dist_sq = np.einsum('ijklm,ijklm->ijkl', deltas, deltas).min(axis=(2, 3))
+    distance = np.sqrt(min_dist_sq)
+    gaps = np.where(is_overlapping, -distance, distance)
+
+    # Circle pairs take the exact shortcut, exactly as get_rotated_gap does.
+    cx = np.array([shape.cx for shape in composition_plan], dtype=float)
+    cy = np.array([shape.cy for shape in composition_plan], dtype=float)
+    radius = np.array([shape.width / 2 for shape in composition_plan], dtype=float)
+    is_circle = np.array([shape.type == 'circle' for shape in composition_plan])
+    circle_gaps = np.hypot(cx[:, None] - cx[None, :], cy[:, None] - cy[None, :]) - (radius[:, None] + radius[None, :])
+    return np.where(is_circle[:, None] & is_circle[None, :], circle_gaps, gaps)
+
+
+def get_numpy_gap(shape1, shape2):
+    """get_rotated_gap through the vectorized engine, for measuring a single pair."""
+    return float(get_pairwise_rotated_gaps([shape1, shape2])[0, 1])
+
+
+# --- EXACT GEOMETRY ENGINE (Analytic) ---
+def get_point_segment_distance(px, py, ax, ay, bx, by):
+    """Returns the distance from point P to the segment AB."""
+    abx, aby = bx - ax, by - ay
+    length_sq = abx * abx + aby * aby
+    t = 0.0 if length_sq == 0 else max(0.0, min(1.0, ((px - ax) * abx + (py - ay) * aby) / length_sq))
+    return math.hypot(px - (ax + t * abx), py - (ay + t * aby))
+
+
+def get_exact_rect_rect_gap(rect1, rect2):
+    """
+    Separating-axis test for two rotated rectangles. Separated rectangles return
+    their true closest distance; overlapping ones return minus the penetration depth.
+    """
+    corners1, corners2 = rect1.corners(), rect2.corners()
+
+    min_overlap = float('inf')
+    for rect in (rect1, rect2):
+        angle = math.radians(rect.rotation)
+        for axis_x, axis_y in ((math.cos(angle), math.sin(angle)), (-math.sin(angle), math.cos(angle))):
+            projections1 = [x * axis_x + y * axis_y for x, y in corners1]
+            projections2 = [x * axis_x + y * axis_y for x, y in corners2]
+            overlap = min(max(projections1), max(projections2)) - max(min(projections1), min(projections2))
+            min_overlap = min(min_overlap, overlap)
+
+    if min_overlap > 0:
+        return -min_overlap
+
+    # Separated convex polygons are closest between a corner of one and an edge of the other.
+    distance = float('inf')
+    for corners_a, corners_b in ((corners1, corners2), (corners2, corners1)):
+        for px, py in corners_a:
+            for k in range(4):
+                (ax, ay), (bx, by) = corners_b[k], corners_b[(k + 1) % 4]
+                distance = min(distance, get_point_segment_distance(px, py, ax, ay, bx, by))
+    return distance
+
+
+def get_exact_circle_rect_gap(circle, rect):
+    """
+    Closest-feature test for a circle and a rotated rectangle, solved in the
+    rectangle's own frame. Negative values are the penetration depth.
+    """
+    half_w, half_h = rect.width / 2, rect.height / 2
+    radius = circle.width / 2
+    angle = math.radians(rect.rotation)
+    cos_a, sin_a = math.cos(-angle), math.sin(-angle)
+    translated_x, translated_y = circle.cx - rect.cx, circle.cy - rect.cy
+    local_x = translated_x * cos_a - translated_y * sin_a
+    local_y = translated_x * sin_a + translated_y * cos_a
+
+    if abs(local_x) <= half_w and abs(local_y) <= half_h:
+        # The centre is inside: push out through the nearest edge.
+        return -(radius + min(half_w - abs(local_x), half_h - abs(local_y)))
+
+    closest_x = max(-half_w, min(local_x, half_w))
+    closest_y = max(-half_h, min(local_y, half_h))
+    return math.hypot(local_x - closest_x, local_y - closest_y) - radius
+
+
+def get_exact_gap(shape1, shape2):
+    """
+    Drop-in, constant-time replacement for get_rotated_gap: the true gap between two
+    shapes, or minus the true penetration depth when they overlap.
+    """
+    if shape1.type == 'circle' and shape2.type == 'circle':
+        return get_precise_gap(shape1, shape2)
+    if shape1.type == 'rectangle' and shape2.type == 'rectangle':
+        return get_exact_rect_rect_gap(shape1, shape2)
+    circle, rect = (shape1, shape2) if shape1.type == 'circle' else (shape2, shape1)
+    return get_exact_circle_rect_gap(circle, rect)
+
+
+GEOMETRY_GAP_FUNCTIONS = {'sampled': get_rotated_gap, 'numpy': get_numpy_gap, 'exact': get_exact_gap}  # One per GEOMETRY_ENGINES entry
+
+
+def compare_geometry_engines(terms, engine='exact'):
+    """
+    Compares a geometry engine against the reference 'sampled' engine over a corpus of
+    terms. Every shape pair of each term's reference composition is measured with both,
+    and each term is recomposed with the engine to count how many images change.
+    """
+    if engine == 'sampled' or engine not in GEOMETRY_GAP_FUNCTIONS:
+        raise ValueError(f"Cannot compare geometry engine '{engine}' with the sampled reference.")
+    gap_function = GEOMETRY_GAP_FUNCTIONS[engine]
+    pairs = missed_overlaps = false_overlaps = changed_images = 0
+    deviations = []
+    sampled_time = engine_time = 0.0
+
+    terms = list(dict.fromkeys(terms))
+    seed_strings = get_seed_strings(terms)
+    for term in terms:
+        composition_plan = compose_term(term, seed_string=seed_strings[term])
+        for i in range(len(composition_plan)):
+            for j in range(i + 1, len(composition_plan)):
+                start = time.perf_counter()
+                sampled_gap = get_rotated_gap(composition_plan[i], composition_plan[j])
+                sampled_time += time.perf_counter() - start
+                start = time.perf_counter()
+                engine_gap = gap_function(composition_plan[i], composition_plan[j])
+                engine_time += time.perf_counter() - start
+
+                pairs += 1
+                deviations.append(abs(sampled_gap - engine_gap))
+                if engine_gap < 0 <= sampled_gap:
+                    missed_overlaps += 1
+                elif sampled_gap < 0 <= engine_gap:
+                    false_overlaps += 1
+
+        engine_plan = compose_term(term, seed_string=seed_strings[term], art_engine={'geometry': engine})
+        if render_term_svg(term, engine_plan) != render_term_svg(term, composition_plan):
+            changed_images += 1
+
+    return {
+        'engine': engine,
+        'terms': len(terms),
+        'pairs': pairs,
+        'overlaps_missed_by_sampling': missed_overlaps,
+        'overlaps_only_in_sampling': false_overlaps,
+        'mean_abs_deviation': round(sum(deviations) / pairs, 4) if pairs else 0.0,
+        'max_abs_deviation': round(max(deviations), 4) if deviations else 0.0,
+        'sampled_us_per_pair': round(sampled_time / pairs * 1e6, 3) if pairs else 0.0,
+        'engine_us_per_pair': round(engine_time / pairs * 1e6, 3) if pairs else 0.0,
+        'changed_images': changed_images,
+    }
+
+
+def resolve_art_engine(art_engine=None):
+    """
+    Merges art engine options over DEFAULT_ART_ENGINE and validates them.
+    Returns (options, None) on success or (None, error_message).
+    """
+    options = dict(DEFAULT_ART_ENGINE)
+    options.update(art_engine or {})
+    unknown = [key for key in options if key not in DEFAULT_ART_ENGINE]
+    if unknown:
+        return None, f"ERROR: Unknown art engine options: {', '.join(unknown)}"
+    if options['geometry'] not in GEOMETRY_ENGINES:
+        return None, f"ERROR: Unknown geometry engine '{options['geometry']}'."
+    if options['composition'] not in COMPOSITION_MODES:
+        return None, f"ERROR: Unknown composition mode '{options['composition']}'."
+    if options['svg'] not in SVG_FORMATS:
+        return None, f"ERROR: Unknown SVG format '{options['svg']}'."
+    if options['svg_precision'] not in SVG_PRECISION_RANGE:
+        return None, (f"ERROR: SVG precision must be between {SVG_PRECISION_RANGE.start} and "
+                      f"{SVG_PRECISION_RANGE.stop - 1} decimals.")
+    if options['geometry'] == 'numpy' and import_numpy() is None:
+        return None, "ERROR: The 'numpy' geometry engine requires NumPy to be installed."
+    return options, None
+
+
 def svg_header():
     return f'<svg width="{IMAGE_SIZE}" height="{IMAGE_SIZE}" viewBox="0 0 {IMAGE_SIZE} {IMAGE_SIZE}" xmlns="http://www.w3.org/2000/svg">'
 
 
 def draw_shape(shape_data):
     """Draws a shape, applying rotation if present."""
-    draw_type, color = shape_data['type'], shape_data['color']
-    fill_color, stroke_color = color, '#1a1a1a'
+    draw_type, color = shape_data.type, shape_data.color
+    fill_color, stroke_color = color, STROKE_COLOR
 
     if draw_type == 'circle':
-        cx, cy, radius = shape_data['cx'], shape_data['cy'], shape_data['width'] / 2
+        cx, cy, radius = shape_data.cx, shape_data.cy, shape_data.width / 2
         return f'<circle cx="{cx}" cy="{cy}" r="{radius}" fill="{fill_color}" stroke="{stroke_color}" stroke-width="{STROKE_WIDTH}" />'
 
     elif draw_type == 'rectangle':
-        x = shape_data['cx'] - shape_data['width'] / 2
-        y = shape_data['cy'] - shape_data['height'] / 2
+        x = shape_data.cx - shape_data.width / 2
+        y = shape_data.cy - shape_data.height / 2
 
         # --- NEW: Check for and apply rotation ---
-        rotation = shape_data.get('rotation', 0)
+        rotation = shape_data.rotation
         transform_attr = ""
         if rotation != 0:
             # The transform attribute rotates the shape around its own center point
-            transform_attr = f' transform="rotate({rotation} {shape_data["cx"]} {shape_data["cy"]})"'
+            transform_attr = f' transform="rotate({rotation} {shape_data.cx} {shape_data.cy})"'
 
-        return (f'<rect x="{x}" y="{y}" width="{shape_data["width"]}" height="{shape_data["height"]}"'
+        return (f'<rect x="{x}" y="{y}" width="{shape_data.width}" height="{shape_data.height}"'
                 f' fill="{fill_color}" stroke="{stroke_color}" stroke-width="{STROKE_WIDTH}"{transform_attr} />')
 
 
-def create_svg_for_term(term, output_path):
-    """Generates a compositional SVG for a given term and saves it to a specific path."""
-    kks = pykakasi.Kakasi()
-    result = kks.convert(term)
+def format_svg_number(value, precision):
+    """Rounds a number to precision decimals, without trailing zeros or a negative zero."""
+    text = f"{value:.{precision}f}"
+    if '.' in text:
+        text = text.rstrip('0').rstrip('.')
+    return '0' if text == '-0' else text
+
+
+def draw_shape_compact(shape_data, precision):
+    """Draws a shape for the compact serializer; the stroke comes from the enclosing group."""
+    number = functools.partial(format_svg_number, precision=precision)
+    if shape_data.type == 'circle':
+        return (f'<circle cx="{number(shape_data.cx)}" cy="{number(shape_data.cy)}"'
+                f' r="{number(shape_data.width / 2)}" fill="{shape_data.color}"/>')
+
+    x = shape_data.cx - shape_data.width / 2
+    y = shape_data.cy - shape_data.height / 2
+    transform_attr = ""
+    if shape_data.rotation != 0:
+        transform_attr = (f' transform="rotate({number(shape_data.rotation)}'
+                          f' {number(shape_data.cx)} {number(shape_data.cy)})"')
+    return (f'<rect x="{number(x)}" y="{number(y)}" width="{number(shape_data.width)}"'
+            f' height="{number(shape_data.height)}" fill="{shape_data.color}"{transform_attr}/>')
+
+
+# --- ROMAJI SEED CONVERSION ---
+ROMAJI_MEMO_SIZE = 65536
+_kakasi = None
+
+
+def get_kakasi():
+    """Returns the process-wide pykakasi converter, loading its dictionaries on first use."""
+    global _kakasi
+    if _kakasi is None:
+        import pykakasi  # Deferred: the module and its dictionaries are only needed to build decks
+        _kakasi = pykakasi.Kakasi()
+    return _kakasi
+
+
+@functools.lru_cache(maxsize=ROMAJI_MEMO_SIZE)
+def get_seed_string(term):
+    """Returns the string a term's image is seeded from: its Hepburn romaji, or the term itself."""
+    result = get_kakasi().convert(term)
     romaji_string = "".join([item['hepburn'] for item in result])
-    seed_string = romaji_string if term != romaji_string else term
+    return romaji_string if term != romaji_string else term
+
+
+def get_seed_strings(terms):
+    """Converts all of a deck's terms in one pass, returning a term -> seed string dict."""
+    return {term: get_seed_string(term) for term in dict.fromkeys(terms)}
+
+
+def create_svg_for_term(term, output_path=None, seed_string=None, art_engine=None, stats=None):
+    """
+    Generates a compositional SVG for a given term and returns it, saving it to
+    output_path if one is given.
+    A precomputed seed_string (see get_seed_strings) skips the romaji conversion, and
+    art_engine selects the engine options (see DEFAULT_ART_ENGINE).
+    """
+    composition_plan = compose_term(term, seed_string=seed_string, art_engine=art_engine, stats=stats)
+    start = time.perf_counter()
+    svg_string = render_term_svg(term, composition_plan, art_engine=art_engine)
+    start = add_phase_time(stats, 'render', start)
+    if output_path is None:
+        return svg_string
+
+    # Write to a temporary sibling first so concurrent deck builds sharing the
+    # media folder never package a half-written image.
+    temp_path = f"{output_path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(svg_string)
+        os.replace(temp_path, output_path)
+    except Exception as e:
+        print(f"ERROR writing SVG file '{output_path}': {e}")
+    add_phase_time(stats, 'write', start)
+    return svg_string
+
+
+def add_phase_time(stats, phase, start):
+    """Adds the time elapsed since start to stats['time_<phase>'] and returns the current time."""
+    now = time.perf_counter()
+    if stats is not None:
+        key = f'time_{phase}'
+        stats[key] = stats.get(key, 0.0) + (now - start)
+    return now
+
+
+def compose_term(term, seed_string=None, art_engine=None, stats=None):
+    """
+    Runs the compositional director for a term and returns its final composition plan.
+    If a stats dict is given, the pair evaluation counts and per-phase times are added to it.
+    """
+    start = time.perf_counter()
+    art_engine = {**DEFAULT_ART_ENGINE, **(art_engine or {})}
+    tracker = CompositionTracker(incremental=art_engine['composition'] == 'incremental')
+    if seed_string is None:
+        seed_string = get_seed_string(term)
     hex_dna = hashlib.sha256(seed_string.encode('utf-8')).hexdigest()
     rng = random.Random(hex_dna)
     shape_types = ['circle', 'rectangle']
@@ -479,13 +1004,11 @@ def create_svg_for_term(term, output_path):
     focal_color = COLOR_PALETTE[int(hex_dna[dna_pointer + 2], 16) % len(COLOR_PALETTE)]
     focal_size = BASE_SHAPE_SIZE + SIZE_VARIATION
 
-    focal_shape = {
-        'type': focal_shape_type, 'color': focal_color, 'cx': focal_point[0], 'cy': focal_point[1],
-        'rotation': 0, 'width': focal_size, 'height': focal_size
-    }
+    focal_shape = Shape(focal_shape_type, focal_color, focal_point[0], focal_point[1],
+                        focal_size, focal_size, rotation=0)
     if focal_shape_type == 'rectangle':
         aspect_ratio = 1.0 + (int(hex_dna[dna_pointer + 3], 16) / 15.0)
-        focal_shape['height'] *= aspect_ratio
+        focal_shape.height *= aspect_ratio
 
     composition_plan.append(focal_shape)
     dna_pointer += 8
@@ -520,38 +1043,63 @@ def create_svg_for_term(term, output_path):
                     possible_rotations = [0, 0, 0, 15, 30, 45, 90, -15, -30, -45, -90]
                     rotation = possible_rotations[int(hex_dna[dna_pointer + 5], 16) % len(possible_rotations)]
 
-                shape_dict = {
-                    'type': shape_type, 'color': color, 'cx': cx + (jitter_factor_x * JITTER_AMOUNT),
-                    'cy': cy + (jitter_factor_y * JITTER_AMOUNT), 'rotation': rotation, 'width': size, 'height': size
-                }
+                new_shape = Shape(shape_type, color, cx + (jitter_factor_x * JITTER_AMOUNT),
+                                  cy + (jitter_factor_y * JITTER_AMOUNT), size, size, rotation=rotation)
 
                 if shape_type == 'rectangle':
                     aspect_ratio = 1.0 + (int(hex_dna[dna_pointer + 6], 16) / 15.0)
-                    shape_dict['height'] *= aspect_ratio
+                    new_shape.height *= aspect_ratio
 
-                composition_plan.append(shape_dict)
+                composition_plan.append(new_shape)
                 dna_pointer += 8
                 shape_was_placed = True
                 break  # Exit the inner loop (over regions) and move to the next shape
 
         if not shape_was_placed:
             break  # No valid regions left, stop trying to place shapes
+        start = add_phase_time(stats, 'placement', start)
 
         # --- FINAL HIERARCHY OF COMPOSITIONAL CORRECTIONS ---
         # 1. Initial clamp to bring all generated shapes onto the canvas.
-        for shape in composition_plan: enforce_shape_boundary(shape)
+        for k, shape in enumerate(composition_plan):
+            if not tracker.is_settled(('boundary', k), shape):
+                enforce_shape_boundary(shape)
+                tracker.settle(('boundary', k), shape)
+        start = add_phase_time(stats, 'boundary', start)
 
         # 2. Transform any rectangles that are too deeply obscured into circles.
-        transform_deeply_overlapping_rects_to_circles(composition_plan, rng)
+        transform_deeply_overlapping_rects_to_circles(composition_plan, rng, tracker=tracker)
+        start = add_phase_time(stats, 'transform', start)
 
         # 3. Run the master harmony enforcement to resolve all awkward relationships.
-        enforce_compositional_harmony(composition_plan)
+        enforce_compositional_harmony(composition_plan, geometry=art_engine['geometry'], tracker=tracker)
+        start = add_phase_time(stats, 'harmony', start)
 
         # 4. Correct the orientation of any tall rectangles that create visual tension.
-        surgically_correct_composition(composition_plan)
+        surgically_correct_composition(composition_plan, tracker=tracker)
+        start = add_phase_time(stats, 'surgical', start)
 
         # 5. A final boundary check and polish to clean up any minor issues from the harmony step.
-        perform_final_composition_polish(composition_plan)
+        perform_final_composition_polish(composition_plan, tracker=tracker)
+        start = add_phase_time(stats, 'polish', start)
+
+    if stats is not None:
+        stats['pair_evaluations'] = stats.get('pair_evaluations', 0) + tracker.pair_evaluations
+        stats['pair_evaluations_saved'] = stats.get('pair_evaluations_saved', 0) + tracker.pair_evaluations_saved
+    return composition_plan
+
+
+def render_term_svg(term, composition_plan, art_engine=None):
+    """Assembles the SVG document for a composed term in the art engine's SVG format."""
+    art_engine = {**DEFAULT_ART_ENGINE, **(art_engine or {})}
+    if art_engine['svg'] == 'compact':
+        precision = art_engine['svg_precision']
+        return ''.join([
+            f'<svg width="{IMAGE_SIZE}" height="{IMAGE_SIZE}" viewBox="0 0 {IMAGE_SIZE} {IMAGE_SIZE}" xmlns="http://www.w3.org/2000/svg">',
+            f'<rect width="100%" height="100%" fill="{BACKGROUND_COLOR}"/>',
+            f'<g stroke="{STROKE_COLOR}" stroke-width="{STROKE_WIDTH}">',
+            *(draw_shape_compact(shape_data, precision) for shape_data in composition_plan),
+            '</g></svg>'])
 
     # --- SVG STRING ASSEMBLY (Unchanged) ---
     svg_list = [svg_header(), f'<rect width="100%" height="100%" fill="{BACKGROUND_COLOR}" />']
@@ -559,15 +1107,7 @@ def create_svg_for_term(term, output_path):
     svg_list.extend([
         f'<text x="{IMAGE_SIZE - 220}" y="{IMAGE_SIZE - 40}" font-family="Arial, sans-serif" font-size="0" fill="#555">{term}</text>',
         '</svg>'])
-    svg_string = '\n'.join(svg_list)
-
-    try:
-        with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(svg_string)
-    except Exception as e:
-        print(f"ERROR writing SVG file '{output_path}': {e}")
-
-    # --- REMOVED: No longer generating PNG ---
+    return '\n'.join(svg_list)
 
 
 # --- PARSING & HELPER FUNCTIONS ---
@@ -586,7 +1126,11 @@ def parse_settings_file(filepath):
             content = f.read()
     except FileNotFoundError:
         return None, f"ERROR: Settings file '{filepath}' not found."
+    return parse_settings_content(content)
 
+
+def parse_settings_content(content):
+    """Extracts the template sections from the text of a settings file."""
     pattern = re.compile(r"## (.*?)\s+```[a-z]+\s+(.*?)```", re.DOTALL | re.IGNORECASE)
     matches = pattern.findall(content)
     settings = {header.lower().replace(' template', ''): code for header, code in matches}
@@ -598,6 +1142,238 @@ def parse_settings_file(filepath):
     return settings, None
 
 
+# --- TEMPLATE COMPILER ---
+TEMPLATE_TAG_PATTERN = re.compile(r'\{\{\s*([#^/]?)\s*([^{}]*?)\s*\}\}')
+TEMPLATE_SPECIAL_FIELDS = {'FrontSide', 'Tags', 'Type', 'Deck', 'Subdeck', 'Card', 'CardFlag', 'CardID'}
+# An HTML comment or a script/style block, whichever starts first, so tags inside comments never open a block.
+TEMPLATE_BLOCK_PATTERN = re.compile(r'<!--.*?-->|(<(script|style)\b[^>]*>)(.*?)(</\2\s*>)', re.DOTALL | re.IGNORECASE)
+JS_REGEX_PRECEDERS = set('(,=:[!&|?{};+-*%<>~^')
+SHARED_RUNTIME_PATTERN = re.compile(r'<script id="shared-utils">(.*?)</script>', re.DOTALL)
+SHARED_RUNTIME_PREFIX = "_pq_shared"  # The leading underscore keeps Anki's Check Media from deleting it
+JS_REGEX_KEYWORDS = re.compile(r'\b(?:return|typeof|case|do|else|in|of|void|yield|await|delete|instanceof|new)$')
+_compiled_settings = {}
+
+
+def compile_settings_file(filepath, minify=True):
+    """
+    Parses, validates and (by default) minifies the settings file's templates,
+    and extracts the shared card runtime into settings['shared_js'].
+    The result is cached per file and checked against its mtime and size, then its
+    content hash, so repeated generations skip the work. Returns (settings, error).
+    """
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None, f"ERROR: Settings file '{filepath}' not found."
+    key = (os.path.abspath(filepath), minify)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = _compiled_settings.get(key)
+    if cached and cached['signature'] == signature:
+        return dict(cached['settings']), None
+
+    try:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            content = f.read()
+    except OSError as e:
+        return None, f"ERROR: Could not read settings file '{filepath}'. Reason: {e}"
+    content_hash = hashlib.sha256(content.encode('utf-8')).hexdigest()
+    if cached and cached['sha256'] == content_hash:
+        cached['signature'] = signature
+        return dict(cached['settings']), None
+
+    settings, error = parse_settings_content(content)
+    if error:
+        return None, error
+    problems = validate_template_fields(settings)
+    shared_runtime, problem = extract_shared_runtime(settings)
+    if problem:
+        problems.append(problem)
+    if problems:
+        return None, "ERROR: Invalid card templates:\n" + '\n'.join(problems)
+    if minify:
+        settings['front'] = minify_template_html(settings['front'])
+        settings['back'] = minify_template_html(settings['back'])
+        settings['styling'] = minify_css(settings['styling'])
+    if shared_runtime is not None:
+        settings['shared_js'] = minify_js(shared_runtime).strip() if minify else shared_runtime
+    _compiled_settings[key] = {'signature': signature, 'sha256': content_hash, 'settings': settings}
+    return dict(settings), None
+
+
+def validate_template_fields(settings):
+    """
+    Checks that every {{Field}} reference in the front and back templates names
+    a field of the note type (or an Anki special field) and that every
+    {{#Field}}/{{^Field}} section is closed. Returns a list of problems.
+    """
+    problems = []
+    for section in ('front', 'back'):
+        open_sections = []
+        for kind, reference in TEMPLATE_TAG_PATTERN.findall(settings[section]):
+            field = reference.split(':')[-1].strip()
+            if field not in QUAESTIONUM_FIELDS and field not in TEMPLATE_SPECIAL_FIELDS:
+                problems.append(f"{section.capitalize()} template: unknown field '{{{{{kind}{reference}}}}}'.")
+            elif field == 'FrontSide' and section == 'front':
+                problems.append("Front template: {{FrontSide}} is only available on the back.")
+            if kind in ('#', '^'):
+                open_sections.append(field)
+            elif kind == '/':
+                if not open_sections or open_sections.pop() != field:
+                    problems.append(f"{section.capitalize()} template: '{{{{/{field}}}}}' does not close an open section.")
+        for field in open_sections:
+            problems.append(f"{section.capitalize()} template: section '{field}' is never closed.")
+    return problems
+
+
+def extract_shared_runtime(settings):
+    """
+    Returns (script, problem) for the shared card runtime: the 'shared-utils' script
+    both templates inline as their fallback when the SharedUtils field is empty.
+    The two copies must match, since cards load a single shared file instead.
+    """
+    front = SHARED_RUNTIME_PATTERN.search(settings['front'])
+    back = SHARED_RUNTIME_PATTERN.search(settings['back'])
+    if not front and not back:
+        return None, None
+    if not front or not back or front.group(1) != back.group(1):
+        return None, "The front and back templates must contain the same 'shared-utils' script."
+    return front.group(1), None
+
+
+def get_shared_runtime_filename(shared_js):
+    """Versioned media filename for the shared card runtime, so an update never collides with a cached copy."""
+    return f"{SHARED_RUNTIME_PREFIX}.{hashlib.sha256(shared_js.encode('utf-8')).hexdigest()[:12]}.js"
+
+
+def minify_template_html(template):
+    """Minifies a card template: HTML comments and whitespace runs outside scripts, plus each script and style block."""
+    def minify_markup(markup):
+        return re.sub(r'\s+', lambda m: '\n' if '\n' in m.group(0) else ' ', markup)
+
+    parts, markup, position = [], [], 0
+    for match in TEMPLATE_BLOCK_PATTERN.finditer(template):
+        markup.append(template[position:match.start()])
+        position = match.end()
+        if match.group(1) is None:
+            continue  # An HTML comment: dropped whole, whatever tags it mentions
+        parts.append(minify_markup(''.join(markup)))
+        markup = []
+        minify_block = minify_js if match.group(2).lower() == 'script' else minify_css
+        parts.append(match.group(1) + minify_block(match.group(3)).strip() + match.group(4))
+    markup.append(template[position:])
+    parts.append(minify_markup(''.join(markup)))
+    return re.sub(r'\n+', '\n', ''.join(parts)).strip()
+
+
+def _skip_js_literal(code, i):
+    """Returns the index just past the string, template or regex literal starting at code[i]."""
+    quote, n = code[i], len(code)
+    i += 1
+    in_class = False
+    while i < n:
+        c = code[i]
+        if c == '\\':
+            i += 2
+            continue
+        if quote == '/':
+            if c == '[':
+                in_class = True
+            elif c == ']':
+                in_class = False
+            elif c == '/' and not in_class:
+                i += 1
+                while i < n and code[i].isalpha():
+                    i += 1  # Regex flags
+                return i
+        elif c == quote:
+            return i + 1
+        elif quote == '`' and code.startswith('${', i):
+            # Skip the embedded expression, including any nested literals.
+            i, depth = i + 2, 1
+            while i < n and depth:
+                if code[i] in '\'"`':
+                    i = _skip_js_literal(code, i)
+                    continue
+                depth += {'{': 1, '}': -1}.get(code[i], 0)
+                i += 1
+            continue
+        i += 1
+    return n
+
+
+def minify_js(code):
+    """
+    Conservatively minifies JavaScript: drops comments, indentation and blank lines
+    and collapses runs of spaces, copying string, template and regex literals
+    verbatim. Line breaks are kept, so automatic semicolon insertion is unaffected.
+    """
+    out, i, n = [], 0, len(code)
+    pending = ''
+    while i < n:
+        c = code[i]
+        if c in ' \t\r\n':
+            if c == '\n' or not pending:
+                pending = '\n' if c == '\n' else ' '
+            i += 1
+            continue
+        if code.startswith('//', i):
+            end = code.find('\n', i)
+            i = n if end < 0 else end
+            continue
+        if code.startswith('/*', i):
+            end = code.find('*/', i + 2)
+            i = n if end < 0 else end + 2
+            pending = pending or ' '
+            continue
+
+        if out and pending:
+            out.append(pending)
+        pending = ''
+        tail = ''.join(out[-12:]).rstrip()
+        is_regex = c == '/' and (not tail or tail[-1] in JS_REGEX_PRECEDERS or JS_REGEX_KEYWORDS.search(tail))
+        if c in '\'"`' or is_regex:
+            end = _skip_js_literal(code, i)
+            out.append(code[i:end])
+            i = end
+        else:
+            out.append(c)
+            i += 1
+    return ''.join(out)
+
+
+def minify_css(css):
+    """Minifies CSS: drops comments, collapses whitespace and trims it around braces, semicolons, commas and colons."""
+    out, i, n = [], 0, len(css)
+    pending = False
+    while i < n:
+        c = css[i]
+        if c.isspace():
+            pending = True
+            i += 1
+            continue
+        if css.startswith('/*', i):
+            end = css.find('*/', i + 2)
+            i = n if end < 0 else end + 2
+            pending = True
+            continue
+
+        if c in '{};,':
+            pending = False
+            if c == '}' and out and out[-1] == ';':
+                out.pop()
+        elif pending and out and out[-1] not in '{};,:':
+            out.append(' ')
+        pending = False
+        if c in '\'"':
+            end = _skip_js_literal(css, i)
+            out.append(css[i:end])
+            i = end
+        else:
+            out.append(c)
+            i += 1
+    return ''.join(out)
+
+
 def sanitize_for_filename(text):
     """Sanitizes a string to be a valid filename."""
     # First, replace common separators with a single underscore
@@ -609,12 +1385,23 @@ def sanitize_for_filename(text):
     return sanitized[:50]
 
 
+def deck_name_from_path(filepath):
+    """Derives the default deck name from a couplet file's name."""
+    base_name = os.path.splitext(os.path.basename(filepath))[0]
+    return base_name.replace('_', ' ').replace('-', ' - ')
+
+
+def get_default_output_dir():
+    """Returns the Documents/Prismata folder used for decks and backups."""
+    docs_path = QStandardPaths.writableLocation(QStandardPaths.StandardLocation.DocumentsLocation)
+    return os.path.join(docs_path, "Prismata")
+
+
 # --- ADD THIS NEW HELPER FUNCTION ---
 def save_backup_file(deck_name, couplets_text):
     """Saves the couplets text to a backup .md file."""
     # This uses the same logic from the old CoupletCatcher
-    docs_path = QStandardPaths.writableLocation(QStandardPaths.StandardLocation.DocumentsLocation)
-    save_path = os.path.join(docs_path, "Prismata")
+    save_path = get_default_output_dir()
     os.makedirs(save_path, exist_ok=True)
 
     filename = f"{sanitize_for_filename(deck_name)}.md"
@@ -629,22 +1416,540 @@ def save_backup_file(deck_name, couplets_text):
         return None
 
 
-# --- CORE ANKI DECK CREATION LOGIC ---
-def create_anki_deck(input_data, deck_name_str, anki_settings, font_files):
-    """Creates an Anki deck from either a file path or a string of text."""
-    lines = []
-    if os.path.exists(str(input_data)):
+# --- PERSISTENT SVG CACHE ---
+ART_ENGINE_VERSION = 1  # Bump whenever the composition code changes its output
+SVG_CACHE_DIRNAME = ".svg_cache"
+SVG_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+
+def get_art_config_hash(art_engine=None):
+    """Fingerprints every artistic constant that shapes an image, plus the engine version and options."""
+    art_config = {
+        'engine': ART_ENGINE_VERSION,
+        'engine_options': {**DEFAULT_ART_ENGINE, **(art_engine or {})},
+        'image_size': IMAGE_SIZE,
+        'background': BACKGROUND_COLOR,
+        'palette': COLOR_PALETTE,
+        'stroke_width': STROKE_WIDTH,
+        'stroke_color': STROKE_COLOR,
+        'jitter': JITTER_AMOUNT,
+        'min_gap': MIN_SEPARATION_GAP,
+        'min_overlap': MIN_OVERLAP_DEPTH,
+        'regions': HARMONIC_REGIONS,
+        'base_size': BASE_SHAPE_SIZE,
+        'size_variation': SIZE_VARIATION,
+    }
+    encoded = json.dumps(art_config, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()[:16]
+
+
+MEDIA_NAME_PREFIX_LENGTH = 32
+
+
+def get_media_key(term, art_config_hash):
+    """Content address of a term's image: composition is deterministic, so the term and art config fix its bytes."""
+    return hashlib.sha256(f"{art_config_hash}:{term}".encode('utf-8')).hexdigest()
+
+
+def get_media_filename(term, art_config_hash):
+    """Collision-safe media filename: a readable prefix from the term plus the image's content address."""
+    readable = sanitize_for_filename(term)[:MEDIA_NAME_PREFIX_LENGTH]
+    key = get_media_key(term, art_config_hash)[:16]
+    return f"pq_img_{readable}_{key}.svg" if readable else f"pq_img_{key}.svg"
+
+
+class SvgCache:
+    """
+    A content-addressed, size-bounded store of composed term images.
+
+    Entries are keyed by the term plus the artistic configuration hash (including
+    the art engine options), so changing any artistic constant starts a fresh
+    keyspace. Hits refresh the entry's mtime, which eviction uses to drop the least
+    recently used files first.
+    """
+
+    def __init__(self, cache_dir, max_bytes=SVG_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def entry_path(self, term, art_engine=None):
+        key = get_media_key(term, get_art_config_hash(art_engine))
+        return os.path.join(self.cache_dir, key[:2], f"{key}.svg")
+
+    def fetch(self, term, art_engine=None):
+        """Returns the cached image bytes for term, or None on a miss."""
+        entry = self.entry_path(term, art_engine)
         try:
-            with open(input_data, 'r', encoding='utf-8') as f:
-                lines = f.read().strip().split('\n')
-        except Exception as e:
-            return False, f"ERROR: Could not read input file. Reason: {e}", [], None
+            with open(entry, 'rb') as f:
+                data = f.read()
+            os.utime(entry)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def store(self, term, data, art_engine=None):
+        """Adds a freshly composed image to the cache."""
+        entry = self.entry_path(term, art_engine)
+        try:
+            os.makedirs(os.path.dirname(entry), exist_ok=True)
+            _write_file_atomically(entry, data)
+        except OSError as e:
+            print(f"Warning: could not cache image for '{term}': {e}")
+
+    def evict(self):
+        """Deletes the least recently used entries until the cache fits in max_bytes."""
+        entries, total_bytes = [], 0
+        for root, _, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue  # Removed by a concurrent build
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total_bytes += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self.evicted += 1
+            except OSError:
+                pass
+            total_bytes -= size
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evicted': self.evicted}
+
+
+def _write_file_atomically(destination_path, data):
+    temp_path = f"{destination_path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, destination_path)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+# --- PARALLEL SVG COMPOSITION ---
+PARALLEL_MIN_TERMS = 64  # Below this, spawning a worker pool costs more than it saves
+SLOWEST_TERMS_REPORTED = 10
+
+
+def create_process_pool(workers):
+    """
+    Returns a process pool whose workers are spawned rather than forked. Builds run
+    on a QThread inside the multithreaded Qt process, and a forked child can inherit
+    a lock another thread was holding and deadlock on it.
+    """
+    import concurrent.futures
+    import multiprocessing  # Deferred with the pool itself, so startup never loads it
+    return concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+def _compose_svg_job(job):
+    """
+    Worker entry point: composes one (term, seed_string, art_engine) job and
+    returns its composition stats, with the SVG bytes under 'svg'.
+    """
+    term, seed_string, art_engine = job
+    stats = {}
+    start = time.perf_counter()
+    svg_string = create_svg_for_term(term, seed_string=seed_string, art_engine=art_engine, stats=stats)
+    stats['time_term'] = time.perf_counter() - start
+    stats['svg'] = svg_string.encode('utf-8')
+    return stats
+
+
+GENERATION_CANCELLED_MESSAGE = "Generation cancelled. No deck file was created."
+
+
+class GenerationCancelled(Exception):
+    """Raised inside a deck build when its cancel_event is set."""
+
+
+def compose_term_svgs(jobs, workers=1, svg_cache=None, art_engine=None, progress_callback=None, cancel_event=None,
+                      media_sink=None, write_files=True):
+    """
+    Composes an SVG for every (term, output_path) job. Each image depends only on
+    its term, so a pool produces exactly the same files as the serial path.
+    With an SvgCache, cached images are reused and only misses are composed.
+    Each image's bytes are passed to media_sink(output_path, data) as soon as
+    they are ready, and written to output_path unless write_files is False.
+    progress_callback(done, total) is called as images complete, and setting
+    cancel_event (a threading.Event) stops the work with GenerationCancelled.
+    Returns the composition stats summed over every composed image.
+    """
+    delivery_times = {}
+
+    def deliver(term, output_path, data):
+        start = time.perf_counter()
+        if write_files:
+            try:
+                _write_file_atomically(output_path, data)
+            except OSError as e:
+                print(f"ERROR writing SVG file '{output_path}': {e}")
+        if media_sink is not None:
+            media_sink(output_path, data)
+        add_phase_time(delivery_times, 'write', start)
+
+    if svg_cache is None:
+        stats = _compose_jobs(jobs, workers, art_engine, deliver, progress_callback, cancel_event, 0, len(jobs))
+        stats.update(delivery_times)
+        return stats
+
+    start = time.perf_counter()
+    misses = []
+    for term, output_path in jobs:
+        data = svg_cache.fetch(term, art_engine=art_engine)
+        if data is None:
+            misses.append((term, output_path))
+        else:
+            deliver(term, output_path, data)
+    cache_times = {}
+    add_phase_time(cache_times, 'cache', start)
+    hits = len(jobs) - len(misses)
+    if progress_callback:
+        progress_callback(hits, len(jobs))
+
+    def deliver_and_store(term, output_path, data):
+        deliver(term, output_path, data)
+        start = time.perf_counter()
+        svg_cache.store(term, data, art_engine=art_engine)
+        add_phase_time(cache_times, 'cache', start)
+
+    stats = _compose_jobs(misses, workers, art_engine, deliver_and_store, progress_callback, cancel_event,
+                          hits, len(jobs))
+    start = time.perf_counter()
+    svg_cache.evict()
+    add_phase_time(cache_times, 'cache', start)
+    stats.update(delivery_times)
+    stats.update(cache_times)
+    return stats
+
+
+def _compose_jobs(jobs, workers, art_engine, deliver, progress_callback, cancel_event, done_offset, total):
+    # Seeds are converted once here, so worker processes never load pykakasi.
+    start = time.perf_counter()
+    seed_strings = get_seed_strings(term for term, _ in jobs)
+    romaji_time = time.perf_counter() - start
+    worker_jobs = [(term, seed_strings[term], art_engine) for term, _ in jobs]
+
+    job_stats = []
+
+    def record(single_stats):
+        term, output_path = jobs[len(job_stats)]
+        deliver(term, output_path, single_stats.pop('svg'))
+        job_stats.append(single_stats)
+        if progress_callback:
+            progress_callback(done_offset + len(job_stats), total)
+        if cancel_event is not None and cancel_event.is_set():
+            raise GenerationCancelled()
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(jobs) < PARALLEL_MIN_TERMS:
+        for job in worker_jobs:
+            record(_compose_svg_job(job))
     else:
-        lines = input_data.strip().split('\n')
+        chunksize = max(1, len(jobs) // (workers * 4))
+        executor = create_process_pool(workers)
+        try:
+            for single_stats in executor.map(_compose_svg_job, worker_jobs, chunksize=chunksize):
+                record(single_stats)
+        finally:
+            # On cancellation, drop the chunks that have not started yet.
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    stats = {'images_composed': len(jobs), 'pair_evaluations': 0, 'pair_evaluations_saved': 0,
+             'time_romaji': romaji_time}
+    term_times = []
+    for job, single_stats in zip(jobs, job_stats):
+        term_times.append((single_stats.pop('time_term'), job[0]))
+        for name, count in single_stats.items():
+            stats[name] = stats.get(name, 0) + count
+    stats['slowest_terms'] = [{'term': term, 'ms': round(seconds * 1000, 2)}
+                              for seconds, term in heapq.nlargest(SLOWEST_TERMS_REPORTED, term_times)]
+    return stats
+
+
+# --- PACKAGE WRITING ---
+class ApkgWriter:
+    """
+    Writes an .apkg incrementally. Media entries are streamed into the zip as
+    they are produced, from memory or from a file, and finish() adds the
+    collection database and media index exactly as genanki's Package would.
+    """
+
+    def __init__(self, path):
+        import zipfile  # Deferred, like the rest of the packaging modules
+        self.archive = zipfile.ZipFile(path, 'w')
+        self.media_names = {}
+
+    def add_media_data(self, filename, data):
+        index = str(len(self.media_names))
+        self.archive.writestr(index, data)
+        self.media_names[index] = filename
+
+    def add_media_file(self, path):
+        index = str(len(self.media_names))
+        self.archive.write(path, index)
+        self.media_names[index] = os.path.basename(path)
+
+    def finish(self, anki_package):
+        """Writes the decks of a genanki Package and closes the archive."""
+        import sqlite3
+        import tempfile
+        db_handle, db_path = tempfile.mkstemp(suffix='.anki2')
+        os.close(db_handle)
+        try:
+            connection = sqlite3.connect(db_path)
+            timestamp = time.time()
+            anki_package.write_to_db(connection.cursor(), timestamp, itertools.count(int(timestamp * 1000)))
+            connection.commit()
+            connection.close()
+            self.archive.write(db_path, 'collection.anki2')
+        finally:
+            os.remove(db_path)
+        self.archive.writestr('media', json.dumps(self.media_names))
+        self.archive.close()
+
+    def close(self):
+        self.archive.close()
+
+
+# --- INCREMENTAL REBUILDS ---
+BUILD_MANIFEST_DIRNAME = ".build_manifests"
+BUILD_MANIFEST_VERSION = 1
+
+
+def get_deck_id(full_deck_name):
+    """Derives a stable deck ID from the full deck name, in the range genanki's random IDs used."""
+    digest = hashlib.sha256(full_deck_name.encode('utf-8')).digest()
+    return (1 << 30) + int.from_bytes(digest[:8], 'big') % (1 << 30)
+
+
+def get_note_guid(full_deck_name, question, occurrence=0):
+    """
+    Stable note GUID from the full deck name and the question, so edits to the
+    answer or cloze term re-import as updates. GUIDs are unique across the whole
+    collection, so the deck name keeps two decks that share a question apart.
+    Repeated questions are told apart by occurrence, counted from the start of
+    the file: inserting a repeat of a question above its later copies shifts
+    their GUIDs, and those copies re-import as new notes.
+    """
+    import genanki  # Deferred, so the window opens without loading it
+    return genanki.guid_for(full_deck_name, question, occurrence)
+
+
+def hash_file(path):
+    """Returns the sha256 hex digest of a file, or None if it cannot be read."""
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
 
-    if not lines or all(not line.strip() for line in lines):
-        return False, "ERROR: Input data is empty or contains only whitespace.", [], None
 
+def hash_note_fields(fields):
+    return hashlib.sha256(json.dumps(fields, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def get_build_manifest_path(output_dir, deck_name_str):
+    return os.path.join(output_dir, BUILD_MANIFEST_DIRNAME, f"{sanitize_for_filename(deck_name_str)}.json")
+
+
+def load_build_manifest(manifest_path):
+    """
+    Loads a deck's build manifest: which term and art configuration produced
+    each media file (with its sha256), and a hash of every note's fields by GUID.
+    Returns an empty manifest if there is none or it is unreadable.
+    """
+    if os.path.exists(manifest_path):
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get('version') == BUILD_MANIFEST_VERSION:
+                return manifest
+        except (OSError, ValueError):
+            pass
+    return {'version': BUILD_MANIFEST_VERSION, 'media': {}, 'notes': {}}
+
+
+def save_build_manifest(manifest, manifest_path):
+    """Writes a build manifest atomically. Returns True on success."""
+    temp_path = f"{manifest_path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(temp_path, manifest_path)
+        return True
+    except OSError as e:
+        print(f"Error saving build manifest: {e}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return False
+
+
+def get_current_media_hash(manifest, svg_filename, term, art_config_hash):
+    """The sha256 the manifest records for an image composed for term with this art config, or None."""
+    entry = manifest['media'].get(svg_filename)
+    if entry is not None and entry['term'] == term and entry['config'] == art_config_hash:
+        return entry['sha256']
+    return None
+
+
+def open_previous_package(apkg_path):
+    """
+    Opens the .apkg a previous build left, so its images can be reused when they
+    were not mirrored to the media folder. Returns (archive, {filename: zip entry}),
+    or (None, {}) if there is no readable package.
+    """
+    import zipfile
+    try:
+        archive = zipfile.ZipFile(apkg_path)
+    except (OSError, zipfile.BadZipFile):
+        return None, {}
+    try:
+        return archive, {filename: index for index, filename in json.loads(archive.read('media')).items()}
+    except (KeyError, ValueError):
+        archive.close()
+        return None, {}
+
+
+# --- COUPLET PARSING ---
+COUPLET_HEADER = "Question;Answer"
+CLOZE_PATTERN = re.compile(r'\*(.*?)\*')
+COUPLET_SKIP_REASONS = {
+    'no_semicolon': "no ';'",
+    'multiple_semicolons': "more than one ';'",
+    'missing_cloze': "no *cloze*",
+}
+
+
+def open_couplet_source(input_data):
+    """Opens a file path, or wraps a string of couplets, as a text stream."""
+    if os.path.exists(str(input_data)):
+        return open(input_data, 'r', encoding='utf-8')
+    return io.StringIO(input_data)
+
+
+def classify_couplet_line(row):
+    """
+    Returns how the deck builder treats one line: 'blank', 'header', 'valid', or
+    the reason it is skipped (a COUPLET_SKIP_REASONS key).
+    """
+    if not row.strip():
+        return 'blank'
+    if COUPLET_HEADER in row:
+        return 'header'
+    semicolons = row.count(';')
+    if semicolons > 1:
+        return 'multiple_semicolons'
+    if semicolons != 1:
+        return 'no_semicolon'
+    if not CLOZE_PATTERN.search(row.partition(';')[2]):
+        return 'missing_cloze'
+    return 'valid'
+
+
+def iter_couplet_records(input_data, warnings=None, stats=None):
+    """
+    Streams (line_number, question, answer_line, cloze_text) records from a file
+    path or a string, one line at a time. Skipped lines with more than one
+    semicolon are reported in warnings. If a stats dict is given, it receives
+    the number of lines read and how many of them were not blank.
+    """
+    if stats is None:
+        stats = {}
+    stats['lines'] = stats['content_lines'] = 0
+    with open_couplet_source(input_data) as source:
+        for line_number, row in enumerate(source, start=1):
+            stats['lines'] = line_number
+            status = classify_couplet_line(row)
+            if status == 'blank': continue
+            stats['content_lines'] += 1
+            if status == 'multiple_semicolons' and warnings is not None:
+                warnings.append(f"Line {line_number}: Skipped (multiple semicolons). Content: '{row.rstrip()[:80]}...'")
+            if status != 'valid': continue
+
+            question, _, answer_line = row.partition(';')
+            answer_line = answer_line.strip()
+            yield line_number, question.strip(), answer_line, CLOZE_PATTERN.search(answer_line).group(1).strip()
+
+
+def collect_cloze_terms(paths):
+    """Returns the non-empty cloze terms of couplet files or folders, exactly as the deck builder parses them."""
+    terms = []
+    for path in collect_couplet_files(paths):
+        terms.extend(term for _, _, _, term in iter_couplet_records(path) if term)
+    return terms
+
+
+# --- CORE ANKI DECK CREATION LOGIC ---
+def create_anki_deck(input_data, deck_name_str, anki_settings, font_files, output_dir=None, report=None,
+                     svg_workers=1, svg_cache=None, art_engine=None, profile_path=None,
+                     progress_callback=None, cancel_event=None, incremental=True, mirror_media=False):
+    """
+    Creates an Anki deck from either a file path or a string of text.
+
+    The deck is written to output_dir (Documents/Prismata by default). If a
+    report dict is given, it is filled with the number of cards created, the
+    composition stats and the time spent in each build stage.
+    svg_workers > 1 composes the images in that many worker processes, an
+    SvgCache reuses images composed by earlier builds, and art_engine selects
+    the composition engine options (see DEFAULT_ART_ENGINE).
+    With a profile_path, the whole build runs under cProfile and the pstats
+    output is written there; composition then runs in-process so it is captured.
+    progress_callback(done, total) is called as each distinct image is ready, and
+    setting cancel_event stops the build without leaving a partial .apkg behind.
+    The deck ID and note GUIDs are derived from the deck name and questions, so a
+    rebuild imports as updates. With incremental=True, images the deck's build
+    manifest shows are unchanged are reused instead of recomposed, from the media
+    folder or else from the previous .apkg.
+    Images are streamed straight into the .apkg; mirror_media=True also writes
+    them to the media folder.
+    """
+    if profile_path is None:
+        return _build_anki_deck(input_data, deck_name_str, anki_settings, font_files, output_dir, report,
+                                svg_workers, svg_cache, art_engine, progress_callback, cancel_event, incremental,
+                                mirror_media)
+
+    import cProfile  # Deferred: only profiled builds need it
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return _build_anki_deck(input_data, deck_name_str, anki_settings, font_files, output_dir, report,
+                                1, svg_cache, art_engine, progress_callback, cancel_event, incremental, mirror_media)
+    finally:
+        profiler.disable()
+        os.makedirs(os.path.dirname(os.path.abspath(profile_path)), exist_ok=True)
+        profiler.dump_stats(profile_path)
+        if report is not None:
+            report['profile_path'] = profile_path
+
+
+def _build_anki_deck(input_data, deck_name_str, anki_settings, font_files, output_dir, report,
+                     svg_workers, svg_cache, art_engine, progress_callback, cancel_event, incremental,
+                     mirror_media):
+    art_engine, error = resolve_art_engine(art_engine)
+    if error:
+        return False, error, [], None
+    import genanki  # Deferred until the first generation, so the window opens without loading it
+
+    timings = {}
+    start = time.perf_counter()
     anki_model = genanki.Model(
         MODEL_ID, 'Prisma Quaestionum v2.3',
         fields=QUAESTIONUM_MODEL_FIELDS,
@@ -653,63 +1958,750 @@ def create_anki_deck(input_data, deck_name_str, anki_settings, font_files):
     )
 
     full_deck_name = f"{ANKI_TOP_LEVEL_DECK}::{deck_name_str}"
-    anki_deck = genanki.Deck(random.randrange(1 << 30, 1 << 31), full_deck_name)
-
-    docs_path = QStandardPaths.writableLocation(QStandardPaths.StandardLocation.DocumentsLocation)
-    output_dir = os.path.join(docs_path, "Prismata")
-    os.makedirs(output_dir, exist_ok=True)
+    anki_deck = genanki.Deck(get_deck_id(full_deck_name), full_deck_name)
 
+    if output_dir is None:
+        output_dir = get_default_output_dir()
     media_output_dir = os.path.join(output_dir, "media")
-    os.makedirs(media_output_dir, exist_ok=True)
+    art_config_hash = get_art_config_hash(art_engine)
 
-    generated_media_files = []
     notes_created = 0
     warnings = []
+    pending_notes = []
+    parse_stats = {}
+    occurrences = {}
+
+    # 1. Stream the couplets first, so composition can be fanned out afterwards.
+    try:
+        for line_number, question, original_answer_line, inner_text in iter_couplet_records(input_data, warnings, parse_stats):
+            notes_created += 1
+            svg_filename = get_media_filename(inner_text, art_config_hash)
+            full_svg_path = os.path.join(media_output_dir, svg_filename)
+            occurrence = occurrences.get(question, 0)
+            occurrences[question] = occurrence + 1
+            guid = get_note_guid(full_deck_name, question, occurrence)
+            pending_notes.append((question, original_answer_line, inner_text, svg_filename, full_svg_path, guid))
+    except Exception as e:
+        return False, f"ERROR: Could not read input file. Reason: {e}", [], None
+
+    if not parse_stats['content_lines']:
+        return False, "ERROR: Input data is empty or contains only whitespace.", [], None
+    os.makedirs(media_output_dir if mirror_media else output_dir, exist_ok=True)
+    start = add_phase_time(timings, 'parse', start)
+
+    output_filename = f"{sanitize_for_filename(deck_name_str)}.apkg"
+    full_output_path = os.path.join(output_dir, output_filename)
+    # Stream into a sibling file and rename at the end, so an interrupted build never leaves a partial .apkg.
+    temp_output_path = f"{full_output_path}.{os.getpid()}.part"
+    package_writer = ApkgWriter(temp_output_path)
+    previous_package = None
+    try:
+        for font_file in font_files:
+            package_writer.add_media_file(get_resource_path(font_file))
+
+        # The shared card runtime ships once as media; each note's SharedUtils field loads it,
+        # which also switches off the templates' inline copy.
+        shared_runtime_filename, shared_utils_field = None, ""
+        if anki_settings.get('shared_js'):
+            shared_runtime_filename = get_shared_runtime_filename(anki_settings['shared_js'])
+            package_writer.add_media_data(shared_runtime_filename, anki_settings['shared_js'].encode('utf-8'))
+            shared_utils_field = f'<script src="{shared_runtime_filename}"></script>'
+
+        # 2. Compose each distinct image the last build of this deck did not already leave
+        #    in place, streaming it into the package as soon as it is ready.
+        manifest_path = get_build_manifest_path(output_dir, deck_name_str)
+        previous_manifest = load_build_manifest(manifest_path)
+        # Unchanged images are taken from the media folder when mirrored, else from the last .apkg.
+        previous_package, previous_package_media = (open_previous_package(full_output_path) if incremental
+                                                    else (None, {}))
+        unique_images = {}
+        for note in pending_notes:
+            unique_images.setdefault(note[3], note[2:5])
+        duplicate_images = len(pending_notes) - len(unique_images)
+        media_hashes = {}
+        compose_jobs = []
+        for inner_text, svg_filename, full_svg_path in unique_images.values():
+            expected_hash = (get_current_media_hash(previous_manifest, svg_filename, inner_text, art_config_hash)
+                             if incremental else None)
+            if expected_hash is not None and hash_file(full_svg_path) == expected_hash:
+                package_writer.add_media_file(full_svg_path)
+                media_hashes[svg_filename] = expected_hash
+                continue
+            if expected_hash is not None and svg_filename in previous_package_media:
+                data = previous_package.read(previous_package_media[svg_filename])
+                if hashlib.sha256(data).hexdigest() == expected_hash:
+                    package_writer.add_media_data(svg_filename, data)
+                    if mirror_media:
+                        _write_file_atomically(full_svg_path, data)
+                    media_hashes[svg_filename] = expected_hash
+                    continue
+            compose_jobs.append((inner_text, full_svg_path))
+        if previous_package is not None:
+            previous_package.close()  # Released before the new package replaces it
+            previous_package = None
+        images_reused = len(unique_images) - len(compose_jobs)
+        compose_progress = progress_callback
+        if progress_callback and images_reused:
+            progress_callback(images_reused, len(unique_images))
+            compose_progress = lambda done, total: progress_callback(images_reused + done, images_reused + total)
+
+        def add_image_to_package(output_path, data):
+            svg_filename = os.path.basename(output_path)
+            package_writer.add_media_data(svg_filename, data)
+            media_hashes[svg_filename] = hashlib.sha256(data).hexdigest()
+
+        cache_stats_before = svg_cache.stats() if svg_cache is not None else None
+        try:
+            composition_stats = compose_term_svgs(compose_jobs, workers=svg_workers,
+                                                  svg_cache=svg_cache, art_engine=art_engine,
+                                                  progress_callback=compose_progress, cancel_event=cancel_event,
+                                                  media_sink=add_image_to_package, write_files=mirror_media)
+        except GenerationCancelled:
+            return False, GENERATION_CANCELLED_MESSAGE, warnings, None
+        start = add_phase_time(timings, 'compose', start)
+
+        # 3. Assemble the notes in their original line order.
+        manifest = {'version': BUILD_MANIFEST_VERSION, 'media': {}, 'notes': {}}
+        for question, original_answer_line, inner_text, svg_filename, full_svg_path, guid in pending_notes:
+            # --- FIX: Create the full HTML tag for the field ---
+            svg_field_content = f'<img src="{svg_filename}" alt="Compositional SVG for {inner_text}">'
+            fields = [question, original_answer_line, inner_text, svg_field_content, shared_utils_field]
+
+            anki_note = genanki.Note(
+                model=anki_model,
+                # --- FIX: Use the new HTML string instead of just the filename ---
+                fields=fields,
+                tags=['Prisma_Quaestionum'],
+                guid=guid
+            )
+            anki_deck.add_note(anki_note)
+            manifest['notes'][guid] = hash_note_fields(fields)
+            manifest['media'][svg_filename] = {'term': inner_text, 'config': art_config_hash,
+                                               'sha256': media_hashes.get(svg_filename)}
+        start = add_phase_time(timings, 'notes', start)
+
+        previous_notes = previous_manifest['notes']
+        note_changes = {'images_reused': images_reused, 'notes_added': 0, 'notes_updated': 0, 'notes_unchanged': 0,
+                        'notes_removed': sum(1 for guid in previous_notes if guid not in manifest['notes'])}
+        for guid, fields_hash in manifest['notes'].items():
+            if guid not in previous_notes:
+                note_changes['notes_added'] += 1
+            elif previous_notes[guid] != fields_hash:
+                note_changes['notes_updated'] += 1
+            else:
+                note_changes['notes_unchanged'] += 1
+
+        if report is not None:
+            report['deck_name'] = deck_name_str
+            report['deck_id'] = anki_deck.deck_id
+            report['cards'] = notes_created
+            report['warnings'] = len(warnings)
+            report['art_engine'] = art_engine
+            report['composition'] = composition_stats
+            report['duplicate_images_skipped'] = duplicate_images
+            report['shared_runtime'] = shared_runtime_filename
+            report['timings'] = timings
+            report['incremental'] = note_changes
+            if svg_cache is not None:
+                report['svg_cache'] = {name: count - cache_stats_before[name]
+                                       for name, count in svg_cache.stats().items()}
+
+        if not anki_deck.notes:
+            return False, "No valid notes were processed. No file will be created.", warnings, None
+
+        if cancel_event is not None and cancel_event.is_set():
+            return False, GENERATION_CANCELLED_MESSAGE, warnings, None
+
+        package_writer.finish(genanki.Package(anki_deck))
+        os.replace(temp_output_path, full_output_path)
+    finally:
+        package_writer.close()
+        if previous_package is not None:
+            previous_package.close()
+        if os.path.exists(temp_output_path):
+            os.remove(temp_output_path)
+    save_build_manifest(manifest, manifest_path)
+    add_phase_time(timings, 'package', start)
+    if report is not None:
+        report['output_path'] = full_output_path
+
+    return True, f"Successfully created '{output_filename}' with {notes_created} cards.", warnings, full_output_path
+
+
+# --- BUILD REPORTS ---
+REPORTS_DIRNAME = "reports"
+
+def format_build_report(report):
+    """Turns a create_anki_deck report into human-readable lines for the log box."""
+    def seconds_list(times):
+        return ' · '.join(f"{key[len('time_'):]} {value:.2f}s" for key, value in times.items()
+                          if key.startswith('time_'))
+
+    composition = report.get('composition', {})
+    lines = [f"Stages: {seconds_list(report.get('timings', {}))}"]
+    if composition.get('images_composed'):
+        lines.append(f"Composition ({composition['images_composed']} images): {seconds_list(composition)}")
+        lines.append(f"Pair evaluations: {composition['pair_evaluations']} "
+                     f"({composition['pair_evaluations_saved']} skipped by incremental composition)")
+    if 'incremental' in report:
+        changes = report['incremental']
+        lines.append(f"Since the last build: {changes['notes_added']} notes added, {changes['notes_updated']} updated, "
+                     f"{changes['notes_unchanged']} unchanged, {changes['notes_removed']} removed; "
+                     f"{changes['images_reused']} images reused.")
+    if 'svg_cache' in report:
+        lines.append(f"Images reused from cache: {report['svg_cache']['hits']}, "
+                     f"newly composed: {report['svg_cache']['misses']}.")
+    if report.get('duplicate_images_skipped'):
+        lines.append(f"Repeated terms sharing an already packaged image: {report['duplicate_images_skipped']}.")
+    if composition.get('slowest_terms'):
+        slowest = ', '.join(f"'{entry['term']}' {entry['ms']:.1f} ms" for entry in composition['slowest_terms'][:5])
+        lines.append(f"Slowest terms: {slowest}")
+    if 'profile_path' in report:
+        lines.append(f"Profile written to: {report['profile_path']}")
+    return lines
+
+
+def write_build_report(report, report_path):
+    """Writes a create_anki_deck report as JSON. Returns the path, or None on failure."""
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(report_path)), exist_ok=True)
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        return report_path
+    except Exception as e:
+        print(f"Error saving build report: {e}")
+        return None
+
+
+# --- ANKICONNECT PUSH ---
+ANKICONNECT_DEFAULT_ENDPOINT = "http://127.0.0.1:8765"
+ANKICONNECT_VERSION = 6
+ANKICONNECT_TIMEOUT = 60
+ANKICONNECT_NOTE_BATCH = 250  # Notes per addNotes call or multi of updateNoteFields
+ANKICONNECT_MEDIA_BATCH_BYTES = 8 * 1024 * 1024  # Raw media bytes per multi of storeMediaFile
+ANKI_SYNC_STATE_VERSION = 2  # 2: note GUIDs include the full deck name
+
+
+class AnkiConnectError(Exception):
+    """AnkiConnect could not be reached or refused an action."""
 
-    for i, row in enumerate(lines):
-        if not row.strip() or "Question;Answer" in row: continue
-        if row.count(';') > 1:
-            warnings.append(f"Line {i + 1}: Skipped (multiple semicolons). Content: '{row[:80]}...'")
-            continue
-        if row.count(';') != 1: continue
 
-        question, original_answer_line = [p.strip() for p in row.split(';')]
-        cloze_match = re.search(r'\*(.*?)\*', original_answer_line)
-        if not cloze_match: continue
+def ankiconnect_request(endpoint, action, timeout=ANKICONNECT_TIMEOUT, **params):
+    """Calls one AnkiConnect action and returns its result. Raises AnkiConnectError."""
+    import urllib.error
+    import urllib.request  # Deferred, so startup never loads the networking modules
 
-        notes_created += 1
-        inner_text = cloze_match.group(1).strip()
+    payload = json.dumps({'action': action, 'version': ANKICONNECT_VERSION, 'params': params}).encode('utf-8')
+    request = urllib.request.Request(endpoint, data=payload, headers={'Content-Type': 'application/json'},
+                                     method='POST')
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            reply = json.loads(response.read().decode('utf-8'))
+    except urllib.error.HTTPError as e:
+        raise AnkiConnectError(f"AnkiConnect answered HTTP {e.code} {e.reason} to '{action}'.") from e
+    except (urllib.error.URLError, OSError) as e:
+        raise AnkiConnectError(f"Could not reach AnkiConnect at {endpoint} ({getattr(e, 'reason', e)}). "
+                               f"Is Anki running with the AnkiConnect add-on?") from e
+    except ValueError as e:
+        raise AnkiConnectError(f"AnkiConnect sent an unreadable reply to '{action}'.") from e
+    if not isinstance(reply, dict) or 'result' not in reply or 'error' not in reply:
+        raise AnkiConnectError(f"Unexpected reply to '{action}': {reply!r}")
+    if reply['error'] is not None:
+        raise AnkiConnectError(f"'{action}' failed: {reply['error']}")
+    return reply['result']
+
+
+def ankiconnect_multi(endpoint, actions):
+    """
+    Sends (action, params) pairs in a single 'multi' request.
+    Returns [(result, error)] in the same order; one refused action does not stop the rest.
+    """
+    if not actions:
+        return []
+    results = ankiconnect_request(endpoint, 'multi', actions=[
+        {'action': action, 'version': ANKICONNECT_VERSION, 'params': params} for action, params in actions
+    ])
+    unpacked = []
+    for result in results:
+        if isinstance(result, dict) and set(result) == {'result', 'error'}:
+            unpacked.append((result['result'], result['error']))
+        else:
+            unpacked.append((result, None))
+    return unpacked
 
-        svg_filename = f"pq_img_{sanitize_for_filename(inner_text)}.svg"
-        full_svg_path = os.path.join(media_output_dir, svg_filename)
 
-        create_svg_for_term(inner_text, full_svg_path)
+def read_apkg_contents(apkg_path):
+    """
+    Reads back what a built .apkg holds: its note type, deck name, notes
+    [(guid, fields, tags)] and media {filename: zip entry}.
+    Returns (contents, error).
+    """
+    import sqlite3
+    import tempfile
+    import zipfile  # Deferred, so startup never loads the packaging modules
+    try:
+        with zipfile.ZipFile(apkg_path) as archive:
+            media = {filename: index for index, filename in json.loads(archive.read('media')).items()}
+            collection = archive.read('collection.anki2')
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile) as e:
+        return None, f"ERROR: Could not read '{os.path.basename(apkg_path)}'. Reason: {e}"
 
-        generated_media_files.append(full_svg_path)
+    db_handle, db_path = tempfile.mkstemp(suffix='.anki2')
+    try:
+        with os.fdopen(db_handle, 'wb') as f:
+            f.write(collection)
+        connection = sqlite3.connect(db_path)
+        try:
+            models_json, decks_json = connection.execute("SELECT models, decks FROM col").fetchone()
+            model = json.loads(models_json)[str(MODEL_ID)]
+            deck_ids = {deck_id for (deck_id,) in connection.execute("SELECT DISTINCT did FROM cards")}
+            notes = [(guid, fields.split('\x1f'), tags.split())
+                     for guid, fields, tags in connection.execute("SELECT guid, flds, tags FROM notes ORDER BY id")]
+        finally:
+            connection.close()
+    except (sqlite3.Error, KeyError, TypeError, ValueError) as e:
+        return None, f"ERROR: '{os.path.basename(apkg_path)}' is not a Prisma Quaestionum deck. Reason: {e}"
+    finally:
+        os.remove(db_path)
+
+    decks = json.loads(decks_json)
+    if len(deck_ids) != 1:
+        return None, f"ERROR: '{os.path.basename(apkg_path)}' should hold exactly one deck."
+    return {
+        'model': {'name': model['name'], 'fields': [field['name'] for field in model['flds']],
+                  'templates': [(template['name'], template['qfmt'], template['afmt']) for template in model['tmpls']],
+                  'css': model['css']},
+        'deck_name': decks[str(deck_ids.pop())]['name'],
+        'notes': notes,
+        'media': media,
+    }, None
+
+
+def get_anki_sync_state_path(apkg_path):
+    """The push state lives with the deck's build manifest."""
+    deck_basename = os.path.splitext(os.path.basename(apkg_path))[0]
+    return os.path.join(os.path.dirname(os.path.abspath(apkg_path)), BUILD_MANIFEST_DIRNAME,
+                        f"{deck_basename}.anki.json")
+
+
+def load_anki_sync_state(state_path, endpoint):
+    """
+    Loads what the last push of a deck to this endpoint left in Anki: the note
+    type hash, the sha256 of every media file and the note ID and fields hash
+    of every note by GUID. Returns an empty state if there is none.
+    """
+    if os.path.exists(state_path):
+        try:
+            with open(state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if state.get('version') == ANKI_SYNC_STATE_VERSION and state.get('endpoint') == endpoint:
+                return state
+        except (OSError, ValueError):
+            pass
+    return {'version': ANKI_SYNC_STATE_VERSION, 'endpoint': endpoint, 'model': None, 'media': {}, 'notes': {}}
 
-        # --- FIX: Create the full HTML tag for the field ---
-        svg_field_content = f'<img src="{svg_filename}" alt="Compositional SVG for {inner_text}">'
 
-        anki_note = genanki.Note(
-            model=anki_model,
-            # --- FIX: Use the new HTML string instead of just the filename ---
-            fields=[question, original_answer_line, inner_text, svg_field_content, ""],
-            tags=['Prisma_Quaestionum']
+def get_anki_search_query(deck_name, model_name):
+    """An Anki search for the notes of one note type in one deck, with its wildcards escaped."""
+    def quote(term):
+        return '"' + re.sub(r'([\\"*_])', r'\\\1', term) + '"'
+    return f"{quote('deck:' + deck_name)} {quote('note:' + model_name)}"
+
+
+def reconcile_anki_notes(endpoint, contents, note_ids):
+    """
+    Matches notes already in Anki (say, from an earlier .apkg import) to GUIDs.
+    AnkiConnect does not expose GUIDs, so they are derived from the deck name
+    and each note's question exactly as the build does, in creation order.
+    Only the deck's own notes (note_ids) are considered, so a note in another
+    deck with the same question is never matched.
+    Returns {guid: [note_id, fields_hash]}.
+    """
+    known = {}
+    occurrences = {}
+    field_names = contents['model']['fields']
+    note_ids = sorted(note_ids)
+    for start in range(0, len(note_ids), ANKICONNECT_NOTE_BATCH):
+        for info in ankiconnect_request(endpoint, 'notesInfo', notes=note_ids[start:start + ANKICONNECT_NOTE_BATCH]):
+            if not info or 'fields' not in info:
+                continue
+            fields = [info['fields'].get(name, {}).get('value', '') for name in field_names]
+            occurrence = occurrences.get(fields[0], 0)
+            occurrences[fields[0]] = occurrence + 1
+            guid = get_note_guid(contents['deck_name'], fields[0], occurrence)
+            known[guid] = [info['noteId'], hash_note_fields(fields)]
+    return known
+
+
+def iter_media_batches(media_items):
+    """Yields lists of storeMediaFile actions for (filename, digest, data) items, about ANKICONNECT_MEDIA_BATCH_BYTES each."""
+    import base64
+    batch, batch_bytes = [], 0
+    for filename, _, data in media_items:
+        batch.append(('storeMediaFile', {'filename': filename, 'data': base64.b64encode(data).decode('ascii')}))
+        batch_bytes += len(data)
+        if batch_bytes >= ANKICONNECT_MEDIA_BATCH_BYTES:
+            yield batch
+            batch, batch_bytes = [], 0
+    if batch:
+        yield batch
+
+
+def push_deck_to_anki(apkg_path, endpoint=ANKICONNECT_DEFAULT_ENDPOINT, full=False, progress_callback=None):
+    """
+    Installs a built deck through an AnkiConnect endpoint instead of an interactive
+    import: the note type, deck, media and notes are sent in batched calls, and only
+    what changed since the last push to that endpoint. full=True resends everything.
+    progress_callback(message) reports each step. Returns (report, error); the
+    report is also filled in when the push stops part-way.
+    """
+    import zipfile  # Deferred, so startup never loads the packaging modules
+    started = time.perf_counter()
+    report = {'endpoint': endpoint, 'deck_name': None, 'model': 'unchanged', 'media_sent': 0, 'media_unchanged': 0,
+              'media_failed': 0, 'media_bytes_sent': 0, 'notes_added': 0, 'notes_updated': 0, 'notes_unchanged': 0, 'notes_failed': 0,
+              'failures': []}
+    progress = progress_callback or (lambda message: None)
+
+    contents, error = read_apkg_contents(apkg_path)
+    if error:
+        return report, error
+    model, deck_name = contents['model'], contents['deck_name']
+    report['deck_name'] = deck_name
+    state_path = get_anki_sync_state_path(apkg_path)
+    state = load_anki_sync_state(state_path, endpoint)
+    if full:
+        state.update(model=None, media={}, notes={})
+
+    try:
+        ankiconnect_request(endpoint, 'version')
+        model_hash = hashlib.sha256(json.dumps(model, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+        # 1. The note type and deck, in one request.
+        setup_actions = [('createDeck', {'deck': deck_name})]
+        if model['name'] not in ankiconnect_request(endpoint, 'modelNames'):
+            setup_actions.append(('createModel', {
+                'modelName': model['name'], 'inOrderFields': model['fields'], 'css': model['css'],
+                'cardTemplates': [{'Name': name, 'Front': front, 'Back': back}
+                                  for name, front, back in model['templates']]}))
+            report['model'] = 'created'
+        elif state['model'] != model_hash:
+            setup_actions.append(('updateModelTemplates', {'model': {
+                'name': model['name'],
+                'templates': {name: {'Front': front, 'Back': back} for name, front, back in model['templates']}}}))
+            setup_actions.append(('updateModelStyling', {'model': {'name': model['name'], 'css': model['css']}}))
+            report['model'] = 'updated'
+        for (action, _), (_, action_error) in zip(setup_actions, ankiconnect_multi(endpoint, setup_actions)):
+            if action_error:
+                raise AnkiConnectError(f"'{action}' failed: {action_error}")
+        state['model'] = model_hash
+
+        # 2. Media (images, fonts and the shared card runtime) whose content changed.
+        progress("Checking media...")
+        with zipfile.ZipFile(apkg_path) as archive:
+            changed_media = []
+            for filename, index in contents['media'].items():
+                data = archive.read(index)
+                digest = hashlib.sha256(data).hexdigest()
+                if state['media'].get(filename) == digest:
+                    report['media_unchanged'] += 1
+                else:
+                    changed_media.append((filename, digest, data))
+        sent = 0
+        for batch in iter_media_batches(changed_media):
+            batch_items = changed_media[sent:sent + len(batch)]
+            for (filename, digest, data), (_, action_error) in zip(batch_items, ankiconnect_multi(endpoint, batch)):
+                if action_error:
+                    report['media_failed'] += 1
+                    report['failures'].append(f"{filename}: {action_error}")
+                    continue
+                state['media'][filename] = digest
+                report['media_sent'] += 1
+                report['media_bytes_sent'] += len(data)
+            sent += len(batch)
+            progress(f"Sent {sent} of {len(changed_media)} media files...")
+
+        # 3. Notes: update those whose fields changed, add those Anki does not have.
+        progress("Checking notes...")
+        query = get_anki_search_query(deck_name, model['name'])
+        note_ids = ankiconnect_request(endpoint, 'findNotes', query=query)
+        if state['notes']:
+            existing = set(note_ids)
+            known = {guid: entry for guid, entry in state['notes'].items() if entry[0] in existing}
+        else:
+            known = reconcile_anki_notes(endpoint, contents, note_ids)
+
+        to_add, to_update = [], []
+        for guid, fields, tags in contents['notes']:
+            fields_hash = hash_note_fields(fields)
+            entry = known.get(guid)
+            if entry is None:
+                to_add.append((guid, fields, tags, fields_hash))
+            elif entry[1] != fields_hash:
+                to_update.append((guid, entry[0], fields, fields_hash))
+            else:
+                report['notes_unchanged'] += 1
+        state['notes'] = {guid: known[guid] for guid, _, _ in contents['notes'] if guid in known}
+
+        for start in range(0, len(to_update), ANKICONNECT_NOTE_BATCH):
+            batch = to_update[start:start + ANKICONNECT_NOTE_BATCH]
+            actions = [('updateNoteFields', {'note': {'id': note_id, 'fields': dict(zip(model['fields'], fields))}})
+                       for _, note_id, fields, _ in batch]
+            for (guid, note_id, _, fields_hash), (_, action_error) in zip(batch, ankiconnect_multi(endpoint, actions)):
+                if action_error:
+                    report['notes_failed'] += 1
+                    report['failures'].append(f"Note {note_id}: {action_error}")
+                    continue
+                state['notes'][guid] = [note_id, fields_hash]
+                report['notes_updated'] += 1
+            progress(f"Updated {min(start + ANKICONNECT_NOTE_BATCH, len(to_update))} of {len(to_update)} notes...")
+
+        for start in range(0, len(to_add), ANKICONNECT_NOTE_BATCH):
+            batch = to_add[start:start + ANKICONNECT_NOTE_BATCH]
+            new_notes = [{'deckName': deck_name, 'modelName': model['name'], 'fields': dict(zip(model['fields'], fields)),
+                          'tags': tags, 'options': {'allowDuplicate': True}} for _, fields, tags, _ in batch]
+            [(new_ids, batch_error)] = ankiconnect_multi(endpoint, [('addNotes', {'notes': new_notes})])
+            if batch_error:
+                # Newer AnkiConnect versions refuse the whole batch over one bad note; add them singly instead.
+                new_ids = []
+                for note, (note_id, action_error) in zip(new_notes, ankiconnect_multi(
+                        endpoint, [('addNote', {'note': note}) for note in new_notes])):
+                    if action_error:
+                        report['failures'].append(f"'{note['fields'][model['fields'][0]]}': {action_error}")
+                    new_ids.append(note_id)
+            for (guid, _, _, fields_hash), note_id in zip(batch, new_ids):
+                if note_id is None:
+                    report['notes_failed'] += 1
+                    continue
+                state['notes'][guid] = [note_id, fields_hash]
+                report['notes_added'] += 1
+            progress(f"Added {min(start + ANKICONNECT_NOTE_BATCH, len(to_add))} of {len(to_add)} notes...")
+        error = None
+    except AnkiConnectError as e:
+        error = f"ERROR: {e}"
+    finally:
+        save_build_manifest(state, state_path)
+        report['seconds'] = round(time.perf_counter() - started, 3)
+    if error is None and (report['notes_failed'] or report['media_failed']):
+        error = (f"ERROR: {report['notes_failed']} note(s) and {report['media_failed']} media file(s) "
+                 f"could not be pushed.")
+    return report, error
+
+
+def format_push_report(report):
+    """Returns the lines of a short, human-readable summary of a push."""
+    lines = [
+        f"Deck: {report['deck_name']}  ·  note type {report['model']}",
+        f"Media: {report['media_sent']} sent ({report['media_bytes_sent'] / 1024:.0f} KB), "
+        f"{report['media_unchanged']} unchanged" + (f", {report['media_failed']} failed" if report['media_failed'] else ""),
+        f"Notes: {report['notes_added']} added, {report['notes_updated']} updated, "
+        f"{report['notes_unchanged']} unchanged" + (f", {report['notes_failed']} failed" if report['notes_failed'] else ""),
+        f"Time: {format_duration(report['seconds'])}",
+    ]
+    lines.extend(report['failures'][:10])
+    return lines
+
+
+# --- HEADLESS BATCH BUILD ---
+COUPLET_FILE_EXTENSIONS = ('.md', '.txt')
+HEADLESS_OUTPUT_DIR = os.path.join(os.path.expanduser("~"), "Documents", "Prismata")
+
+
+def collect_couplet_files(paths):
+    """Expands files and directories into a sorted, de-duplicated list of couplet files."""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for filename in sorted(os.listdir(path)):
+                full_path = os.path.join(path, filename)
+                if os.path.isfile(full_path) and filename.lower().endswith(COUPLET_FILE_EXTENSIONS):
+                    found.append(full_path)
+        elif os.path.isfile(path):
+            found.append(path)
+    unique_files, seen = [], set()
+    for path in found:
+        key = os.path.abspath(path)
+        if key not in seen:
+            seen.add(key)
+            unique_files.append(path)
+    return unique_files
+
+
+def build_deck_job(job):
+    """
+    Builds a single deck for the batch runner. Runs inside a worker process,
+    so it only takes and returns plain picklable data.
+    """
+    (input_path, deck_name, anki_settings, font_files, output_dir, svg_workers, svg_cache, art_engine, profile_dir,
+     incremental, mirror_media) = job
+    report = {}
+    profile_path = None
+    if profile_dir:
+        profile_path = os.path.join(profile_dir, f"{sanitize_for_filename(deck_name)}.pstats")
+    start = time.perf_counter()
+    try:
+        success, message, warnings, output_path = create_anki_deck(
+            input_path, deck_name, anki_settings, font_files, output_dir=output_dir, report=report,
+            svg_workers=svg_workers, svg_cache=svg_cache, art_engine=art_engine, profile_path=profile_path,
+            incremental=incremental, mirror_media=mirror_media
         )
-        anki_deck.add_note(anki_note)
+    except Exception as e:
+        success, message, warnings, output_path = False, f"ERROR: {type(e).__name__}: {e}", [], None
+    return {
+        'input': input_path,
+        'deck_name': deck_name,
+        'success': success,
+        'message': message,
+        'cards': report.get('cards', 0),
+        'svg_cache': report.get('svg_cache'),
+        'incremental': report.get('incremental'),
+        'duplicate_images_skipped': report.get('duplicate_images_skipped', 0),
+        'composition': report.get('composition'),
+        'timings': report.get('timings'),
+        'profile_path': report.get('profile_path'),
+        'warnings': warnings,
+        'output_path': output_path,
+        'wall_time': round(time.perf_counter() - start, 4),
+    }
 
-    if not anki_deck.notes:
-        return False, "No valid notes were processed. No file will be created.", warnings, None
 
-    anki_package = genanki.Package(anki_deck)
-    anki_package.media_files = [get_resource_path(f) for f in font_files]
-    anki_package.media_files.extend(generated_media_files)
+def run_batch_build(input_files, anki_settings, font_files, output_dir, workers=None, svg_workers=1,
+                    svg_cache=None, art_engine=None, profile_dir=None, incremental=True, mirror_media=False):
+    """Builds every input file into its own deck across a process pool, in input order."""
+    jobs = [(path, deck_name_from_path(path), anki_settings, font_files, output_dir, svg_workers, svg_cache,
+             art_engine, profile_dir, incremental, mirror_media) for path in input_files]
+    if workers == 1 or len(jobs) <= 1:
+        return [build_deck_job(job) for job in jobs]
+    with create_process_pool(workers) as executor:
+        return list(executor.map(build_deck_job, jobs))
+
+
+def run_compare_geometry(args):
+    """Prints the geometry engine comparison report for the cloze terms of the given files."""
+    if args.engine == 'numpy' and import_numpy() is None:
+        print(json.dumps({'error': "The 'numpy' geometry engine requires NumPy to be installed."}, indent=2))
+        return 2
+    terms = collect_cloze_terms(args.inputs)
+    print(json.dumps(compare_geometry_engines(terms, engine=args.engine), ensure_ascii=False, indent=2))
+    return 0
 
-    output_filename = f"{sanitize_for_filename(deck_name_str)}.apkg"
-    full_output_path = os.path.join(output_dir, output_filename)
-    anki_package.write_to_file(full_output_path)
 
-    return True, f"Successfully created '{output_filename}' with {notes_created} cards.", warnings, full_output_path
+def run_push(args):
+    results = []
+    for apkg_path in args.decks:
+        report, error = push_deck_to_anki(apkg_path, args.endpoint, full=args.full)
+        results.append(dict(report, apkg=apkg_path, error=error))
+    print(json.dumps({'decks': results, 'failed': sum(1 for r in results if r['error'])},
+                     ensure_ascii=False, indent=2))
+    return 0 if all(r['error'] is None for r in results) else 1
+
+
+def run_cli(argv):
+    """Command-line entry point. Returns the process exit code."""
+    parser = argparse.ArgumentParser(prog="anki_generator_gui.py",
+                                     description="Prisma Quaestionum headless tools.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help="Build .apkg decks from couplet files or folders.")
+    build_parser.add_argument('inputs', nargs='+', help="Couplet files (.md/.txt) or folders containing them.")
+    build_parser.add_argument('-o', '--output-dir', default=HEADLESS_OUTPUT_DIR,
+                              help="Folder for the .apkg files and media (default: %(default)s).")
+    build_parser.add_argument('-s', '--settings', default=get_resource_path(SETTINGS_FILE),
+                              help="Path to the PQ_Settings.md template file.")
+    build_parser.add_argument('-j', '--workers', type=int, default=None,
+                              help="Number of worker processes (default: one per CPU).")
+    build_parser.add_argument('--svg-workers', type=int, default=1,
+                              help="Worker processes composing images within each deck (default: %(default)s).")
+    build_parser.add_argument('--cache-dir', default=None,
+                              help=f"Image cache folder (default: {SVG_CACHE_DIRNAME} inside the output folder).")
+    build_parser.add_argument('--cache-max-mb', type=int, default=SVG_CACHE_MAX_BYTES // (1024 * 1024),
+                              help="Size limit of the image cache in MB (default: %(default)s).")
+    build_parser.add_argument('--no-cache', action='store_true', help="Do not use the image cache.")
+    build_parser.add_argument('--full-rebuild', action='store_true',
+                              help="Ignore each deck's build manifest and recompose every image not in the cache.")
+    build_parser.add_argument('--mirror-media', action='store_true',
+                              help="Also write every image to the media folder next to the decks.")
+    build_parser.add_argument('--geometry', choices=GEOMETRY_ENGINES, default=DEFAULT_ART_ENGINE['geometry'],
+                              help="Geometry engine used to measure shape gaps (default: %(default)s).")
+    build_parser.add_argument('--composition', choices=COMPOSITION_MODES, default=DEFAULT_ART_ENGINE['composition'],
+                              help="Re-check every relationship after each placement ('legacy') or only "
+                                   "those touched by a change ('incremental') (default: %(default)s).")
+    build_parser.add_argument('--svg', choices=SVG_FORMATS, default=DEFAULT_ART_ENGINE['svg'],
+                              help="SVG serializer; 'compact' writes rounded numbers and shared stroke "
+                                   "attributes for smaller media (default: %(default)s).")
+    build_parser.add_argument('--svg-precision', type=int, default=DEFAULT_ART_ENGINE['svg_precision'],
+                              help="Decimals kept by the compact serializer (default: %(default)s).")
+    build_parser.add_argument('--no-minify', action='store_true',
+                              help="Ship the card templates and styling exactly as written in the settings file.")
+    build_parser.add_argument('--profile-dir', default=None,
+                              help="Write a cProfile .pstats file per deck into this folder.")
+    build_parser.add_argument('--font', action='append', default=[], dest='fonts',
+                              help="Extra font file to package into every deck, after the bundled ones "
+                                   "(repeatable).")
+
+    compare_parser = subparsers.add_parser('compare-geometry',
+                                           help="Compare a geometry engine with the sampled reference.")
+    compare_parser.add_argument('inputs', nargs='+', help="Couplet files or folders whose cloze terms form the corpus.")
+    compare_parser.add_argument('--engine', choices=[e for e in GEOMETRY_GAP_FUNCTIONS if e != 'sampled'],
+                                default='exact', help="Engine to compare (default: %(default)s).")
+
+    startup_parser = subparsers.add_parser('startup-time',
+                                           help="Open the main window once and report the cold start time.")
+    startup_parser.add_argument('--budget-ms', type=float, default=STARTUP_BUDGET_MS,
+                                help="Exit with status 1 when the first paint takes longer (default: %(default)s).")
+
+    push_parser = subparsers.add_parser('push', help="Install built decks through AnkiConnect, sending only changes.")
+    push_parser.add_argument('decks', nargs='+', help=".apkg files written by 'build' or the Deck Generator.")
+    push_parser.add_argument('--endpoint', default=ANKICONNECT_DEFAULT_ENDPOINT,
+                             help="AnkiConnect URL (default: %(default)s).")
+    push_parser.add_argument('--full', action='store_true',
+                             help="Ignore the last push and resend every note and media file.")
+
+    args = parser.parse_args(argv)
+    if args.command == 'push':
+        return run_push(args)
+    if args.command == 'compare-geometry':
+        return run_compare_geometry(args)
+    if args.command == 'startup-time':
+        return run_startup_time(args)
+
+    input_files = collect_couplet_files(args.inputs)
+    if not input_files:
+        print(json.dumps({'error': "No couplet files found.", 'decks': []}, ensure_ascii=False, indent=2))
+        return 2
+
+    anki_settings, error = compile_settings_file(args.settings, minify=not args.no_minify)
+    if error:
+        print(json.dumps({'error': error, 'decks': []}, ensure_ascii=False, indent=2))
+        return 2
+
+    svg_cache = None
+    if not args.no_cache:
+        cache_dir = args.cache_dir or os.path.join(args.output_dir, SVG_CACHE_DIRNAME)
+        svg_cache = SvgCache(cache_dir, max_bytes=args.cache_max_mb * 1024 * 1024)
+
+    font_files = FONT_FILES + [os.path.abspath(path) for path in args.fonts]
+    missing_fonts = [path for path in font_files if not os.path.isfile(get_resource_path(path))]
+    if missing_fonts:
+        print(json.dumps({'error': f"Font files not found: {', '.join(missing_fonts)}", 'decks': []},
+                         ensure_ascii=False, indent=2))
+        return 2
+
+    start = time.perf_counter()
+    results = run_batch_build(input_files, anki_settings, font_files, args.output_dir, workers=args.workers,
+                              svg_workers=args.svg_workers, svg_cache=svg_cache,
+                              art_engine={'geometry': args.geometry, 'composition': args.composition,
+                                          'svg': args.svg, 'svg_precision': args.svg_precision},
+                              profile_dir=args.profile_dir, incremental=not args.full_rebuild,
+                              mirror_media=args.mirror_media)
+    summary = {
+        'decks': results,
+        'built': sum(1 for r in results if r['success']),
+        'failed': sum(1 for r in results if not r['success']),
+        'cards': sum(r['cards'] for r in results),
+        'wall_time': round(time.perf_counter() - start, 4),
+    }
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    return 0 if summary['failed'] == 0 else 1
 
 
 class ClickableLabel(QLabel):
@@ -720,14 +2712,302 @@ class ClickableLabel(QLabel):
         self.clicked.emit()
         super().mousePressEvent(event)
 
+# --- PROMPT CHUNKING ---
+PROMPT_CHUNK_WORDS = 3000  # Default word budget of each prompt when long text is split
+PROMPT_CHUNK_MIN_WORDS = 150  # calculate_n's divisor: a smaller budget would ask for no couplets
+PROMPT_CHUNK_SLICE = 0.02  # Seconds of chunking per event loop turn
+N_PLACEHOLDER_PATTERN = re.compile(r"(\(N\)\s*:\s*\[.*?\])", re.IGNORECASE)
+PARAGRAPH_BREAK_PATTERN = re.compile(r'\n[ \t]*\n\s*|\n(?=#{1,6}\s)')
+SENTENCE_BREAK_PATTERN = re.compile(r'(?<=[.!?…»"”])\s+')
+
+
+def build_prompt(base_prompt, materia_text, n_value):
+    """Fills the (N) placeholder of a prompt and appends the text it applies to."""
+    final_prompt = N_PLACEHOLDER_PATTERN.sub(f"(N): [{n_value}]", base_prompt)
+    return f"{final_prompt}\n\n{materia_text}"
+
+
+def iter_paragraphs(text):
+    """Streams the paragraphs of a text: blocks between blank lines, with Markdown headings starting a new one."""
+    start = 0
+    for match in PARAGRAPH_BREAK_PATTERN.finditer(text):
+        paragraph = text[start:match.start()].strip()
+        if paragraph:
+            yield paragraph
+        start = match.end()
+    paragraph = text[start:].strip()
+    if paragraph:
+        yield paragraph
+
+
+def split_to_budget(paragraph, max_words):
+    """
+    Yields (text, word_count) pieces of at most max_words words: the paragraph itself
+    if it fits, otherwise runs of whole sentences, and words for an overlong sentence.
+    """
+    word_count = len(paragraph.split())
+    if word_count <= max_words:
+        yield paragraph, word_count
+        return
+    sentences, words = [], 0
+    for sentence in SENTENCE_BREAK_PATTERN.split(paragraph):
+        sentence_words = sentence.split()
+        if words and words + len(sentence_words) > max_words:
+            yield ' '.join(sentences), words
+            sentences, words = [], 0
+        if len(sentence_words) > max_words:
+            for start in range(0, len(sentence_words), max_words):
+                piece = sentence_words[start:start + max_words]
+                yield ' '.join(piece), len(piece)
+            continue
+        sentences.append(sentence)
+        words += len(sentence_words)
+    if sentences:
+        yield ' '.join(sentences), words
+
+
+def iter_materia_chunks(text, max_words=PROMPT_CHUNK_WORDS):
+    """
+    Streams (chunk_text, word_count) for a long text, in order, each chunk at most
+    max_words words and cut between paragraphs where possible. A heading that
+    would end a chunk is carried over to the chunk holding its section.
+    """
+    parts, words = [], 0
+    for paragraph in iter_paragraphs(text):
+        for piece, piece_words in split_to_budget(paragraph, max_words):
+            if words and words + piece_words > max_words:
+                carried, carried_words = [], 0
+                if len(parts) > 1 and parts[-1].startswith('#'):
+                    carried_words = len(parts[-1].split())
+                    if carried_words + piece_words <= max_words:
+                        carried = [parts.pop()]
+                    else:
+                        carried_words = 0
+                yield '\n\n'.join(parts), words - carried_words
+                parts, words = carried, carried_words
+            parts.append(piece)
+            words += piece_words
+    if parts:
+        yield '\n\n'.join(parts), words
+
+
+# --- LLM ENDPOINT SUBMISSION ---
+LLM_DEFAULT_ENDPOINT = "http://localhost:8080/v1"  # Any OpenAI-compatible server, e.g. llama.cpp or vLLM
+LLM_CONCURRENCY = 4  # Prompts in flight at once
+LLM_MAX_ATTEMPTS = 4
+LLM_RETRY_DELAY = 2.0  # Seconds before the first retry, doubled after each failure
+LLM_TIMEOUT = 300  # Seconds without any data before a request is abandoned
+LLM_RETRY_STATUSES = {408, 409, 425, 429, 500, 502, 503, 504}
+LLM_API_KEY_VARIABLES = ('PQ_LLM_API_KEY', 'OPENAI_API_KEY')
+LLM_CANCELLED_MESSAGE = "Cancelled."
+
+
+class LlmRequestError(Exception):
+    """A failed request to the LLM endpoint; retryable says whether trying again may help."""
+    def __init__(self, message, retryable):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+def get_chat_completions_url(endpoint):
+    """Accepts a server's base URL ('.../v1') or its full chat completions URL."""
+    endpoint = endpoint.strip().rstrip('/')
+    return endpoint if endpoint.endswith('/chat/completions') else endpoint + '/chat/completions'
+
+
+def get_llm_api_key():
+    """Reads the endpoint's API key from the environment, so it is never stored with the settings."""
+    return next((os.environ[name] for name in LLM_API_KEY_VARIABLES if os.environ.get(name)), None)
+
+
+def stream_chat_completion(endpoint, model, prompt, on_delta=None, cancel_event=None, api_key=None,
+                           timeout=LLM_TIMEOUT):
+    """
+    Sends one prompt to an OpenAI-compatible chat completions endpoint and returns the
+    reply, passing each streamed piece to on_delta as it arrives. Servers that ignore
+    "stream" and answer with one JSON body work too. Raises LlmRequestError.
+    """
+    import http.client
+    import urllib.error
+    import urllib.request  # Deferred with the rest of the networking, so startup never loads it
+
+    body = {'messages': [{'role': 'user', 'content': prompt}], 'stream': True}
+    if model:
+        body['model'] = model
+    headers = {'Content-Type': 'application/json', 'Accept': 'text/event-stream'}
+    if api_key:
+        headers['Authorization'] = f"Bearer {api_key}"
+    request = urllib.request.Request(get_chat_completions_url(endpoint), data=json.dumps(body).encode('utf-8'),
+                                     headers=headers, method='POST')
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            if 'text/event-stream' not in response.headers.get('Content-Type', ''):
+                reply = json.loads(response.read().decode('utf-8'))['choices'][0]['message']['content'] or ''
+                if on_delta and reply:
+                    on_delta(reply)
+                return reply
+            pieces, finished = [], False
+            for raw_line in response:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise LlmRequestError(LLM_CANCELLED_MESSAGE, retryable=False)
+                line = raw_line.decode('utf-8').strip()
+                if not line.startswith('data:'):
+                    continue
+                data = line[len('data:'):].strip()
+                if data == '[DONE]':
+                    finished = True
+                    break
+                event = json.loads(data)
+                if event.get('error'):
+                    raise LlmRequestError(f"Server error: {event['error']}", retryable=True)
+                choices = event.get('choices') or [{}]
+                finished = finished or bool(choices[0].get('finish_reason'))
+                delta = (choices[0].get('delta') or {}).get('content')
+                if delta:
+                    pieces.append(delta)
+                    if on_delta:
+                        on_delta(delta)
+            if not finished:
+                raise LlmRequestError("The stream ended before the reply was complete.", retryable=True)
+            return ''.join(pieces)
+    except urllib.error.HTTPError as e:
+        raise LlmRequestError(f"HTTP {e.code} {e.reason}", retryable=e.code in LLM_RETRY_STATUSES) from e
+    except (urllib.error.URLError, http.client.HTTPException, OSError) as e:
+        raise LlmRequestError(f"Connection failed: {getattr(e, 'reason', e)}", retryable=True) from e
+    except (ValueError, KeyError, IndexError, TypeError, AttributeError) as e:
+        raise LlmRequestError(f"Unexpected reply from the endpoint: {e!r}", retryable=False) from e
+
+
+async def submit_prompts(prompts, endpoint, model=None, concurrency=LLM_CONCURRENCY, attempts=LLM_MAX_ATTEMPTS,
+                         on_delta=None, on_result=None, cancel_event=None, api_key=None,
+                         retry_delay=LLM_RETRY_DELAY):
+    """
+    Sends every prompt with at most `concurrency` requests in flight, retrying transient
+    failures with exponential backoff (a waiting retry does not hold a slot).
+    on_delta(index, text, received) receives the streamed pieces with the characters the
+    current attempt has received so far; a retry restarts that count with ('', 0).
+    on_result(index, reply, error) receives each finished prompt, in completion order.
+    Returns [(reply, error)] in prompt order.
+    """
+    import asyncio
+    import concurrent.futures
+
+    concurrency = max(1, concurrency)
+    asyncio.get_running_loop().set_default_executor(
+        concurrent.futures.ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='pq-llm'))
+    slots = asyncio.Semaphore(concurrency)
+
+    async def submit(index, prompt):
+        reply, error, delay = None, None, retry_delay
+        received = 0
+
+        def stream_delta(text):
+            nonlocal received
+            received += len(text)
+            on_delta(index, text, received)
+
+        for attempt in range(1, attempts + 1):
+            if cancel_event is not None and cancel_event.is_set():
+                reply, error = None, LLM_CANCELLED_MESSAGE
+                break
+            if received:
+                received = 0  # A retried stream starts over, so its partial text no longer counts
+                on_delta(index, '', 0)
+            try:
+                async with slots:
+                    reply = await asyncio.to_thread(stream_chat_completion, endpoint, model, prompt,
+                                                    stream_delta if on_delta else None, cancel_event, api_key)
+                error = None
+                break
+            except LlmRequestError as e:
+                reply, error = None, str(e)
+                if not e.retryable or attempt == attempts:
+                    break
+                await asyncio.sleep(delay)
+                delay *= 2
+        if on_result:
+            on_result(index, reply, error)
+        return reply, error
+
+    return await asyncio.gather(*(submit(index, prompt) for index, prompt in enumerate(prompts)))
+
+
+def run_prompt_submission(prompts, endpoint, **options):
+    """Runs submit_prompts to completion on a fresh event loop. Returns [(reply, error)] in prompt order."""
+    import asyncio
+    return asyncio.run(submit_prompts(prompts, endpoint, **options))
+
+
+def extract_couplet_lines(reply):
+    """
+    Returns the couplet lines of an LLM reply: every line with a ';' that is not the
+    header. Chatter, recalibration notes and code fences are dropped; malformed
+    couplets are kept so the Couplet Catcher can flag them.
+    """
+    lines = []
+    for line in reply.splitlines():
+        status = classify_couplet_line(line)
+        if status in ('valid', 'multiple_semicolons', 'missing_cloze'):
+            lines.append(line.strip())
+    return lines
+
+
+class PromptSubmissionThread(QThread):
+    """Runs run_prompt_submission off the GUI thread, reporting streamed text and each finished prompt."""
+    text_received = pyqtSignal(int, int)  # prompt index, characters its current attempt has received
+    prompt_finished = pyqtSignal(int, object, object)  # prompt index, reply, error
+    submission_finished = pyqtSignal(object)  # [(reply, error)] in prompt order
+
+    def __init__(self, prompts, endpoint, model, concurrency, parent=None):
+        super().__init__(parent)
+        self.prompts = prompts
+        self.endpoint = endpoint
+        self.model = model
+        self.concurrency = concurrency
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        """Stops the streams at their next line and skips the prompts not yet sent."""
+        self.cancel_event.set()
+
+    def run(self):
+        try:
+            results = run_prompt_submission(
+                self.prompts, self.endpoint, model=self.model, concurrency=self.concurrency,
+                on_delta=lambda index, text, received: self.text_received.emit(index, received),
+                on_result=self.prompt_finished.emit, cancel_event=self.cancel_event, api_key=get_llm_api_key()
+            )
+        except Exception as e:
+            results = [(None, f"Submission failed: {e}")] * len(self.prompts)
+        self.submission_finished.emit(results)
+
+
 # --- NEW PROMPT ASSISTANT LOGIC ---
 class PromptAssistantWidget(QWidget):
+    couplets_received = pyqtSignal(str)  # Couplet lines of answered prompts, in source order
+
     def __init__(self):
         super().__init__()
         self.prompts = self.load_prompts()
+        self.prompt_texts = {}
+        self.settings = QSettings(ORGANIZATION_NAME, APPLICATION_NAME)
         self.status_reset_timer = QTimer(self)
         self.status_reset_timer.setSingleShot(True)
         self.status_reset_timer.timeout.connect(self.reset_status)
+        # --- Chunked prompts: built in time slices, then copied one at a time ---
+        self.prompt_queue = []
+        self.next_prompt = 0
+        self.chunk_source = None
+        self.chunk_base_prompt = ""
+        self.chunk_timer = QTimer(self)
+        self.chunk_timer.setSingleShot(True)
+        self.chunk_timer.timeout.connect(self.build_next_prompts)
+        # --- Endpoint submission: replies are handed on in prompt order as they complete ---
+        self.submission_thread = None
+        self.submission_prompts = []
+        self.submission_results = {}
+        self.next_commit = 0
+        self.received_chars = {}  # Prompt index: characters received by its current attempt
         self.init_ui()
 
     # --- SURGICAL REFACTOR: Helper for centered buttons ---
@@ -742,7 +3022,7 @@ class PromptAssistantWidget(QWidget):
 
     # ... load_prompts and calculate_n are unchanged ...
     def load_prompts(self):
-        """Loads all .md prompts from the Prompts subdirectory."""
+        """Lists the .md prompts in the Prompts subdirectory; each one is read on first use."""
         prompts = {}
         prompt_dir_path = get_resource_path(PROMPTS_DIR)
         if not os.path.isdir(prompt_dir_path):
@@ -750,14 +3030,21 @@ class PromptAssistantWidget(QWidget):
 
         for filename in os.listdir(prompt_dir_path):
             if filename.startswith("Prism of Questions - ") and filename.endswith(".md"):
-                try:
-                    lang_name = filename.replace("Prism of Questions - ", "").replace(".md", "")
-                    with open(os.path.join(prompt_dir_path, filename), 'r', encoding='utf-8') as f:
-                        prompts[lang_name] = f.read()
-                except Exception as e:
-                    print(f"Error loading prompt {filename}: {e}")
+                lang_name = filename.replace("Prism of Questions - ", "").replace(".md", "")
+                prompts[lang_name] = os.path.join(prompt_dir_path, filename)
         return prompts
 
+    def get_prompt_text(self, lang_name):
+        """Returns the text of a prompt, reading it on first use. Returns None if it cannot be read."""
+        if lang_name not in self.prompt_texts:
+            try:
+                with open(self.prompts[lang_name], 'r', encoding='utf-8') as f:
+                    self.prompt_texts[lang_name] = f.read()
+            except Exception as e:
+                print(f"Error loading prompt {os.path.basename(self.prompts[lang_name])}: {e}")
+                return None
+        return self.prompt_texts[lang_name]
+
     def calculate_n(self, text_content):
         """Calculates the N value based on word count."""
         word_count = len(text_content.split())
@@ -789,9 +3076,46 @@ class PromptAssistantWidget(QWidget):
         lang_layout.addWidget(lang_label)
         lang_layout.addWidget(self.lang_combo)
 
+        # --- CHUNKING OPTION: one prompt per section of a long text ---
+        chunk_layout = QHBoxLayout()
+        self.chunk_checkbox = QCheckBox("Split long text into prompts of")
+        self.chunk_checkbox.setChecked(self.settings.value("chunk_prompts", False, type=bool))
+        self.chunk_words_spin = QSpinBox()
+        self.chunk_words_spin.setRange(PROMPT_CHUNK_MIN_WORDS, 100000)
+        self.chunk_words_spin.setSingleStep(500)
+        self.chunk_words_spin.setSuffix(" words")
+        self.chunk_words_spin.setValue(self.settings.value("chunk_words", PROMPT_CHUNK_WORDS, type=int))
+        self.chunk_words_spin.setEnabled(self.chunk_checkbox.isChecked())
+        self.chunk_checkbox.toggled.connect(self.save_chunk_settings)
+        self.chunk_words_spin.valueChanged.connect(self.save_chunk_settings)
+        chunk_layout.addWidget(self.chunk_checkbox)
+        chunk_layout.addWidget(self.chunk_words_spin)
+        chunk_layout.addStretch()
+
+        # --- ENDPOINT OPTION: send the prompts to an OpenAI-compatible server instead of copying ---
+        endpoint_layout = QHBoxLayout()
+        self.send_checkbox = QCheckBox("Send to endpoint")
+        self.send_checkbox.setChecked(self.settings.value("llm_send", False, type=bool))
+        self.endpoint_input = QLineEdit(self.settings.value("llm_endpoint", LLM_DEFAULT_ENDPOINT))
+        self.endpoint_input.setPlaceholderText(LLM_DEFAULT_ENDPOINT)
+        self.model_input = QLineEdit(self.settings.value("llm_model", ""))
+        self.model_input.setPlaceholderText("Model (optional)")
+        self.concurrency_spin = QSpinBox()
+        self.concurrency_spin.setRange(1, 32)
+        self.concurrency_spin.setSuffix(" parallel")
+        self.concurrency_spin.setValue(self.settings.value("llm_concurrency", LLM_CONCURRENCY, type=int))
+        self.send_checkbox.toggled.connect(self.save_endpoint_settings)
+        self.endpoint_input.editingFinished.connect(self.save_endpoint_settings)
+        self.model_input.editingFinished.connect(self.save_endpoint_settings)
+        self.concurrency_spin.valueChanged.connect(self.save_endpoint_settings)
+        endpoint_layout.addWidget(self.send_checkbox)
+        endpoint_layout.addWidget(self.endpoint_input, 3)
+        endpoint_layout.addWidget(self.model_input, 2)
+        endpoint_layout.addWidget(self.concurrency_spin)
+
         # --- WORKSPACE (STRETCH = 8) ---
         materia_label = QLabel("Paste Māteria Prima Below:")
-        self.materia_input = QTextEdit()
+        self.materia_input = QPlainTextEdit()  # Plain text keeps book-length pastes responsive
         self.materia_input.setPlaceholderText("Paste the text to process here...")
         self.materia_input.textChanged.connect(self.update_clear_button_visibility)
 
@@ -814,7 +3138,23 @@ class PromptAssistantWidget(QWidget):
         center_container = QWidget()
         center_layout = QHBoxLayout(center_container); center_layout.setContentsMargins(0,0,0,0)
         center_layout.addWidget(self.process_button)
+        self.copy_next_button = QPushButton("Copy Next")
+        self.copy_next_button.setObjectName("utilityButton")
+        self.copy_next_button.clicked.connect(self.copy_next_prompt)
+        self.export_prompts_button = QPushButton("Export All")
+        self.export_prompts_button.setObjectName("utilityButton")
+        self.export_prompts_button.clicked.connect(self.export_prompts)
+        self.cancel_send_button = QPushButton("Cancel")
+        self.cancel_send_button.setObjectName("utilityButton")
+        self.cancel_send_button.clicked.connect(self.cancel_submission)
+        self.cancel_send_button.hide()
         right_container = QWidget()
+        right_layout = QHBoxLayout(right_container); right_layout.setContentsMargins(0,0,0,0)
+        right_layout.addWidget(self.copy_next_button); right_layout.addWidget(self.export_prompts_button)
+        right_layout.addWidget(self.cancel_send_button)
+        right_layout.addStretch()
+        self.set_prompt_queue_visible(False)
+        self.save_endpoint_settings()
         button_layout = QHBoxLayout()
         button_layout.addWidget(left_container, 1)
         button_layout.addWidget(center_container, 0)
@@ -834,6 +3174,8 @@ class PromptAssistantWidget(QWidget):
 
         # --- FINAL LAYOUT ASSEMBLY WITH MASCULINE FIBONACCI RATIOS (1:8:5) ---
         layout.addLayout(lang_layout, stretch=1)
+        layout.addLayout(chunk_layout, stretch=0)
+        layout.addLayout(endpoint_layout, stretch=0)
         layout.addWidget(materia_label, stretch=0) # Labels don't stretch
         layout.addWidget(self.materia_input, stretch=8)
         layout.addLayout(action_area_layout, stretch=5)
@@ -841,13 +3183,42 @@ class PromptAssistantWidget(QWidget):
     def clear_fields(self):
         """Public method to clear input fields."""
         self.materia_input.clear()
+        self.reset_prompt_queue()
         self.status_label.setText("Ready.")
 
     def update_clear_button_visibility(self):
         """Shows or hides the clear button based on input."""
-        has_text = bool(self.materia_input.toPlainText().strip())
+        has_text = not self.materia_input.document().isEmpty()  # Never copies the whole text per keystroke
         self.clear_button.setVisible(has_text)
 
+    def save_chunk_settings(self):
+        self.chunk_words_spin.setEnabled(self.chunk_checkbox.isChecked())
+        self.settings.setValue("chunk_prompts", self.chunk_checkbox.isChecked())
+        self.settings.setValue("chunk_words", self.chunk_words_spin.value())
+
+    def save_endpoint_settings(self):
+        sending = self.send_checkbox.isChecked()
+        for widget in (self.endpoint_input, self.model_input, self.concurrency_spin):
+            widget.setEnabled(sending)
+        self.process_button.setText("Generate && Send Prompts" if sending else "Generate && Copy Prompt")
+        self.settings.setValue("llm_send", sending)
+        self.settings.setValue("llm_endpoint", self.endpoint_input.text().strip())
+        self.settings.setValue("llm_model", self.model_input.text().strip())
+        self.settings.setValue("llm_concurrency", self.concurrency_spin.value())
+
+    def set_prompt_queue_visible(self, visible):
+        self.copy_next_button.setVisible(visible)
+        self.export_prompts_button.setVisible(visible)
+
+    def reset_prompt_queue(self):
+        self.cancel_submission()
+        self.chunk_timer.stop()
+        self.chunk_source = None
+        self.prompt_queue = []
+        self.next_prompt = 0
+        self.process_button.setEnabled(True)
+        self.set_prompt_queue_visible(False)
+
     def reset_status(self):
         self.status_label.setText("Ready.")
 
@@ -865,16 +3236,161 @@ class PromptAssistantWidget(QWidget):
             self.status_reset_timer.start(3000)
             return
 
+        base_prompt = self.get_prompt_text(selected_lang)
+        if base_prompt is None:
+            self.status_label.setText(f"Error: Could not read the {selected_lang} prompt.")
+            self.status_reset_timer.start(3000)
+            return
+
+        self.reset_prompt_queue()
+        max_words = self.chunk_words_spin.value()
+        if self.chunk_checkbox.isChecked() and len(materia_text.split()) > max_words:
+            self.start_prompt_queue(materia_text, base_prompt, max_words)
+            return
+
         n_value = self.calculate_n(materia_text)
-        base_prompt = self.prompts[selected_lang]
-        final_prompt = re.sub(r"(\(N\)\s*:\s*\[.*?\])", f"(N): [{n_value}]", base_prompt, flags=re.IGNORECASE)
-        full_clipboard_text = f"{final_prompt}\n\n{materia_text}"
+        if self.send_checkbox.isChecked():
+            self.start_submission([{'prompt': build_prompt(base_prompt, materia_text, n_value),
+                                    'n': n_value, 'words': len(materia_text.split())}])
+            return
         clipboard = QApplication.clipboard()
-        clipboard.setText(full_clipboard_text)
+        clipboard.setText(build_prompt(base_prompt, materia_text, n_value))
 
         self.status_label.setText(f"Success! N={n_value}. Prompt copied to clipboard.")
         self.status_reset_timer.start(2000)
 
+    def start_prompt_queue(self, materia_text, base_prompt, max_words):
+        """Starts splitting the text into an ordered queue of prompts, a time slice at a time."""
+        self.status_reset_timer.stop()
+        self.chunk_source = iter_materia_chunks(materia_text, max_words)
+        self.chunk_base_prompt = base_prompt
+        self.process_button.setEnabled(False)
+        self.status_label.setText("Preparing prompts...")
+        self.chunk_timer.start(0)
+
+    def build_next_prompts(self):
+        """Adds prompts to the queue for one time slice, so a book-length text never freezes the window."""
+        deadline = time.perf_counter() + PROMPT_CHUNK_SLICE
+        for chunk, word_count in self.chunk_source:
+            n_value = self.calculate_n(chunk)
+            self.prompt_queue.append({'prompt': build_prompt(self.chunk_base_prompt, chunk, n_value),
+                                      'n': n_value, 'words': word_count})
+            if time.perf_counter() > deadline:
+                self.status_label.setText(f"Preparing prompts... {len(self.prompt_queue)} ready.")
+                self.chunk_timer.start(0)
+                return
+        self.chunk_source = None
+        if self.send_checkbox.isChecked():
+            self.start_submission(self.prompt_queue)
+            return
+        self.process_button.setEnabled(True)
+        self.set_prompt_queue_visible(True)
+        self.copy_next_prompt()
+
+    def copy_next_prompt(self):
+        """Copies the next prompt of the queue to the clipboard."""
+        total = len(self.prompt_queue)
+        if self.next_prompt >= total:
+            self.status_label.setText(f"All {total} prompts have been copied.")
+            return
+        entry = self.prompt_queue[self.next_prompt]
+        QApplication.clipboard().setText(entry['prompt'])
+        self.next_prompt += 1
+        self.copy_next_button.setEnabled(self.next_prompt < total)
+        self.status_label.setText(f"Prompt {self.next_prompt} of {total} copied (N={entry['n']}, "
+                                  f"{entry['words']:,} words).")
+
+    def export_prompts(self):
+        """Writes every prompt of the queue to a numbered .md file in a chosen folder."""
+        folder = QFileDialog.getExistingDirectory(self, "Export Prompts To", get_default_output_dir())
+        if not folder:
+            return
+        width = len(str(len(self.prompt_queue)))
+        try:
+            for number, entry in enumerate(self.prompt_queue, start=1):
+                filename = f"Prompt {number:0{width}d} - {sanitize_for_filename(self.lang_combo.currentText())}.md"
+                with open(os.path.join(folder, filename), 'w', encoding='utf-8') as f:
+                    f.write(entry['prompt'])
+        except OSError as e:
+            self.status_label.setText(f"Error exporting prompts: {e}")
+            return
+        self.status_label.setText(f"Exported {len(self.prompt_queue)} prompts to '{os.path.basename(folder)}'.")
+
+    def is_submitting(self):
+        return self.submission_thread is not None and self.submission_thread.isRunning()
+
+    def start_submission(self, entries):
+        """Sends the prompts to the endpoint on a worker thread; their couplets follow in prompt order."""
+        endpoint = self.endpoint_input.text().strip() or LLM_DEFAULT_ENDPOINT
+        self.status_reset_timer.stop()
+        self.submission_prompts = list(entries)
+        self.submission_results = {}
+        self.next_commit = 0
+        self.received_chars = {}
+        self.process_button.setEnabled(False)
+        self.set_prompt_queue_visible(False)
+        self.cancel_send_button.show()
+        self.status_label.setText(f"Sending {len(entries)} prompt(s) to {endpoint}...")
+        self.submission_thread = PromptSubmissionThread(
+            [entry['prompt'] for entry in entries], endpoint, self.model_input.text().strip() or None,
+            self.concurrency_spin.value(), self
+        )
+        self.submission_thread.text_received.connect(self.submission_progress)
+        self.submission_thread.prompt_finished.connect(self.prompt_answered)
+        self.submission_thread.submission_finished.connect(self.submission_finished)
+        self.submission_thread.start()
+
+    def cancel_submission(self):
+        if self.is_submitting():
+            self.submission_thread.cancel()
+            self.status_label.setText("Cancelling...")
+
+    def wait_for_submission(self):
+        """Cancels any running submission and blocks until its thread has stopped."""
+        if self.is_submitting():
+            self.submission_thread.cancel()
+            self.submission_thread.wait()
+
+    def submission_status(self):
+        return (f"Answered {self.next_commit + len(self.submission_results)} of {len(self.submission_prompts)} "
+                f"prompts ({sum(self.received_chars.values()):,} characters received)...")
+
+    def submission_progress(self, index, chars):
+        self.received_chars[index] = chars
+        self.status_label.setText(self.submission_status())
+
+    def prompt_answered(self, index, reply, error):
+        """Hands on the couplets of every answered prompt that has no unanswered prompt before it."""
+        self.submission_results[index] = (reply, error)
+        committed = []
+        while self.next_commit in self.submission_results:
+            reply, error = self.submission_results.pop(self.next_commit)
+            if reply:
+                committed.extend(extract_couplet_lines(reply))
+            self.next_commit += 1
+        if committed:
+            self.couplets_received.emit('\n'.join(committed))
+        self.status_label.setText(self.submission_status())
+
+    def submission_finished(self, results):
+        """Reports the outcome; failed prompts are left in the queue to copy or export by hand."""
+        self.submission_thread = None
+        self.cancel_send_button.hide()
+        self.process_button.setEnabled(True)
+        failed = [index for index, (reply, error) in enumerate(results) if error]
+        if not failed:
+            self.status_label.setText(f"Success! {len(results)} prompt(s) answered. "
+                                      f"Couplets sent to the Couplet Catcher.")
+            return
+        first_error = results[failed[0]][1]
+        self.prompt_queue = [self.submission_prompts[index] for index in failed]
+        self.next_prompt = 0
+        self.copy_next_button.setEnabled(True)
+        self.set_prompt_queue_visible(True)
+        numbers = ', '.join(str(index + 1) for index in failed[:10]) + ('...' if len(failed) > 10 else '')
+        self.status_label.setText(f"{len(failed)} of {len(results)} prompt(s) failed (#{numbers}: {first_error}). "
+                                  f"Copy Next / Export All now hold only the failed prompts.")
+
 # --- ADD THIS HELPER FUNCTION ---
 def open_file_externally(filepath):
     """Opens a file using the system's default application."""
@@ -885,6 +3401,114 @@ def open_file_externally(filepath):
     QDesktopServices.openUrl(url)
 
 
+# --- INCREMENTAL COUPLET VALIDATION ---
+COUPLET_VALIDATION_DELAY_MS = 150  # Typing pauses this long before the edited lines are checked
+COUPLET_VALIDATION_SLICE = 0.015  # Seconds of checking per event loop turn, so large pastes never block typing
+
+
+class CoupletValidator(QObject):
+    """
+    Checks every line of a couplet editor with classify_couplet_line, as the deck
+    builder will, and keeps running counts. block_states mirrors the document's
+    blocks, so an edit only re-checks the blocks it touched. Lines the builder
+    would skip are marked in the visible part of the editor.
+    """
+    counts_changed = pyqtSignal()
+
+    def __init__(self, editor):
+        super().__init__(editor)
+        self.editor = editor
+        self.document = editor.document()
+        self.block_states = [None] * self.document.blockCount()  # None until checked
+        self.counts = dict.fromkeys(['blank', 'header', 'valid', *COUPLET_SKIP_REASONS], 0)
+        self.scan_from = 0
+        self.marked_blocks = ()
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.validate_pending)
+        self.document.contentsChange.connect(self.on_contents_change)
+        editor.updateRequest.connect(self.mark_invalid_lines)  # Scrolling, resizing and repaints
+        self.timer.start(0)
+
+    @property
+    def invalid(self):
+        return sum(self.counts[reason] for reason in COUPLET_SKIP_REASONS)
+
+    @property
+    def pending(self):
+        return self.timer.isActive()
+
+    def on_contents_change(self, position, chars_removed, chars_added):
+        """Forgets the states of the blocks an edit replaced; the blocks around them keep theirs."""
+        first = self.document.findBlock(position).blockNumber()
+        end = min(position + chars_added, self.document.characterCount() - 1)
+        new_blocks = self.document.findBlock(end).blockNumber() - first + 1
+        old_blocks = new_blocks - (self.document.blockCount() - len(self.block_states))
+        for state in self.block_states[first:first + old_blocks]:
+            if state is not None:
+                self.counts[state] -= 1
+        self.block_states[first:first + old_blocks] = [None] * new_blocks
+        self.scan_from = min(self.scan_from, first)
+        self.timer.start(COUPLET_VALIDATION_DELAY_MS)
+
+    def validate_pending(self):
+        """Checks unchecked blocks for one time slice, then yields to the event loop."""
+        deadline = time.perf_counter() + COUPLET_VALIDATION_SLICE
+        states = self.block_states
+        index = self.scan_from
+        while index < len(states) and states[index] is not None:
+            index += 1
+        block = self.document.findBlockByNumber(index)
+        while block.isValid():
+            if states[index] is None:
+                state = classify_couplet_line(block.text())
+                states[index] = state
+                self.counts[state] += 1
+                if time.perf_counter() > deadline:
+                    break
+            index += 1
+            block = block.next()
+        self.scan_from = index
+        if index < len(states):
+            self.timer.start(0)
+        self.mark_invalid_lines()
+        self.counts_changed.emit()
+
+    def mark_invalid_lines(self, *_):
+        """Highlights the visible lines the deck builder would skip."""
+        marked = []
+        block = self.editor.firstVisibleBlock()
+        height = self.editor.viewport().height()
+        while block.isValid() and self.editor.blockBoundingGeometry(block).translated(
+                self.editor.contentOffset()).top() < height:
+            if self.block_states[block.blockNumber()] in COUPLET_SKIP_REASONS:
+                marked.append(block)
+            block = block.next()
+        numbers = tuple(block.blockNumber() for block in marked)
+        if numbers == self.marked_blocks:
+            return
+        self.marked_blocks = numbers
+        selections = []
+        for block in marked:
+            selection = QTextEdit.ExtraSelection()
+            selection.format.setBackground(QColor(229, 62, 62, 45))
+            selection.format.setProperty(QTextFormat.Property.FullWidthSelection, True)
+            selection.cursor = QTextCursor(block)
+            selections.append(selection)
+        self.editor.setExtraSelections(selections)
+
+    def first_invalid_line(self):
+        """Returns (line_number, reason) for the first checked line the builder would skip, or None."""
+        found = []
+        for reason in COUPLET_SKIP_REASONS:
+            if self.counts[reason]:
+                found.append((self.block_states.index(reason), reason))
+        if not found:
+            return None
+        index, reason = min(found)
+        return index + 1, COUPLET_SKIP_REASONS[reason]
+
+
 # --- FINAL, CORRECTED COUPLET CATCHER WIDGET ---
 class CoupletCatcherWidget(QWidget):
     def __init__(self):
@@ -922,8 +3546,9 @@ class CoupletCatcherWidget(QWidget):
         self.couplets_input.setPlaceholderText(
             "Paste couplets (Ctrl+V), click the button above,\nor double-click here to load a file."
         )
-        self.couplets_input.textChanged.connect(self.update_state)
         self.couplets_input.doubleClicked.connect(self.populate_from_file)
+        self.couplet_validator = CoupletValidator(self.couplets_input)
+        self.couplet_validator.counts_changed.connect(self.update_state)
 
         # --- Bottom layout with Save button and Status label ---
         self.save_button = QPushButton("Save Couplets as .md")
@@ -934,8 +3559,12 @@ class CoupletCatcherWidget(QWidget):
         self.status_label = QLabel("")
         self.status_label.setAlignment(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
 
+        self.validation_label = QLabel("")
+        self.validation_label.setObjectName("progressLabel")
+
         bottom_layout = QHBoxLayout()
         bottom_layout.addWidget(self.save_button)
+        bottom_layout.addWidget(self.validation_label)
         bottom_layout.addStretch()
         bottom_layout.addWidget(self.status_label)
 
@@ -965,8 +3594,7 @@ class CoupletCatcherWidget(QWidget):
         self.deck_name_input.setFocus()
 
     def populate_from_file(self):
-        docs_path = QStandardPaths.writableLocation(QStandardPaths.StandardLocation.DocumentsLocation)
-        default_open_path = os.path.join(docs_path, "Prismata")
+        default_open_path = get_default_output_dir()
         file_filter = "Markdown Files (*.md);;Text Files (*.txt)"
         filepath, _ = QFileDialog.getOpenFileName(self, "Select Couplet File", default_open_path, file_filter)
         if filepath:
@@ -979,15 +3607,25 @@ class CoupletCatcherWidget(QWidget):
                 self.couplets_input.setPlainText(f.read())
         except Exception as e:
             self.couplets_input.setPlainText(f"Error loading file:\n{e}")
-        base_name = os.path.splitext(os.path.basename(filepath))[0]
-        self.deck_name_input.setText(base_name.replace('_', ' ').replace('-', ' - '))
+        self.deck_name_input.setText(deck_name_from_path(filepath))
 
     def update_state(self):
-        """Single method to update the state of the save button and status label."""
+        """Single method to update the state of the save button, status and validation labels."""
+        validator = self.couplet_validator
+        valid, invalid = validator.counts['valid'], validator.invalid
         has_name = bool(self.deck_name_input.text().strip())
-        has_text = bool(self.couplets_input.toPlainText().strip())
+        has_text = valid + invalid + validator.counts['header'] > 0
         is_ready = has_name and has_text
 
+        if valid or invalid:
+            summary = f"{valid:,} cards · {invalid:,} skipped"
+            first_invalid = validator.first_invalid_line()
+            if first_invalid:
+                summary += f" (line {first_invalid[0]:,}: {first_invalid[1]})"
+            self.validation_label.setText(summary + (" · checking..." if validator.pending else ""))
+        else:
+            self.validation_label.setText("")
+
         self.save_button.setEnabled(is_ready)
 
         # Only show "Ready to save." if the timer isn't active
@@ -1034,10 +3672,84 @@ class ClickableLineEdit(QLineEdit):
 
 
 # --- SIMPLIFIED DECK GENERATOR WIDGET ---
+# --- BACKGROUND DECK GENERATION ---
+def format_duration(seconds):
+    """Formats a number of seconds as M:SS (or H:MM:SS for long builds)."""
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+
+class AnkiPushThread(QThread):
+    """Runs push_deck_to_anki off the GUI thread."""
+    log_message = pyqtSignal(str)
+    push_finished = pyqtSignal(object, object)  # report, error
+
+    def __init__(self, apkg_path, endpoint, parent=None):
+        super().__init__(parent)
+        self.apkg_path = apkg_path
+        self.endpoint = endpoint
+
+    def run(self):
+        try:
+            report, error = push_deck_to_anki(self.apkg_path, self.endpoint, progress_callback=self.log_message.emit)
+        except Exception as e:
+            report, error = None, f"ERROR: Push failed. Reason: {e}"
+        self.push_finished.emit(report, error)
+
+
+class DeckGenerationThread(QThread):
+    """Runs create_anki_deck off the GUI thread, streaming log lines and per-card progress."""
+    log_message = pyqtSignal(str)
+    progress = pyqtSignal(int, int)
+    generation_finished = pyqtSignal(object)
+
+    def __init__(self, input_filepath, deck_name, font_files, output_dir, profile_path=None, parent=None):
+        super().__init__(parent)
+        self.input_filepath = input_filepath
+        self.deck_name = deck_name
+        self.font_files = font_files
+        self.output_dir = output_dir
+        self.profile_path = profile_path
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        """Asks the build to stop at the next finished card."""
+        self.cancel_event.set()
+
+    def run(self):
+        result = {'success': False, 'message': "", 'warnings': [], 'output_path': None, 'report': {}}
+        self.log_message.emit(f"Loading settings from {SETTINGS_FILE}...")
+        anki_settings, error = compile_settings_file(get_resource_path(SETTINGS_FILE))
+        if error:
+            result['message'] = error
+            self.generation_finished.emit(result)
+            return
+
+        self.log_message.emit("Settings loaded successfully.\n")
+        self.log_message.emit(f"Processing '{os.path.basename(self.input_filepath)}'...")
+        svg_cache = SvgCache(os.path.join(self.output_dir, SVG_CACHE_DIRNAME))
+        try:
+            success, message, warnings, output_path = create_anki_deck(
+                self.input_filepath, self.deck_name, anki_settings, self.font_files, report=result['report'],
+                svg_workers=os.cpu_count(), svg_cache=svg_cache, profile_path=self.profile_path,
+                progress_callback=self.progress.emit, cancel_event=self.cancel_event
+            )
+        except Exception as e:
+            success, message, warnings, output_path = False, f"ERROR: Generation failed. Reason: {e}", [], None
+        result.update(success=success, message=message, warnings=warnings, output_path=output_path)
+        self.generation_finished.emit(result)
+
+
 class DeckGeneratorWidget(QWidget):
     def __init__(self, font_files, parent_app):
         super().__init__()
         self.input_filepath = ""
+        self.generation_thread = None
+        self.push_thread = None
+        self.generation_started_at = 0.0
         self.font_files = font_files
         self.parent_app = parent_app
         self.settings = QSettings(ORGANIZATION_NAME, APPLICATION_NAME)
@@ -1079,6 +3791,11 @@ class DeckGeneratorWidget(QWidget):
         self.generate_button.setObjectName("generateButton")
         self.generate_button.clicked.connect(self.run_generation)
 
+        self.cancel_button = QPushButton("Cancel Generation")
+        self.cancel_button.setObjectName("cancelButton")
+        self.cancel_button.clicked.connect(self.cancel_generation)
+        self.cancel_button.hide()
+
         self.clear_all_button = QPushButton("Clear All")
         self.clear_all_button.setObjectName("utilityButton")
         self.clear_all_button.clicked.connect(self.parent_app.clear_all_fields)
@@ -1088,13 +3805,21 @@ class DeckGeneratorWidget(QWidget):
         self.install_deck_button.clicked.connect(self.install_last_deck)
         self.install_deck_button.hide()
 
+        self.push_deck_button = QPushButton("Push to Anki")
+        self.push_deck_button.setObjectName("utilityButton")
+        self.push_deck_button.setToolTip("Send only the changed notes and media to Anki through AnkiConnect.")
+        self.push_deck_button.clicked.connect(self.push_last_deck)
+        self.push_deck_button.hide()
+
         left_container = QWidget()
         center_container = QWidget()
         center_layout = QHBoxLayout(center_container); center_layout.setContentsMargins(0,0,0,0)
         center_layout.addWidget(self.generate_button)
+        center_layout.addWidget(self.cancel_button)
         right_container = QWidget()
         right_layout = QHBoxLayout(right_container); right_layout.setContentsMargins(0,0,0,0)
         right_layout.addWidget(self.clear_all_button); right_layout.addWidget(self.install_deck_button)
+        right_layout.addWidget(self.push_deck_button)
         right_layout.addStretch()
 
         button_layout = QHBoxLayout()
@@ -1103,6 +3828,17 @@ class DeckGeneratorWidget(QWidget):
         button_layout.addWidget(right_container, 1)
 
 
+        # Progress for a running build: images done, images/sec and ETA.
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setTextVisible(False)
+        self.progress_bar.hide()
+        self.progress_label = QLabel("")
+        self.progress_label.setObjectName("progressLabel")
+        self.progress_label.hide()
+        config_layout.addWidget(self.progress_bar)
+        config_layout.addWidget(self.progress_label)
+
+
         # --- BLOCK 3: LOG/OUTPUT AREA (STRETCH = 8) ---
         self.log_box = QTextEdit()
         self.log_box.setReadOnly(True)
@@ -1116,14 +3852,15 @@ class DeckGeneratorWidget(QWidget):
         main_layout.addWidget(self.log_box, stretch=8)
 
     def select_file(self):
-        docs_path = QStandardPaths.writableLocation(QStandardPaths.StandardLocation.DocumentsLocation)
-        default_open_path = os.path.join(docs_path, "Prismata")
+        default_open_path = get_default_output_dir()
         file_filter = "Markdown Files (*.md);;Text Files (*.txt)"
         filepath, _ = QFileDialog.getOpenFileName(self, "Select Couplet File", default_open_path, file_filter)
         if filepath:
             self.handle_dropped_file(filepath)
 
     def run_generation(self):
+        if self.is_generating():
+            return
         self.log_box.clear()
         deck_name = self.deck_name_input.text().strip()
         if not self.input_filepath:
@@ -1133,40 +3870,93 @@ class DeckGeneratorWidget(QWidget):
             self.log_box.setText("ERROR: Please provide a deck name.")
             return
 
-        self.log_box.append(f"Loading settings from {SETTINGS_FILE}...")
-        QApplication.processEvents()
-
-        anki_settings, error = parse_settings_file(get_resource_path(SETTINGS_FILE))
-        if error:
-            self.log_box.append(error)
+        output_dir = get_default_output_dir()
+        self.report_basename = sanitize_for_filename(deck_name)
+        profile_path = None
+        if PROFILE_GENERATION:
+            profile_path = os.path.join(output_dir, REPORTS_DIRNAME, f"{self.report_basename}.pstats")
+
+        self.output_dir = output_dir
+        self.set_install_buttons_visible(False)
+        self.set_generation_running(True)
+        self.generation_thread = DeckGenerationThread(self.input_filepath, deck_name, self.font_files,
+                                                      output_dir, profile_path, parent=self)
+        self.generation_thread.log_message.connect(self.log_box.append)
+        self.generation_thread.progress.connect(self.update_progress)
+        self.generation_thread.generation_finished.connect(self.generation_finished)
+        self.generation_started_at = time.perf_counter()
+        self.generation_thread.start()
+
+    def is_generating(self):
+        return self.generation_thread is not None and self.generation_thread.isRunning()
+
+    def set_generation_running(self, running):
+        """Swaps Generate for Cancel and locks the inputs while a build is running."""
+        self.generate_button.setVisible(not running)
+        self.cancel_button.setVisible(running)
+        self.cancel_button.setEnabled(True)
+        self.select_file_button.setEnabled(not running)
+        self.deck_name_input.setEnabled(not running)
+        self.clear_all_button.setEnabled(not running)
+        self.progress_bar.setVisible(running)
+        self.progress_label.setVisible(running)
+        if running:
+            self.progress_bar.setRange(0, 0)  # Busy indicator until the first card is counted
+            self.progress_label.setText("Preparing cards...")
+
+    def update_progress(self, done, total):
+        if self.generation_thread is None or self.generation_thread.cancel_event.is_set():
             return
-
-        self.log_box.append("Settings loaded successfully.\n")
-        self.log_box.append(f"Processing '{os.path.basename(self.input_filepath)}'...")
-        QApplication.processEvents()
-
-        success, message, warnings, output_path = create_anki_deck(
-            self.input_filepath, deck_name, anki_settings, self.font_files
-        )
-
-        if success:
+        self.progress_bar.setRange(0, max(total, 1))
+        self.progress_bar.setValue(done)
+        elapsed = time.perf_counter() - self.generation_started_at
+        rate = done / elapsed if elapsed > 0 else 0.0
+        text = f"{done} / {total} images"
+        if rate > 0:
+            text += f"  ·  {rate:.1f} images/sec  ·  ETA {format_duration((total - done) / rate)}"
+        self.progress_label.setText(text)
+
+    def cancel_generation(self):
+        if self.is_generating():
+            self.generation_thread.cancel()
+            self.cancel_button.setEnabled(False)
+            self.progress_label.setText("Cancelling...")
+
+    def wait_for_generation(self):
+        """Cancels any running build and blocks until its thread has stopped."""
+        if self.is_generating():
+            self.generation_thread.cancel()
+            self.generation_thread.wait()
+
+    def generation_finished(self, result):
+        self.generation_thread = None
+        self.set_generation_running(False)
+        report = result['report']
+
+        if result['success']:
             self.log_box.append(f"\n--- GENERATION COMPLETE ---")
-            self.log_box.append(message)
-            self.parent_app.deck_generation_complete(output_path)
+            self.log_box.append(result['message'])
+            self.log_box.append("\n--- BUILD REPORT ---")
+            for line in format_build_report(report): self.log_box.append(line)
+            report_path = write_build_report(report, os.path.join(self.output_dir, REPORTS_DIRNAME, f"{self.report_basename}.json"))
+            if report_path:
+                self.log_box.append(f"Full report: {report_path}")
+            self.parent_app.deck_generation_complete(result['output_path'])
         else:
             self.log_box.append(f"\n--- GENERATION FAILED ---")
-            self.log_box.append(message)
-            self.install_deck_button.hide()
+            self.log_box.append(result['message'])
+            self.set_install_buttons_visible(False)
 
-        if warnings:
+        if result['warnings']:
             self.log_box.append("\n--- WARNINGS ---")
-            for warning in warnings: self.log_box.append(warning)
+            for warning in result['warnings']: self.log_box.append(warning)
 
     def handle_dropped_file(self, filepath):
+        if self.is_generating():
+            return
         self.input_filepath = filepath
         self.file_label.setText(os.path.basename(filepath))
-        base_name = os.path.splitext(os.path.basename(filepath))[0]
-        self.deck_name_input.setText(base_name.replace('_', ' ').replace('-', ' - '))
+        self.deck_name_input.setText(deck_name_from_path(filepath))
         self.log_box.setText(f"File '{os.path.basename(filepath)}' loaded. Ready to generate.")
 
     def clear_fields(self):
@@ -1174,15 +3964,45 @@ class DeckGeneratorWidget(QWidget):
         self.file_label.setText("No file selected.")
         self.deck_name_input.clear()
         self.log_box.clear()
-        self.install_deck_button.hide()
+        self.set_install_buttons_visible(False)
 
     def install_last_deck(self):
         if self.parent_app.last_deck_path:
             open_file_externally(self.parent_app.last_deck_path)
 
+    def set_install_buttons_visible(self, visible):
+        self.install_deck_button.setVisible(visible)
+        self.push_deck_button.setVisible(visible)
+
+    def push_last_deck(self):
+        """Pushes the last deck to Anki through AnkiConnect, logging the outcome."""
+        if not self.parent_app.last_deck_path or self.push_thread is not None:
+            return
+        endpoint = self.parent_app.settings.value("ankiconnect_endpoint", ANKICONNECT_DEFAULT_ENDPOINT)
+        self.push_deck_button.setEnabled(False)
+        self.generate_button.setEnabled(False)
+        self.log_box.append(f"\n--- PUSHING TO ANKI ({endpoint}) ---")
+        self.push_thread = AnkiPushThread(self.parent_app.last_deck_path, endpoint, parent=self)
+        self.push_thread.log_message.connect(self.log_box.append)
+        self.push_thread.push_finished.connect(self.push_finished)
+        self.push_thread.start()
+
+    def push_finished(self, report, error):
+        self.push_thread = None
+        self.push_deck_button.setEnabled(True)
+        self.generate_button.setEnabled(True)
+        if report is not None and report.get('seconds') is not None:
+            for line in format_push_report(report): self.log_box.append(line)
+        self.log_box.append(error if error else "Deck is up to date in Anki.")
+
+    def wait_for_push(self):
+        """Blocks until a running push has finished; its batches are short, so it is not interrupted."""
+        if self.push_thread is not None:
+            self.push_thread.wait()
+
 # --- ADD THIS NEW CUSTOM WIDGET CLASS ---
-class ClickableTextEdit(QTextEdit):
-    """A QTextEdit that emits a signal on double-click."""
+class ClickableTextEdit(QPlainTextEdit):
+    """A plain-text editor that emits a signal on double-click."""
     doubleClicked = pyqtSignal()
 
     def mouseDoubleClickEvent(self, event):
@@ -1202,9 +4022,7 @@ class AnkiGeneratorApp(QWidget):
         self.current_theme = self.settings.value("theme", "light")
         self.last_deck_path = None  # To store the path of the last generated deck
         # ------------------------------------
-        self.font_files = [
-
-        ]
+        self.font_files = list(FONT_FILES)
         self.load_fonts()
         self.init_ui()
         self.apply_styles() # This will now apply the loaded theme
@@ -1263,21 +4081,55 @@ class AnkiGeneratorApp(QWidget):
         tab_widget_layout.addWidget(self.content_pages)
         main_layout.addLayout(tab_widget_layout)
 
-        # --- Create and add the THREE pages ---
-        self.prompt_assistant_tab = PromptAssistantWidget()
-        self.couplet_catcher_tab = CoupletCatcherWidget()
-        self.deck_generator_tab = DeckGeneratorWidget(self.font_files, self)
-
-        self.tab_bar.addTab("Prompt Assistant")
-        self.content_pages.addWidget(self.prompt_assistant_tab)
-
-        self.tab_bar.addTab("Couplet Catcher")
-        self.content_pages.addWidget(self.couplet_catcher_tab)
-
-        self.tab_bar.addTab("Deck Generator")
-        self.content_pages.addWidget(self.deck_generator_tab)
-
-        self.tab_bar.currentChanged.connect(self.content_pages.setCurrentIndex)
+        # --- Add the THREE pages: each one is built the first time it is shown ---
+        self.tab_factories = [
+            ("Prompt Assistant", self.build_prompt_assistant),
+            ("Couplet Catcher", CoupletCatcherWidget),
+            ("Deck Generator", lambda: DeckGeneratorWidget(self.font_files, self)),
+        ]
+        self.tab_pages = [None] * len(self.tab_factories)
+        for title, _ in self.tab_factories:
+            self.tab_bar.addTab(title)
+            self.content_pages.addWidget(QWidget())  # Placeholder until the page is built
+
+        self.tab_bar.currentChanged.connect(self.show_tab)
+        self.show_tab(self.tab_bar.currentIndex())
+
+    def build_prompt_assistant(self):
+        page = PromptAssistantWidget()
+        page.couplets_received.connect(self.receive_couplets)
+        return page
+
+    def receive_couplets(self, text):
+        """Appends couplets answered by the endpoint to the Couplet Catcher, which validates them as usual."""
+        self.couplet_catcher_tab.couplets_input.appendPlainText(text)
+
+    def get_tab(self, index):
+        """Returns the page for a tab, building it in place of its placeholder on first use."""
+        if self.tab_pages[index] is None:
+            placeholder = self.content_pages.widget(index)
+            page = self.tab_factories[index][1]()
+            self.content_pages.insertWidget(index, page)
+            self.content_pages.removeWidget(placeholder)
+            placeholder.deleteLater()
+            self.tab_pages[index] = page
+        return self.tab_pages[index]
+
+    def show_tab(self, index):
+        self.get_tab(index)
+        self.content_pages.setCurrentIndex(index)
+
+    @property
+    def prompt_assistant_tab(self):
+        return self.get_tab(0)
+
+    @property
+    def couplet_catcher_tab(self):
+        return self.get_tab(1)
+
+    @property
+    def deck_generator_tab(self):
+        return self.get_tab(2)
 
     def restore_window_state(self):
         """Restores window size and position from settings."""
@@ -1294,6 +4146,11 @@ class AnkiGeneratorApp(QWidget):
 
     def closeEvent(self, event):
         """Overrides the close event to save window state."""
+        if self.tab_pages[0] is not None:
+            self.prompt_assistant_tab.wait_for_submission()
+        if self.tab_pages[2] is not None:
+            self.deck_generator_tab.wait_for_generation()
+            self.deck_generator_tab.wait_for_push()
         self.save_window_state()
         super().closeEvent(event)
 
@@ -1321,15 +4178,15 @@ class AnkiGeneratorApp(QWidget):
                 self.deck_generator_tab.central_area.setCurrentIndex(1)  # Switch to log view
 
     def clear_all_fields(self):
-        """Calls the clear method on each tab."""
-        self.prompt_assistant_tab.clear_fields()
-        self.couplet_catcher_tab.clear_fields()
-        self.deck_generator_tab.clear_fields()
+        """Calls the clear method on each tab that has been built."""
+        for page in self.tab_pages:
+            if page is not None:
+                page.clear_fields()
 
     def deck_generation_complete(self, filepath):
         """Callback function when a deck is successfully created."""
         self.last_deck_path = filepath
-        self.deck_generator_tab.install_deck_button.show()
+        self.deck_generator_tab.set_install_buttons_visible(True)
 
     def toggle_theme(self):
         """Switches the theme, saves the choice, and reapplies styles."""
@@ -1339,7 +4196,13 @@ class AnkiGeneratorApp(QWidget):
 
     # In class AnkiGeneratorApp
     def apply_styles(self):
-        # (The palette definitions are unchanged)
+        self.setStyleSheet(self.build_stylesheet(self.current_theme))
+        self.title_label.setToolTip(f"Switch to {'Light' if self.current_theme == 'dark' else 'Dark'} Mode")
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def build_stylesheet(theme):
+        """Returns the application stylesheet for a theme, built once per theme."""
         light_palette = {
             "bg": "#FFFFFF", "text": "#333333", "text_strong": "#000000",
             "text_subtle": "#444444", "border": "#cccccc", "input_bg": "#f0f0f0",
@@ -1352,7 +4215,7 @@ class AnkiGeneratorApp(QWidget):
             "input_bg_clickable": "#2D3748", "input_text_clickable": "#A0AEC0",
             "input_border_clickable": "#718096", "active_tab_border": "#F6AD55"
         }
-        palette = dark_palette if self.current_theme == "dark" else light_palette
+        palette = dark_palette if theme == "dark" else light_palette
 
         stylesheet = f"""
             #mainAppWindow {{ background-color: {palette["bg"]}; }}
@@ -1392,7 +4255,7 @@ class AnkiGeneratorApp(QWidget):
             }}
 
             /* --- CORRECTED TEXTEDIT STYLES --- */
-            QTextEdit {{
+            QTextEdit, QPlainTextEdit {{
                 background-color: {palette["input_bg"]}; border: 1px solid {palette["border"]};
                 padding: 10px; border-radius: 4px; color: {palette["text"]};
                 font-family: '', monospace; font-size: 14px;
@@ -1408,6 +4271,13 @@ class AnkiGeneratorApp(QWidget):
                 border: 1px dashed {palette["input_border_clickable"]};
             }}
 
+            QProgressBar {{
+                background-color: {palette["input_bg"]}; border: 1px solid {palette["border"]};
+                border-radius: 4px; max-height: 8px;
+            }}
+            QProgressBar::chunk {{ background-color: #2E8B57; border-radius: 4px; }}
+            #progressLabel {{ font-size: 13px; }}
+
             /* --- ADDED FOR POLISH --- */
             #separatorLine {{
                 border: none;
@@ -1435,14 +4305,75 @@ class AnkiGeneratorApp(QWidget):
             #processPromptButton {{ background-color: #E65100; }} #processPromptButton:hover {{ background-color: #FFB300; }}
             #saveCoupletsButton {{ background-color: #4A5568; }} #saveCoupletsButton:hover {{ background-color: #718096; }}
             #clearButton {{ background-color: #A0AEC0; }} #clearButton:hover {{ background-color: #CBD5E0; }}
+            #cancelButton {{ background-color: #C53030; }} #cancelButton:hover {{ background-color: #F56565; }}
             #utilityButton {{ font-size: 12px; padding: 8px 12px; background-color: #4A5568; }}
             #utilityButton:hover {{ background-color: #718096; }}
         """
-        self.setStyleSheet(stylesheet)
-        self.title_label.setToolTip(f"Switch to {'Light' if self.current_theme == 'dark' else 'Dark'} Mode")
+        return stylesheet
+
+
+# --- STARTUP TIME MEASUREMENT ---
+class FirstPaintWatcher(QObject):
+    """Records when a widget is first painted and stops the event loop."""
+    def __init__(self, app):
+        super().__init__()
+        self.app = app
+        self.painted_at = None
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Type.Paint and self.painted_at is None:
+            self.painted_at = time.perf_counter()
+            QTimer.singleShot(0, self.app.quit)
+        return False
+
+
+def run_startup_time(args):
+    """
+    Opens the main window as a normal launch would, waits for its first paint and
+    prints the time spent in each startup phase as JSON. Returns 1 over the budget.
+    """
+    phases = {'module': time.perf_counter() - _module_started}
+    mark = time.perf_counter()
+    QApplication.setHighDpiScaleFactorRoundingPolicy(Qt.HighDpiScaleFactorRoundingPolicy.PassThrough)
+    app = QApplication(sys.argv[:1])
+    phases['application'] = time.perf_counter() - mark
+
+    mark = time.perf_counter()
+    window = AnkiGeneratorApp()
+    phases['window'] = time.perf_counter() - mark
+
+    mark = time.perf_counter()
+    watcher = FirstPaintWatcher(app)
+    window.installEventFilter(watcher)
+    window.show()
+    QTimer.singleShot(10000, app.quit)  # Never hang when the platform does not paint
+    app.exec()
+    if watcher.painted_at is None:
+        print(json.dumps({'error': "The main window was never painted."}, indent=2))
+        return 2
+    phases['first_paint'] = watcher.painted_at - mark
+
+    total_ms = (watcher.painted_at - _module_started) * 1000
+    report = {
+        'phases_ms': {name: round(seconds * 1000, 1) for name, seconds in phases.items()},
+        'total_ms': round(total_ms, 1),
+        'budget_ms': args.budget_ms,
+        'within_budget': total_ms <= args.budget_ms,
+        'tabs_built': [title for (title, _), page in zip(window.tab_factories, window.tab_pages) if page is not None],
+        'deferred_modules': [name for name in ('genanki', 'pykakasi', 'numpy', 'sqlite3', 'zipfile', 'tempfile',
+                                               'cProfile', 'concurrent.futures', 'multiprocessing')
+                             if name not in sys.modules],
+    }
+    print(json.dumps(report, indent=2))
+    return 0 if report['within_budget'] else 1
 
 
 if __name__ == "__main__":
+    if getattr(sys, 'frozen', False):
+        import multiprocessing  # Only the PyInstaller build needs it this early
+        multiprocessing.freeze_support()  # Required for worker pools in the PyInstaller build
+    if len(sys.argv) > 1 and sys.argv[1] in ('build', 'compare-geometry', 'startup-time', 'push'):
+        sys.exit(run_cli(sys.argv[1:]))
     QApplication.setHighDpiScaleFactorRoundingPolicy(Qt.HighDpiScaleFactorRoundingPolicy.PassThrough)
     app = QApplication(sys.argv)
     window = AnkiGeneratorApp()
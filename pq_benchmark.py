@@ -0,0 +1,659 @@
+"""
+Benchmark and equivalence suite for the Prisma Quaestionum art and deck pipeline.
+
+    python pq_benchmark.py corpus --language japanese --lines 5000 -o deck.md
+    python pq_benchmark.py phases --language mixed --count 2000 --composition incremental
+    python pq_benchmark.py deck --lines 100 1000 10000 --svg-workers 8
+    python pq_benchmark.py golden write reference.json --count 5000
+    python pq_benchmark.py golden check reference.json --count 5000 --geometry exact --tolerance 0.5
+    python pq_benchmark.py minify
+    python pq_benchmark.py llm --prompts 40 --concurrency 1 4 8 --token-delay 0.01 --fail-every 5
+    python pq_benchmark.py anki --lines 2000 --edits 20
+
+Every command prints a JSON report. Corpora are generated from a fixed seed, so the
+same arguments always produce the same terms on every machine.
+"""
+import argparse
+import hashlib
+import http.server
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+
+import anki_generator_gui as pq
+
+# --- SYNTHETIC CORPUS GENERATOR ---
+LANGUAGES = ['latin', 'french', 'kana', 'kanji', 'mixed']
+
+LATIN_SYLLABLES = ['a', 'ae', 'am', 'an', 'ar', 'ci', 'cu', 'de', 'di', 'do', 'e', 'es', 'ex', 'fa', 'fi',
+                   'ge', 'gra', 'i', 'in', 'is', 'la', 'li', 'lu', 'ma', 'me', 'mi', 'mo', 'mu', 'na', 'ne',
+                   'ni', 'no', 'or', 'pa', 'pe', 'po', 'pri', 'qua', 'que', 'ra', 're', 'ri', 'ro', 'sa',
+                   'se', 'si', 'ta', 'te', 'ti', 'tu', 'um', 'us', 've', 'vi', 'vo']
+LATIN_ENDINGS = ['us', 'um', 'a', 'ae', 'is', 'em', 'es', 'orum', 'ibus', 'at', 'unt', 'ere']
+
+FRENCH_SYLLABLES = ['bé', 'ca', 'ché', 'co', 'dé', 'fa', 'gé', 'la', 'lè', 'ma', 'mè', 'na', 'ni', 'pa',
+                    'pê', 'qui', 'ra', 'ré', 'sa', 'sé', 'ta', 'té', 'tré', 'va', 'vê', 'ço', 'ou', 'oi',
+                    'an', 'en', 'on', 'in', 'eau', 'ai']
+FRENCH_ENDINGS = ['', 'e', 's', 'ent', 'er', 'ez', 'ée', 'ion', 'ité', 'ment']
+FRENCH_ARTICLES = ['le ', 'la ', 'les ', 'un ', 'une ', 'des ', "l'", "d'", '']
+
+HIRAGANA = [chr(c) for c in range(0x3042, 0x3094)]
+KATAKANA = [chr(c) for c in range(0x30A2, 0x30F4)]
+KANJI = list('日月火水木金土山川田人口目耳手足力男女子学生先年上下中大小本文字語国語時間'
+             '東西南北春夏秋冬雨雪花草森林空海天気電車道路家族友愛心思言話読書見聞食飲')
+
+
+def generate_term(rng, language):
+    """Returns one synthetic cloze term in the given language."""
+    if language == 'mixed':
+        language = rng.choice(LANGUAGES[:-1])
+    if language == 'latin':
+        words = [''.join(rng.choice(LATIN_SYLLABLES) for _ in range(rng.randint(1, 3))) + rng.choice(LATIN_ENDINGS)
+                 for _ in range(rng.choice([1, 1, 1, 2, 3]))]
+        return ' '.join(words)
+    if language == 'french':
+        words = [''.join(rng.choice(FRENCH_SYLLABLES) for _ in range(rng.randint(1, 3))) + rng.choice(FRENCH_ENDINGS)
+                 for _ in range(rng.choice([1, 1, 2]))]
+        return rng.choice(FRENCH_ARTICLES) + ' '.join(words)
+    if language == 'kana':
+        alphabet = HIRAGANA if rng.random() < 0.5 else KATAKANA
+        return ''.join(rng.choice(alphabet) for _ in range(rng.randint(2, 6)))
+    # Kanji compounds, sometimes followed by hiragana okurigana.
+    term = ''.join(rng.choice(KANJI) for _ in range(rng.randint(1, 3)))
+    if rng.random() < 0.4:
+        term += ''.join(rng.choice(HIRAGANA) for _ in range(rng.randint(1, 2)))
+    return term
+
+
+def generate_terms(language, count, seed=0):
+    rng = random.Random(f"{seed}:{language}")
+    return [generate_term(rng, language) for _ in range(count)]
+
+
+def generate_couplets(language, line_count, seed=0):
+    """Returns the text of a synthetic couplet file with a header and line_count couplets."""
+    lines = ["Question;Answer"]
+    for number, term in enumerate(generate_terms(language, line_count, seed), start=1):
+        lines.append(f"Quid est res {number}?;Haec est *{term}* in sententia {number}.")
+    return '\n'.join(lines)
+
+
+def load_terms(args):
+    """Returns the corpus terms: cloze terms from --inputs files if given, else generated ones."""
+    if args.inputs:
+        return pq.collect_cloze_terms(args.inputs)
+    return generate_terms(args.language, args.count, args.seed)
+
+
+def get_art_engine(args):
+    art_engine, error = pq.resolve_art_engine({'geometry': args.geometry, 'composition': args.composition,
+                                               'svg': args.svg, 'svg_precision': args.svg_precision})
+    if error:
+        sys.exit(error)
+    return art_engine
+
+
+# --- BENCHMARKS ---
+def bench_phases(terms, art_engine):
+    """Composes and renders every term, timing each composition phase."""
+    stats = {}
+    svg_bytes = 0
+    start = time.perf_counter()
+    seed_strings = pq.get_seed_strings(terms)
+    romaji_time = time.perf_counter() - start
+    for term in terms:
+        plan = pq.compose_term(term, seed_string=seed_strings[term], art_engine=art_engine, stats=stats)
+        render_start = time.perf_counter()
+        svg_bytes += len(pq.render_term_svg(term, plan, art_engine=art_engine).encode('utf-8'))
+        pq.add_phase_time(stats, 'render', render_start)
+    total_time = time.perf_counter() - start
+
+    phases = {'romaji': romaji_time}
+    phases.update({key[len('time_'):]: value for key, value in stats.items() if key.startswith('time_')})
+    return {
+        'art_engine': art_engine,
+        'terms': len(terms),
+        'unique_terms': len(seed_strings),
+        'total_s': round(total_time, 4),
+        'terms_per_s': round(len(terms) / total_time, 1) if total_time else None,
+        'phases_ms': {phase: round(seconds * 1000, 2) for phase, seconds in phases.items()},
+        'phase_share': {phase: round(seconds / total_time, 3) for phase, seconds in phases.items()},
+        'pair_evaluations': stats.get('pair_evaluations', 0),
+        'pair_evaluations_saved': stats.get('pair_evaluations_saved', 0),
+        'svg_bytes_per_term': round(svg_bytes / len(terms), 1) if terms else 0,
+    }
+
+
+def bench_deck(language, line_count, seed, art_engine, svg_workers, settings):
+    """Builds a synthetic deck end to end in a scratch folder and reports the stage timings."""
+    couplets = generate_couplets(language, line_count, seed)
+    with tempfile.TemporaryDirectory() as output_dir:
+        report = {}
+        start = time.perf_counter()
+        success, message, warnings, output_path = pq.create_anki_deck(
+            couplets, f"Benchmark {line_count}", settings, [], output_dir=output_dir, report=report,
+            svg_workers=svg_workers, art_engine=art_engine
+        )
+        wall_time = time.perf_counter() - start
+        package_bytes = os.path.getsize(output_path) if success else 0
+    return {
+        'lines': line_count,
+        'success': success,
+        'message': message,
+        'cards': report.get('cards', 0),
+        'wall_s': round(wall_time, 4),
+        'cards_per_s': round(report.get('cards', 0) / wall_time, 1) if wall_time else None,
+        'stages_s': {key[len('time_'):]: round(value, 4) for key, value in report.get('timings', {}).items()},
+        'package_bytes': package_bytes,
+        'pair_evaluations': report.get('composition', {}).get('pair_evaluations', 0),
+    }
+
+
+# --- GOLDEN OUTPUT ---
+NUMBER_PATTERN = re.compile(r'-?\d+(?:\.\d+)?(?:e[-+]?\d+)?')
+
+
+def fingerprint_svg(svg_string):
+    """Hashes an SVG, plus its numbers and numberless skeleton for tolerance comparisons."""
+    skeleton = NUMBER_PATTERN.sub('#', svg_string)
+    return {
+        'sha256': hashlib.sha256(svg_string.encode('utf-8')).hexdigest(),
+        'skeleton': hashlib.sha256(skeleton.encode('utf-8')).hexdigest(),
+        'numbers': [float(n) for n in NUMBER_PATTERN.findall(svg_string)],
+    }
+
+
+def render_fingerprints(terms, art_engine):
+    seed_strings = pq.get_seed_strings(terms)
+    return {term: fingerprint_svg(pq.render_term_svg(
+                term, pq.compose_term(term, seed_string=seed_strings[term], art_engine=art_engine),
+                art_engine=art_engine))
+            for term in seed_strings}
+
+
+def compare_fingerprints(reference, current, tolerance):
+    identical, within_tolerance, differing = 0, 0, []
+    for term, expected in reference.items():
+        actual = current.get(term)
+        if actual is None:
+            differing.append(term)
+        elif actual['sha256'] == expected['sha256']:
+            identical += 1
+        elif (tolerance > 0 and actual['skeleton'] == expected['skeleton'] and
+              all(abs(a - b) <= tolerance for a, b in zip(actual['numbers'], expected['numbers']))):
+            within_tolerance += 1
+        else:
+            differing.append(term)
+    return {
+        'terms': len(reference),
+        'identical': identical,
+        'within_tolerance': within_tolerance,
+        'differing': len(differing),
+        'differing_examples': differing[:20],
+    }
+
+
+# --- TEMPLATE MINIFIER GOLDEN CASES ---
+MINIFY_GOLDEN_CASES = [
+    ('whitespace', '<div>\n    a   b\n</div>', '<div>\na b\n</div>'),
+    ('comment', '<div>a</div> <!-- note --> <div>b</div>', '<div>a</div> <div>b</div>'),
+    ('script tag inside a comment', '<!-- loads <script> later -->\n<div>a  b</div>\n<script>var x = 1;</script>',
+     '<div>a b</div>\n<script>var x = 1;</script>'),
+    ('style tag inside a comment', '<!-- <style> -->\n<p>x  y</p>\n<style> p { color: red; } </style>',
+     '<p>x y</p>\n<style>p{color:red}</style>'),
+    ('comment markers inside a script', '<script>var s = "<!-- x -->";  // note\n</script>',
+     '<script>var s = "<!-- x -->";</script>'),
+]
+
+
+def check_minify_golden():
+    """Runs minify_template_html over the golden cases and reports every output that differs."""
+    failures = []
+    for name, template, expected in MINIFY_GOLDEN_CASES:
+        actual = pq.minify_template_html(template)
+        if actual != expected:
+            failures.append({'case': name, 'expected': expected, 'actual': actual})
+    return {'cases': len(MINIFY_GOLDEN_CASES), 'failed': len(failures), 'failures': failures}
+
+
+# --- LLM ENDPOINT STUB ---
+STUB_PROMPT_PATTERN = re.compile(r'STUB PROMPT (\d+)')
+
+
+def generate_stub_couplets(number, count):
+    """The couplets the stub server answers prompt `number` with, in the format the deck builder accepts."""
+    return [f"Quid est res {number}.{line}?;Haec est *{term}* in sententia {line}."
+            for line, term in enumerate(generate_terms('mixed', count, seed=number))]
+
+
+class StubCompletionServer(http.server.ThreadingHTTPServer):
+    """
+    A local OpenAI-compatible chat completions server. Every reply streams a line of
+    chatter and then couplets for its prompt, one line per token_delay seconds. The
+    first attempt of every fail_every-th prompt fails: alternately with HTTP 503, or
+    by dropping the connection halfway through the stream.
+    """
+    daemon_threads = True
+
+    def __init__(self, tokens, token_delay, fail_every):
+        super().__init__(('127.0.0.1', 0), StubCompletionHandler)
+        self.tokens = tokens
+        self.token_delay = token_delay
+        self.fail_every = fail_every
+        self.lock = threading.Lock()
+        self.attempts = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.failures = 0
+
+    @property
+    def endpoint(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+
+class StubCompletionHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.0'
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        number = int(STUB_PROMPT_PATTERN.search(body['messages'][0]['content']).group(1))
+        with server.lock:
+            attempt = server.attempts[number] = server.attempts.get(number, 0) + 1
+            fails = server.fail_every and number % server.fail_every == 0 and attempt == 1
+            if fails:
+                server.failures += 1
+                if (number // server.fail_every) % 2 == 0:
+                    self.send_error(503)
+                    return
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.end_headers()
+            reply = [f"Here are the couplets for prompt {number}.\n"]
+            reply += [f"{couplet}\n" for couplet in generate_stub_couplets(number, server.tokens)]
+            if fails:
+                reply = reply[:len(reply) // 2]
+            for token in reply:
+                time.sleep(server.token_delay)
+                event = {'choices': [{'index': 0, 'delta': {'content': token}}]}
+                self.wfile.write(f"data: {json.dumps(event)}\n\n".encode('utf-8'))
+                self.wfile.flush()
+            if not fails:
+                self.wfile.write(b"data: [DONE]\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The client cancelled mid-stream
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+
+def bench_llm(prompt_count, concurrency_levels, tokens, token_delay, fail_every, retry_delay):
+    """
+    Times submit_prompts against the stub server and checks that the replies come back
+    in prompt order, hold only couplets the deck builder accepts, and that streamed
+    text from failed attempts is not counted twice.
+    """
+    prompts = [f"STUB PROMPT {number}" for number in range(prompt_count)]
+    expected = [couplet for number in range(prompt_count) for couplet in generate_stub_couplets(number, tokens)]
+    runs = []
+    for concurrency in concurrency_levels:
+        server = StubCompletionServer(tokens, token_delay, fail_every)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        received = {}
+        started = time.perf_counter()
+        results = pq.run_prompt_submission(prompts, server.endpoint, concurrency=concurrency,
+                                           retry_delay=retry_delay,
+                                           on_delta=lambda index, text, chars: received.__setitem__(index, chars))
+        elapsed = time.perf_counter() - started
+        server.shutdown()
+        server.server_close()
+        couplets = [line for reply, _ in results if reply for line in pq.extract_couplet_lines(reply)]
+        runs.append({
+            'concurrency': concurrency,
+            'seconds': round(elapsed, 3),
+            'prompts_per_second': round(prompt_count / elapsed, 2),
+            'max_in_flight': server.max_in_flight,
+            'retried': server.failures,
+            'failed': sum(1 for _, error in results if error),
+            'in_order': couplets == expected,
+            'valid_couplets': sum(1 for couplet in couplets if pq.classify_couplet_line(couplet) == 'valid'),
+            'received_chars_match': sum(received.values()) == sum(len(reply or '') for reply, _ in results),
+        })
+    return {'prompts': prompt_count, 'tokens_per_reply': tokens + 1, 'token_delay': token_delay, 'runs': runs}
+
+
+# --- ANKICONNECT MOCK ---
+ANKI_QUERY_PATTERN = re.compile(r'"deck:((?:\\.|[^"\\])*)" "note:((?:\\.|[^"\\])*)"')
+
+
+def unescape_anki_search(term):
+    return re.sub(r'\\(.)', r'\1', term)
+
+
+class MockAnkiConnectServer(http.server.ThreadingHTTPServer):
+    """
+    A local AnkiConnect stand-in holding its collection in memory. It answers the
+    actions push_deck_to_anki uses, including 'multi', and counts every request,
+    action and byte it receives.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), MockAnkiConnectHandler)
+        self.lock = threading.Lock()
+        self.models = {}
+        self.decks = set()
+        self.media = {}
+        self.notes = {}  # note ID: {'deck', 'model', 'fields', 'tags'}
+        self.next_note_id = 1500000000000
+        self.requests = 0
+        self.bytes_received = 0
+        self.actions = {}
+
+    @property
+    def endpoint(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def reset_counters(self):
+        self.requests = 0
+        self.bytes_received = 0
+        self.actions = {}
+
+    def add_note(self, note):
+        if note['modelName'] not in self.models or note['deckName'] not in self.decks:
+            raise ValueError("model or deck was not found")
+        self.next_note_id += 1
+        self.notes[self.next_note_id] = {'deck': note['deckName'], 'model': note['modelName'],
+                                         'fields': dict(note['fields']), 'tags': list(note.get('tags', []))}
+        return self.next_note_id
+
+    def perform(self, action, params):
+        """Runs one action and returns its result. Raises ValueError as AnkiConnect reports errors."""
+        self.actions[action] = self.actions.get(action, 0) + 1
+        if action == 'version':
+            return pq.ANKICONNECT_VERSION
+        if action == 'multi':
+            results = []
+            for entry in params['actions']:
+                try:
+                    results.append({'result': self.perform(entry['action'], entry.get('params', {})), 'error': None})
+                except (ValueError, KeyError) as e:
+                    results.append({'result': None, 'error': str(e)})
+            return results
+        if action == 'modelNames':
+            return sorted(self.models)
+        if action == 'createModel':
+            self.models[params['modelName']] = {'fields': params['inOrderFields'], 'css': params['css'],
+                                                'templates': params['cardTemplates']}
+            return {'name': params['modelName']}
+        if action == 'updateModelTemplates':
+            self.models[params['model']['name']]['templates'] = params['model']['templates']
+            return None
+        if action == 'updateModelStyling':
+            self.models[params['model']['name']]['css'] = params['model']['css']
+            return None
+        if action == 'createDeck':
+            self.decks.add(params['deck'])
+            return 1
+        if action == 'storeMediaFile':
+            import base64
+            self.media[params['filename']] = base64.b64decode(params['data'])
+            return params['filename']
+        if action == 'findNotes':
+            deck, model = (unescape_anki_search(term) for term in ANKI_QUERY_PATTERN.fullmatch(params['query']).groups())
+            return [note_id for note_id, note in self.notes.items()
+                    if note['deck'] == deck and note['model'] == model]
+        if action == 'notesInfo':
+            return [{'noteId': note_id, 'modelName': self.notes[note_id]['model'], 'tags': self.notes[note_id]['tags'],
+                     'fields': {name: {'value': value, 'order': order}
+                                for order, (name, value) in enumerate(self.notes[note_id]['fields'].items())}}
+                    if note_id in self.notes else {} for note_id in params['notes']]
+        if action == 'addNotes':
+            return [self.add_note(note) for note in params['notes']]
+        if action == 'addNote':
+            return self.add_note(params['note'])
+        if action == 'updateNoteFields':
+            note = self.notes.get(params['note']['id'])
+            if note is None:
+                raise ValueError("Note was not found")
+            note['fields'].update(params['note']['fields'])
+            return None
+        raise ValueError(f"unsupported action: {action}")
+
+
+class MockAnkiConnectHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        payload = self.rfile.read(int(self.headers['Content-Length']))
+        request = json.loads(payload)
+        with server.lock:
+            server.requests += 1
+            server.bytes_received += len(payload)
+            try:
+                reply = {'result': server.perform(request['action'], request.get('params', {})), 'error': None}
+            except (ValueError, KeyError) as e:
+                reply = {'result': None, 'error': str(e)}
+        data = json.dumps(reply).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def edit_couplets(couplets, edits, seed=0):
+    """Changes the cloze term of `edits` evenly spread lines, as a user revising a deck would."""
+    lines = couplets.split('\n')
+    step = max(1, (len(lines) - 1) // max(edits, 1))
+    for number in range(1, len(lines), step)[:edits]:
+        lines[number] = lines[number].replace('* in', f'{seed}novum* in', 1)
+    return '\n'.join(lines)
+
+
+def timed_push(server, apkg_path):
+    server.reset_counters()
+    report, error = pq.push_deck_to_anki(apkg_path, server.endpoint)
+    keys = ('model', 'media_sent', 'media_unchanged', 'media_failed', 'notes_added', 'notes_updated',
+            'notes_unchanged', 'notes_failed', 'seconds')
+    return dict({key: report.get(key) for key in keys}, error=error, requests=server.requests,
+                bytes_sent=server.bytes_received, actions=server.actions)
+
+
+def collection_matches(server, apkg_path):
+    """True if the mock holds exactly the notes and media of the .apkg."""
+    contents, _ = pq.read_apkg_contents(apkg_path)
+    field_names = contents['model']['fields']
+    pushed = sorted(tuple(note['fields'][name] for name in field_names) for note in server.notes.values()
+                    if note['deck'] == contents['deck_name'])
+    built = sorted(tuple(fields) for _, fields, _ in contents['notes'])
+    return pushed == built and set(contents['media']) <= set(server.media)
+
+
+def import_apkg(server, apkg_path):
+    """Seeds the mock with a deck's notes, as importing the .apkg in Anki would."""
+    contents, _ = pq.read_apkg_contents(apkg_path)
+    server.models[contents['model']['name']] = {}
+    server.decks.add(contents['deck_name'])
+    for _, fields, tags in contents['notes']:
+        server.add_note({'deckName': contents['deck_name'], 'modelName': contents['model']['name'],
+                         'fields': dict(zip(contents['model']['fields'], fields)), 'tags': tags})
+    return len(contents['notes'])
+
+
+def bench_anki(language, line_count, edits, seed, settings):
+    """
+    Builds a deck, pushes it to a mock AnkiConnect server, pushes it again unchanged,
+    then edits some lines, rebuilds and pushes the changes. A second mock seeded as if
+    the deck and a copy of it under another name had been imported from their .apkg
+    files checks that existing notes are matched within their own deck only.
+    """
+    couplets = generate_couplets(language, line_count, seed)
+    deck_name = f"Benchmark {line_count}"
+    with tempfile.TemporaryDirectory() as output_dir:
+        success, message, _, apkg_path = pq.create_anki_deck(couplets, deck_name, settings, [], output_dir=output_dir)
+        if not success:
+            return {'error': message}
+        server = MockAnkiConnectServer()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        pushes = {'first': timed_push(server, apkg_path), 'unchanged': timed_push(server, apkg_path)}
+
+        pq.create_anki_deck(edit_couplets(couplets, edits, seed), deck_name, settings, [], output_dir=output_dir)
+        pushes['edited'] = timed_push(server, apkg_path)
+        in_sync = collection_matches(server, apkg_path)
+        apkg_bytes = os.path.getsize(apkg_path)
+        server.shutdown()
+        server.server_close()
+
+        # The copy shares every question with the deck, but not a single note GUID.
+        _, _, _, copy_path = pq.create_anki_deck(edit_couplets(couplets, edits, seed), f"{deck_name} copy",
+                                                 settings, [], output_dir=output_dir)
+        imported = MockAnkiConnectServer()
+        threading.Thread(target=imported.serve_forever, daemon=True).start()
+        note_count = import_apkg(imported, apkg_path) + import_apkg(imported, copy_path)
+        os.remove(pq.get_anki_sync_state_path(apkg_path))
+        pushes['after_import'] = timed_push(imported, apkg_path)
+        pushes['copy_after_import'] = timed_push(imported, copy_path)
+        imported_in_sync = (collection_matches(imported, apkg_path) and collection_matches(imported, copy_path)
+                            and len(imported.notes) == note_count)
+        imported.shutdown()
+        imported.server_close()
+    return {'lines': line_count, 'edits': edits, 'apkg_bytes': apkg_bytes, 'pushes': pushes,
+            'in_sync': in_sync, 'after_import_in_sync': imported_in_sync}
+
+
+# --- COMMAND LINE ---
+def add_corpus_arguments(parser):
+    parser.add_argument('--language', choices=LANGUAGES, default='mixed')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def add_engine_arguments(parser):
+    parser.add_argument('--geometry', choices=pq.GEOMETRY_ENGINES, default=pq.DEFAULT_ART_ENGINE['geometry'])
+    parser.add_argument('--composition', choices=pq.COMPOSITION_MODES,
+                        default=pq.DEFAULT_ART_ENGINE['composition'])
+    parser.add_argument('--svg', choices=pq.SVG_FORMATS, default=pq.DEFAULT_ART_ENGINE['svg'])
+    parser.add_argument('--svg-precision', type=int, default=pq.DEFAULT_ART_ENGINE['svg_precision'])
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Prisma Quaestionum benchmark and equivalence suite.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    corpus_parser = subparsers.add_parser('corpus', help="Write a synthetic couplet file.")
+    add_corpus_arguments(corpus_parser)
+    corpus_parser.add_argument('--lines', type=int, default=1000)
+    corpus_parser.add_argument('-o', '--output', required=True)
+
+    phases_parser = subparsers.add_parser('phases', help="Time each composition phase over a corpus of terms.")
+    add_corpus_arguments(phases_parser)
+    add_engine_arguments(phases_parser)
+    phases_parser.add_argument('--count', type=int, default=1000)
+    phases_parser.add_argument('--inputs', nargs='*', help="Use the cloze terms of these couplet files instead.")
+
+    deck_parser = subparsers.add_parser('deck', help="Time create_anki_deck end to end, including .apkg writing.")
+    add_corpus_arguments(deck_parser)
+    add_engine_arguments(deck_parser)
+    deck_parser.add_argument('--lines', type=int, nargs='+', default=[100, 1000, 10000])
+    deck_parser.add_argument('--svg-workers', type=int, default=1)
+    deck_parser.add_argument('--settings', default=pq.get_resource_path(pq.SETTINGS_FILE))
+
+    golden_parser = subparsers.add_parser('golden', help="Record or verify the hash of every generated SVG.")
+    golden_parser.add_argument('mode', choices=['write', 'check'])
+    golden_parser.add_argument('reference', help="Golden JSON file.")
+    add_corpus_arguments(golden_parser)
+    add_engine_arguments(golden_parser)
+    golden_parser.add_argument('--count', type=int, default=1000)
+    golden_parser.add_argument('--inputs', nargs='*', help="Use the cloze terms of these couplet files instead.")
+    golden_parser.add_argument('--tolerance', type=float, default=0.0,
+                               help="Accept images whose numbers all differ by at most this much.")
+
+    subparsers.add_parser('minify', help="Check the card template minifier against its golden cases.")
+
+    llm_parser = subparsers.add_parser('llm', help="Time concurrent prompt submission against a local stub server.")
+    llm_parser.add_argument('--prompts', type=int, default=40)
+    llm_parser.add_argument('--concurrency', type=int, nargs='+', default=[1, pq.LLM_CONCURRENCY, 8])
+    llm_parser.add_argument('--tokens', type=int, default=20, help="Couplets streamed per reply.")
+    llm_parser.add_argument('--token-delay', type=float, default=0.005)
+    llm_parser.add_argument('--fail-every', type=int, default=5,
+                            help="Answer the first attempt of every Nth prompt with HTTP 503 (0 disables).")
+    llm_parser.add_argument('--retry-delay', type=float, default=0.05)
+
+    anki_parser = subparsers.add_parser('anki', help="Time pushing a deck and its edits to a mock AnkiConnect server.")
+    add_corpus_arguments(anki_parser)
+    anki_parser.add_argument('--lines', type=int, default=2000)
+    anki_parser.add_argument('--edits', type=int, default=20, help="Lines whose cloze term is changed before the re-push.")
+    anki_parser.add_argument('--settings', default=pq.get_resource_path(pq.SETTINGS_FILE))
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'corpus':
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(generate_couplets(args.language, args.lines, args.seed))
+        result = {'output': args.output, 'lines': args.lines, 'language': args.language}
+
+    elif args.command == 'phases':
+        result = bench_phases(load_terms(args), get_art_engine(args))
+
+    elif args.command == 'deck':
+        settings, error = pq.compile_settings_file(args.settings)
+        if error:
+            sys.exit(error)
+        art_engine = get_art_engine(args)
+        result = {'art_engine': art_engine, 'svg_workers': args.svg_workers,
+                  'decks': [bench_deck(args.language, count, args.seed, art_engine, args.svg_workers, settings)
+                            for count in args.lines]}
+
+    elif args.command == 'minify':
+        result = check_minify_golden()
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return 0 if result['failed'] == 0 else 1
+
+    elif args.command == 'anki':
+        settings, error = pq.compile_settings_file(args.settings)
+        if error:
+            sys.exit(error)
+        result = bench_anki(args.language, args.lines, args.edits, args.seed, settings)
+
+    elif args.command == 'llm':
+        result = bench_llm(args.prompts, args.concurrency, args.tokens, args.token_delay, args.fail_every,
+                           args.retry_delay)
+
+    elif args.mode == 'write':
+        art_engine = get_art_engine(args)
+        fingerprints = render_fingerprints(load_terms(args), art_engine)
+        with open(args.reference, 'w', encoding='utf-8') as f:
+            json.dump({'art_engine': art_engine, 'art_config': pq.get_art_config_hash(art_engine),
+                       'terms': fingerprints}, f, ensure_ascii=False)
+        result = {'reference': args.reference, 'terms': len(fingerprints)}
+
+    else:
+        with open(args.reference, 'r', encoding='utf-8') as f:
+            reference = json.load(f)
+        art_engine = get_art_engine(args)
+        current = render_fingerprints(list(reference['terms']), art_engine)
+        result = compare_fingerprints(reference['terms'], current, args.tolerance)
+        result['reference_engine'] = reference['art_engine']
+        result['art_engine'] = art_engine
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return 0 if result['differing'] == 0 else 1
+
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))